@@ -0,0 +1,201 @@
+"""
+Admission control + fair queuing trước LLM call.
+
+vLLM chỉ xử lý hiệu quả ~max_num_seqs request cùng lúc; phần còn lại nằm trong
+queue của vLLM và đẩy latency của mọi người lên vài phút khi một script gửi dồn
+dập. AdmissionController giới hạn số LLM call đồng thời (LLM_MAX_CONCURRENCY),
+xếp hàng phần dư theo flow (group scope → principal.sub) và chia slot round-robin
+giữa các group, rồi giữa các principal trong group. Queue đầy / quá hạn →
+Overloaded (app trả 429 + Retry-After). Cache hit không đi qua đây.
+"""
+from __future__ import annotations
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() == "true"
+# ≈ --max-num-seqs của vLLM (tổng cho mọi replica mà gateway này dùng)
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "64"))
+# một principal không được chiếm cả queue
+ADMISSION_MAX_QUEUE_PER_PRINCIPAL = int(os.environ.get("ADMISSION_MAX_QUEUE_PER_PRINCIPAL", "8"))
+ADMISSION_QUEUE_TIMEOUT_SEC = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SEC", "30"))
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ("group", "sub", "event", "granted", "enqueued_at")
+
+    def __init__(self, group: str, sub: str):
+        self.group = group
+        self.sub = sub
+        self.event = threading.Event()
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+class Ticket:
+    """Slot LLM đã được cấp; dùng làm context manager hoặc gọi release()"""
+    def __init__(self, ctl: Optional["AdmissionController"], waited_ms: float):
+        self._ctl = ctl
+        self._started = time.monotonic()
+        self._released = False
+        self.waited_ms = waited_ms
+
+    def release(self):
+        if not self._released and self._ctl is not None:
+            self._released = True
+            self._ctl._release(time.monotonic() - self._started)
+
+    def __enter__(self) -> "Ticket":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_queue_per_principal: int = ADMISSION_MAX_QUEUE_PER_PRINCIPAL,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SEC, enabled: bool = ADMISSION_ENABLED):
+        self.enabled = enabled
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_queue_per_principal = max(1, max_queue_per_principal)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # group -> sub -> waiters (FIFO); thứ tự OrderedDict = vòng round-robin
+        self._flows: "OrderedDict[str, OrderedDict[str, Deque[_Waiter]]]" = OrderedDict()
+        self._queued = 0
+        self._per_sub: Dict[str, int] = {}
+        # EWMA thời gian một LLM call (giây) để ước lượng Retry-After
+        self._service_sec = 5.0
+        self._admitted = 0
+        self._queued_total = 0
+        self._rejected: Dict[str, int] = {"queue_full": 0, "principal_queue_full": 0, "timeout": 0}
+        self._waited = 0
+        self._wait_ms_max = 0.0
+        self._wait_ms_sum = 0.0
+
+    # ---------- public ----------
+    def acquire(self, sub: Optional[str], group: Optional[str]) -> Ticket:
+        """Chờ tới lượt (fair) hoặc raise Overloaded ngay khi queue đầy"""
+        if not self.enabled:
+            return Ticket(None, 0.0)
+        sub = sub or "anonymous"
+        group = group or "public"
+        with self._lock:
+            if self._in_flight < self.max_concurrency and not self._queued:
+                self._in_flight += 1
+                self._admitted += 1
+                return Ticket(self, 0.0)
+            if self._queued >= self.max_queue:
+                self._rejected["queue_full"] += 1
+                raise Overloaded("queue_full", self._retry_after())
+            if self._per_sub.get(sub, 0) >= self.max_queue_per_principal:
+                self._rejected["principal_queue_full"] += 1
+                raise Overloaded("principal_queue_full", self._retry_after())
+            w = _Waiter(group, sub)
+            self._flows.setdefault(group, OrderedDict()).setdefault(sub, deque()).append(w)
+            self._queued += 1
+            self._queued_total += 1
+            self._per_sub[sub] = self._per_sub.get(sub, 0) + 1
+
+        w.event.wait(self.queue_timeout)
+        with self._lock:
+            if not w.granted:
+                self._remove(w)
+                self._rejected["timeout"] += 1
+                raise Overloaded("timeout", self._retry_after())
+            waited = (time.monotonic() - w.enqueued_at) * 1000
+            self._waited += 1
+            self._wait_ms_sum += waited
+            self._wait_ms_max = max(self._wait_ms_max, waited)
+        return Ticket(self, waited)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            flows = {
+                g: {s: len(q) for s, q in subs.items()}
+                for g, subs in self._flows.items()
+            }
+            return {
+                "enabled": self.enabled,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "max_queue_per_principal": self.max_queue_per_principal,
+                "queue_timeout_sec": self.queue_timeout,
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "queued_by_flow": flows,
+                "admitted": self._admitted,
+                "queued_total": self._queued_total,
+                "rejected": dict(self._rejected),
+                "avg_queue_wait_ms": round(self._wait_ms_sum / self._waited, 1) if self._waited else 0.0,
+                "max_queue_wait_ms": round(self._wait_ms_max, 1),
+                "llm_service_sec_ewma": round(self._service_sec, 2),
+                "retry_after_sec": self._retry_after(),
+            }
+
+    # ---------- internal (gọi khi đang giữ _lock) ----------
+    def _retry_after(self) -> int:
+        # thời gian để xả hết queue hiện tại với max_concurrency slot
+        rounds = (self._queued + self._in_flight) / self.max_concurrency
+        return max(1, int(math.ceil(rounds * self._service_sec)))
+
+    def _remove(self, w: _Waiter):
+        subs = self._flows.get(w.group)
+        q = subs.get(w.sub) if subs else None
+        if q is None or w not in q:
+            return
+        q.remove(w)
+        self._queued -= 1
+        self._dec_sub(w.sub)
+        if not q:
+            del subs[w.sub]
+            if not subs:
+                del self._flows[w.group]
+
+    def _dec_sub(self, sub: str):
+        n = self._per_sub.get(sub, 0) - 1
+        if n > 0:
+            self._per_sub[sub] = n
+        else:
+            self._per_sub.pop(sub, None)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Round-robin: group đầu vòng → principal đầu vòng trong group; cả hai xoay về cuối"""
+        if not self._flows:
+            return None
+        group, subs = next(iter(self._flows.items()))
+        sub, q = next(iter(subs.items()))
+        w = q.popleft()
+        self._queued -= 1
+        self._dec_sub(sub)
+        if q:
+            subs.move_to_end(sub)
+        else:
+            del subs[sub]
+        if subs:
+            self._flows.move_to_end(group)
+        else:
+            del self._flows[group]
+        return w
+
+    def _release(self, service_sec: float):
+        with self._lock:
+            self._service_sec = 0.8 * self._service_sec + 0.2 * service_sec
+            # chuyển slot thẳng cho waiter kế tiếp (không để request mới chen ngang)
+            w = self._next_waiter()
+            if w is None:
+                self._in_flight -= 1
+                return
+            w.granted = True
+            self._admitted += 1
+            w.event.set()
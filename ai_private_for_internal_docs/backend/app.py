@@ -3,7 +3,7 @@ import os
 import time
 import uuid
 import json
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 from fastapi import FastAPI, Header, HTTPException, Query, Body, Request
@@ -11,11 +11,23 @@ from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
 
 from rag import RagConfig, RagStore
+from docstore import DOCSTORE_ENABLED, DOCSTORE_DB
 from cache import (
-    get_answer, set_answer, is_bad, mark_bad, delete_answer, delete_bad,
+    get_answer, set_answer, answer_key, is_bad, mark_bad, delete_answer, delete_bad,
     bump_corpus_version, corpus_version, recent_set, recent_get,
-    scan_keys, key_ttl, get_json, delete_key, parse_cache_key, ping
+    scan_keys, key_ttl, get_json, put_json, delete_key, parse_cache_key, ping,
+    value_format, train_codec_dict, corpus_groups, refresh_corpus_groups,
+    group_versions, bump_group_version, PUBLIC_GROUP,
+    invalidate_sources, invalidation_log,
+    track_question, popular_questions, enqueue_prewarm, prewarm_status,
+    prewarm_queue_length, pending_group_versions,
+    get_retrieval, set_retrieval, get_query_embedding, set_query_embedding,
+    conversation_fingerprint, get_conversation_hits, set_conversation_hits,
+    start_background as start_cache_background
 )
+from prewarm import Prewarmer, PREWARM_ENABLED
+from admission import AdmissionController, Overloaded, LLM_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE
+from llm_router import LLMRouter, LLMError, LLMUnavailable, LLM_FALLBACK_CACHE_TTL_SEC
 
 # v3: OIDC support
 try:
@@ -33,17 +45,60 @@ ADMIN_GROUP = os.environ.get("ADMIN_GROUP", "RAG-ADMINS")
 app = FastAPI(title="Private RAG Gateway")
 
 cfg = RagConfig(
-    qdrant_url=os.environ["QDRANT_URL"],
+    qdrant_url=os.environ.get("QDRANT_URL", "http://qdrant:6333"),
     collection=os.environ.get("QDRANT_COLLECTION", "internal_docs"),
     embed_model=os.environ.get("EMBED_MODEL", "sentence-transformers/bge-m3"),
     chunk_size=int(os.environ.get("CHUNK_SIZE", "900")),
     chunk_overlap=int(os.environ.get("CHUNK_OVERLAP", "150")),
     top_k=int(os.environ.get("TOP_K", "6")),
+    embed_url=os.environ.get("EMBED_SERVER_URL", ""),
+    query_batch_wait_ms=float(os.environ.get("QUERY_BATCH_WAIT_MS", "3")),
+    query_batch_max=int(os.environ.get("QUERY_BATCH_MAX", "32")),
+    min_score=float(os.environ.get("RETRIEVAL_MIN_SCORE", "0.35")),
+    max_score_gap=float(os.environ.get("RETRIEVAL_MAX_SCORE_GAP", "0.3")),
+    max_context_chars=int(os.environ.get("RETRIEVAL_MAX_CONTEXT_CHARS", "6000")),
+    min_k=int(os.environ.get("RETRIEVAL_MIN_K", "1")),
+    docstore_path=DOCSTORE_DB if DOCSTORE_ENABLED else "",
+    content_ids=os.environ.get("CONTENT_ADDRESSED_CHUNKS", "false").lower() in ("1", "true", "yes"),
+    vector_backend=os.environ.get("VECTOR_BACKEND", "qdrant"),
+    local_index_path=os.environ.get("LOCAL_INDEX_PATH", ""),
+    local_index_dtype=os.environ.get("LOCAL_INDEX_DTYPE", "float32"),
 )
 store = RagStore(cfg)
+admission = AdmissionController()
+
+@app.on_event("startup")
+def _start_cache_background():
+    # invalidation listener + build Bloom filter bad:* ở thread nền trước request đầu tiên
+    start_cache_background()
+
+@app.on_event("startup")
+def _size_threadpool():
+    # request đang xếp hàng admission giữ một thread (sync endpoint) → nới thread pool
+    # để cache hit / admin không phải chờ sau queue LLM
+    import anyio.to_thread
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, LLM_MAX_CONCURRENCY + ADMISSION_MAX_QUEUE + 40)
+
+def refresh_scope_groups():
+    """Rebuild corpus doc_group set từ Qdrant (dùng cho scope-normalized cache keys)"""
+    try:
+        n = refresh_corpus_groups(store.doc_groups())
+        print(f"[CACHE] corpus groups refreshed: {n}")
+    except Exception as e:
+        # tập cũ vẫn là superset (ingest chỉ thêm) → key vẫn đúng, chỉ share ít hơn
+        print(f"[WARN] corpus groups refresh failed: {e}")
+
+try:
+    if corpus_groups() is None:
+        refresh_scope_groups()
+except Exception as e:
+    print(f"[WARN] corpus groups unavailable: {e}")
 
 LLM_BASE_URL = os.environ["LLM_BASE_URL"].rstrip("/")
 LLM_MODEL = os.environ.get("LLM_MODEL", "")
+# pool backend (LLM_BACKENDS + LLM_FALLBACK_URL); mặc định chỉ LLM_BASE_URL
+llm_router = LLMRouter.from_env(LLM_BASE_URL)
 
 class ChatMsg(BaseModel):
     role: str
@@ -85,6 +140,11 @@ def last_user_message(messages: List[ChatMsg]) -> str:
             return m.content
     return messages[-1].content if messages else ""
 
+def prior_turns(messages: List[ChatMsg]) -> List[Tuple[str, str]]:
+    """Các lượt user/assistant trước câu hỏi cuối (system prompt của client không tính)"""
+    last = max((i for i, m in enumerate(messages) if m.role == "user"), default=len(messages) - 1)
+    return [(m.role, m.content) for m in messages[:last] if m.role in ("user", "assistant")]
+
 def build_system_prompt(context_chunks: List[Dict[str, Any]]) -> str:
     # Force citations with page numbers + strict JSON output
     parts = [
@@ -113,13 +173,14 @@ def build_system_prompt(context_chunks: List[Dict[str, Any]]) -> str:
 
 @app.get("/healthz")
 def healthz():
-    redis_ok = cache.ping()
+    redis_ok = ping()
     return {"ok": True, "redis": redis_ok}
 
 @app.post("/admin/ingest")
 def admin_ingest(
     authorization: str | None = Header(default=None),
     path: str | None = Query(default=None, description="relative to /app/docs or absolute path inside container"),
+    resume: bool = Query(default=False, description="tiếp tục run ingest dang dở gần nhất (checkpoint)"),
 ):
     principal = require_auth(authorization)
     
@@ -138,19 +199,187 @@ def admin_ingest(
     cmd = ["python", "ingest.py"]
     if path:
         cmd.append(path)
+    if resume:
+        cmd.append("--resume")
 
     p = subprocess.run(cmd, capture_output=True, text=True)
     if p.returncode != 0:
         raise HTTPException(status_code=500, detail=p.stderr[-2000:])
     
-    # Increment corpus version to invalidate all caches
-    new_version = cache.bump_corpus_version()
+    # ingest.py đã bump version của các doc_group vừa ingest → chỉ cache của các scope đó bị invalidate
+    refresh_scope_groups()
     
     return {
         "ok": True, 
         "output": p.stdout[-4000:],
-        "corpus_version": new_version
+        "corpus_version": corpus_version(),
+        "group_versions": group_versions(),
+    }
+
+def retrieve(query: str, allowed_groups: List[str], versions: Optional[Dict[str, int]] = None,
+             top_k: Optional[int] = None) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Hit list cho query, qua retrieval cache (normalized query + scope + corpus version).
+    -> (hits, "hit" | "embedding" | "miss"); "embedding" = chỉ embedding có trong cache.
+    """
+    hits = get_retrieval(query, allowed_groups, versions=versions, top_k=top_k)
+    if hits is not None:
+        return hits, "hit"
+    qv = get_query_embedding(query, cfg.embed_model)
+    status = "embedding" if qv is not None else "miss"
+    if qv is None:
+        qv = store.embed_query(query)
+        set_query_embedding(query, cfg.embed_model, qv)
+    hits = store.search(query, top_k=top_k, allowed_groups=allowed_groups if allowed_groups else None, query_vector=qv)
+    set_retrieval(query, allowed_groups, hits, versions=versions, top_k=top_k)
+    return hits, status
+
+# Multi-turn: follow-up dùng lại hit list của các lượt trước, chỉ search thêm vài hit mới
+CONV_FOLLOWUP_K = int(os.environ.get("CONV_FOLLOWUP_K", "3"))
+CONV_MAX_HITS = int(os.environ.get("CONV_MAX_HITS", "8"))
+
+def _hit_id(h: Dict[str, Any]) -> Tuple[Any, Any, Any]:
+    return h.get("source"), h.get("page_number"), h.get("chunk_index")
+
+def retrieve_turn(query: str, history: List[str], allowed_groups: List[str],
+                  versions: Optional[Dict[str, int]] = None) -> Tuple[List[Dict[str, Any]], str, Dict[str, Any]]:
+    """
+    history: các câu hỏi user trước câu hỏi hiện tại.
+    -> (hits, retrieval cache status, thông tin reuse cho rag_meta)
+    """
+    if not history:
+        hits, status = retrieve(query, allowed_groups, versions)
+        return hits, status, {"turn": 1}
+    # lượt 1 không ghi conv:* riêng: hit list của nó chính là retrieval cache của câu hỏi đó
+    if len(history) == 1:
+        prior = get_retrieval(history[0], allowed_groups, versions=versions)
+    else:
+        prior = get_conversation_hits(allowed_groups, history, versions)
+    # follow-up thường thiếu chủ ngữ ("còn trường hợp thử việc thì sao?") → search kèm câu hỏi trước
+    search_q = f"{history[-1]}\n{query}"
+    if prior is None:
+        hits, status = retrieve(search_q, allowed_groups, versions)
+        info = {"turn": len(history) + 1, "reused": 0, "added": len(hits)}
+    else:
+        new, status = retrieve(search_q, allowed_groups, versions, top_k=CONV_FOLLOWUP_K)
+        seen = {_hit_id(h) for h in prior}
+        added = [h for h in new if _hit_id(h) not in seen][:CONV_MAX_HITS]
+        hits = (added + prior)[:CONV_MAX_HITS]
+        info = {"turn": len(history) + 1, "reused": len(hits) - len(added), "added": len(added)}
+    set_conversation_hits(allowed_groups, history + [query], hits, versions)
+    return hits, status, info
+
+def admission_flow(principal: Optional[Dict[str, Any]], allowed_groups: List[str]) -> Tuple[str, str]:
+    """(principal.sub, group scope) cho fair queuing"""
+    sub = (principal or {}).get("sub") or (principal or {}).get("email") or "anonymous"
+    group = ",".join(sorted(allowed_groups)) if allowed_groups else PUBLIC_GROUP
+    return sub, group
+
+def rag_answer(req: ChatReq, query: str, allowed_groups: List[str], rid: str, t0: float,
+               versions: Optional[Dict[str, int]] = None, flow: Tuple[str, str] = ("anonymous", PUBLIC_GROUP)) -> Dict[str, Any]:
+    """Retrieve + LLM call, trả về OpenAI response kèm rag_meta (chưa có cache info)"""
+    # admission trước cả retrieval: queue đầy → 429 ngay, không tốn embed/search
+    try:
+        ticket = admission.acquire(*flow)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"LLM busy ({e.reason}), retry after {e.retry_after}s",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    with ticket:
+        return _rag_answer(req, query, allowed_groups, rid, t0, versions, ticket.waited_ms)
+
+def _rag_answer(req: ChatReq, query: str, allowed_groups: List[str], rid: str, t0: float,
+                versions: Optional[Dict[str, int]], queue_wait_ms: float) -> Dict[str, Any]:
+    history = [c for role, c in prior_turns(req.messages) if role == "user"]
+    candidates, retrieval_status, conversation = retrieve_turn(query, history, allowed_groups, versions)
+    # cắt sau retrieval cache: cache giữ đủ top_k candidate, đổi ngưỡng không cần flush
+    hits, k_selection = store.select_context(candidates)
+    system_prompt = build_system_prompt(hits)
+
+    payload = {
+        "model": (req.model or LLM_MODEL),
+        "messages": [{"role": "system", "content": system_prompt}]
+                    + [{"role": m.role, "content": m.content} for m in req.messages],
+        "temperature": req.temperature,
+        "top_p": req.top_p,
+        "max_tokens": req.max_tokens,
+    }
+
+    try:
+        data, backend = llm_router.chat(payload)
+    except LLMUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except LLMError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
+
+    # Add minimal timing info for debugging with page numbers
+    data["rag_meta"] = {
+        "request_id": rid,
+        "feedback_url": f"/api/feedback/ui?request_id={rid}",
+        "retrieved": [
+            {
+                "source": h["source"],
+                "page_number": h.get("page_number"),
+                "chunk_index": h.get("chunk_index"),
+                "score": h["score"],
+                "doc_group": h.get("doc_group"),
+            }
+            for h in hits
+        ],
+        "k": k_selection["k"],
+        "k_selection": k_selection,
+        "retrieval_cache": retrieval_status,
+        "conversation": conversation,
+        "queue_wait_ms": int(queue_wait_ms),
+        "llm_backend": backend,
+        "latency_ms": int((time.time() - t0) * 1000),
     }
+    return data
+
+def attach_user(data: Dict[str, Any], principal: Optional[Dict[str, Any]]):
+    """
+    rag_meta.user (email + toàn bộ AD groups) của request hiện tại. Không bao giờ nằm trong
+    ans:* — một entry dùng chung cho mọi user cùng groups ∩ corpus groups — nên thêm theo
+    từng request trên cả đường hit lẫn miss (entry cũ còn "user" của người khác thì bỏ đi).
+    """
+    data["rag_meta"].pop("user", None)
+    if OIDC_ENABLED and principal:
+        data["rag_meta"]["user"] = {
+            "email": principal.get("email"),
+            "groups": principal.get("groups", []),
+        }
+
+def store_answer(question: str, groups: List[str], data: Dict[str, Any],
+                 versions: Optional[Dict[str, int]] = None, conv: str = "") -> Optional[str]:
+    """
+    set_answer theo backend đã trả lời: answer của fallback (primary bận / bị eject) chỉ
+    cache LLM_FALLBACK_CACHE_TTL_SEC giây, hoặc không cache khi = 0. Ghi lựa chọn vào rag_meta.cache.
+    Không ghi field theo principal (xem attach_user).
+    """
+    meta = data["rag_meta"]
+    meta.pop("user", None)
+    fallback = bool((meta.get("llm_backend") or {}).get("fallback"))
+    ttl_sec = LLM_FALLBACK_CACHE_TTL_SEC if fallback else None
+    meta["cache"]["stored"] = not (fallback and ttl_sec <= 0)
+    if fallback:
+        meta["cache"]["ttl_sec"] = max(0, ttl_sec)
+    if not meta["cache"]["stored"]:
+        return None
+    return set_answer(question, groups, data, versions=versions, conv=conv, ttl_sec=ttl_sec)
+
+def prewarm_answer(question: str, groups: List[str], versions: Dict[str, int]) -> Optional[str]:
+    """Pre-warm một câu hỏi phổ biến vào key của versions (pending) → cache key, None nếu không cache"""
+    rid = "pw-" + str(uuid.uuid4())[:8]
+    req = ChatReq(messages=[ChatMsg(role="user", content=question)])
+    data = rag_answer(req, question, groups, rid, time.time(), versions=versions, flow=("prewarm", "prewarm"))
+    data["rag_meta"]["cache"] = {"hit": False, "bypassed": False, "type": "prewarm"}
+    return store_answer(question, groups, data, versions=versions)
+
+prewarmer = Prewarmer(prewarm_answer)
+if PREWARM_ENABLED:
+    prewarmer.start()
 
 @app.post("/v1/chat/completions")
 def chat_completions(req: ChatReq, authorization: str | None = Header(default=None)):
@@ -159,18 +388,27 @@ def chat_completions(req: ChatReq, authorization: str | None = Header(default=No
     t0 = time.time()
 
     query = last_user_message(req.messages)
+    # multi-turn: cùng câu follow-up ở hội thoại khác → cache key khác
+    conv = conversation_fingerprint(prior_turns(req.messages))
     
     # v3: Group-based filtering
     allowed_groups = []
     if OIDC_ENABLED and principal:
         allowed_groups = principal.get("groups", [])
     
+    # popularity (decayed) cho post-ingest pre-warm (chỉ câu hỏi mở đầu hội thoại)
+    if not conv:
+        try:
+            track_question(query, allowed_groups)
+        except Exception as e:
+            print(f"[WARN] track_question failed: {e}")
+    
     # 1️⃣ Check if marked as bad → bypass cache
-    bypass = is_bad(query, allowed_groups)
+    bypass = is_bad(query, allowed_groups, conv=conv)
     
     # 2️⃣ Try to get cached answer (if not bypassed)
     if not bypass:
-        cached = get_answer(query, allowed_groups)
+        cached = get_answer(query, allowed_groups, conv=conv)
         if cached:
             # Return cached response with cache metadata
             cached["rag_meta"] = cached.get("rag_meta", {})
@@ -181,72 +419,38 @@ def chat_completions(req: ChatReq, authorization: str | None = Header(default=No
             }
             cached["rag_meta"]["request_id"] = rid
             cached["rag_meta"]["feedback_url"] = f"/api/feedback/ui?request_id={rid}"
+            attach_user(cached, principal)
             
             # Store recent request for feedback tracking
             recent_set(rid, {
                 "question": query,
                 "groups": allowed_groups,
+                "conv": conv,
                 "principal_sub": principal.get("sub") if principal else None,
                 "principal_email": principal.get("email") if principal else None,
                 "response": cached,
                 "cached": True
-            })
+            }, answer_key=answer_key(query, allowed_groups, conv=conv))
             
             return cached
     
     # 3️⃣ Cache miss or bypassed → call RAG + LLM
-    hits = store.search(query, allowed_groups=allowed_groups if allowed_groups else None)
-    system_prompt = build_system_prompt(hits)
-
-    payload = {
-        "model": (req.model or LLM_MODEL),
-        "messages": [{"role": "system", "content": system_prompt}]
-                    + [{"role": m.role, "content": m.content} for m in req.messages],
-        "temperature": req.temperature,
-        "top_p": req.top_p,
-        "max_tokens": req.max_tokens,
-    }
-
-    r = requests.post(f"{LLM_BASE_URL}/chat/completions", json=payload, timeout=120)
-    if r.status_code >= 400:
-        raise HTTPException(status_code=502, detail=f"LLM error {r.status_code}: {r.text[:500]}")
-
-    data = r.json()
-    # Add minimal timing info for debugging with page numbers
-    data["rag_meta"] = {
-        "request_id": rid,
-        "feedback_url": f"/api/feedback/ui?request_id={rid}",
-        "retrieved": [
-            {
-                "source": h["source"],
-                "page_number": h.get("page_number"),
-                "chunk_index": h.get("chunk_index"),
-                "score": h["score"],
-                "doc_group": h.get("doc_group"),
-            }
-            for h in hits
-        ],
-        "latency_ms": int((time.time() - t0) * 1000),
-        "cache": {"hit": False, "bypassed": bypass, "type": "default"}
-    }
-    
-    # v3: Add user identity to metadata if OIDC
-    if OIDC_ENABLED and principal:
-        data["rag_meta"]["user"] = {
-            "email": principal.get("email"),
-            "groups": principal.get("groups", []),
-        }
+    data = rag_answer(req, query, allowed_groups, rid, t0, flow=admission_flow(principal, allowed_groups))
+    data["rag_meta"]["cache"] = {"hit": False, "bypassed": bypass, "type": "default"}
     
     # 4️⃣ Store in cache and recent tracking
-    set_answer(query, allowed_groups, data)
+    key = store_answer(query, allowed_groups, data, conv=conv)
+    # v3: user identity chỉ thêm sau khi đã ghi cache
+    attach_user(data, principal)
     recent_set(rid, {
         "question": query,
         "groups": allowed_groups,
+        "conv": conv,
         "principal_sub": principal.get("sub") if principal else None,
         "principal_email": principal.get("email") if principal else None,
         "response": data,
         "cached": False
-    })
+    }, answer_key=key)
     
     return data
 
@@ -374,13 +578,13 @@ async def feedback_bad(request: Request, authorization: str | None = Header(defa
     rec = recent_get(request_id)
     if not rec:
         return HTMLResponse(
-            \"\"\"
+            """
             <html><body style="font-family: Arial; margin:40px;">
               <h3>❌ Request ID không tồn tại hoặc đã hết hạn</h3>
               <p>Request chỉ được lưu trong 24 giờ.</p>
               <a href="/">← Quay lại</a>
             </body></html>
-            \"\"\",
+            """,
             status_code=404
         )
     
@@ -391,28 +595,28 @@ async def feedback_bad(request: Request, authorization: str | None = Header(defa
     
     if sorted(rec.get("groups", [])) != sorted(current_groups):
         return HTMLResponse(
-            \"\"\"
+            """
             <html><body style="font-family: Arial; margin:40px;">
               <h3>🚫 Không thể report: scope quyền không khớp</h3>
               <p>Bạn chỉ có thể report feedback cho các câu hỏi trong nhóm quyền của bạn.</p>
               <a href="/">← Quay lại</a>
             </body></html>
-            \"\"\",
+            """,
             status_code=403
         )
     
     # Mark as bad and delete cache
-    mark_bad(rec["question"], rec["groups"], reason=reason)
-    delete_answer(rec["question"], rec["groups"])
+    mark_bad(rec["question"], rec["groups"], reason=reason, conv=rec.get("conv", ""))
+    delete_answer(rec["question"], rec["groups"], conv=rec.get("conv", ""))
     
     return HTMLResponse(
-        \"\"\"
+        """
         <html><body style="font-family: Arial; margin:40px;">
           <h3>✅ Đã ghi nhận phản hồi</h3>
           <p>Lần sau hệ thống sẽ bỏ qua cache cho câu hỏi này và generate lại.</p>
           <a href="/">← Quay lại</a>
         </body></html>
-        \"\"\"
+        """
     )
 
 
@@ -437,6 +641,166 @@ def admin_cache_stats(
     return cache_stats()
 
 
+@app.post("/admin/cache/train_dict")
+def admin_cache_train_dict(
+    authorization: str | None = Header(default=None),
+    samples: int = Query(default=2000, ge=16, le=20000),
+):
+    """
+    Train zstd dictionary cho compact codec từ các ans:*/recent:* hiện có (admin only).
+    Các giá trị ghi sau đó dùng dictionary mới; giá trị cũ vẫn đọc được.
+    """
+    principal = require_auth(authorization)
+    
+    if OIDC_ENABLED and principal:
+        if ADMIN_GROUP not in principal.get("groups", []):
+            raise HTTPException(
+                status_code=403, 
+                detail=f"Forbidden: {ADMIN_GROUP} group required"
+            )
+    
+    res = train_codec_dict(sample_limit=samples)
+    if not res:
+        raise HTTPException(status_code=409, detail="Not enough samples or codec disabled")
+    return {"ok": True, **res}
+
+
+@app.get("/admin/cache/invalidations")
+def admin_cache_invalidations(
+    authorization: str | None = Header(default=None),
+    limit: int = Query(default=50, ge=1, le=200),
+):
+    """
+    Recent source-level invalidations (admin only) - JSON API.
+    Mỗi entry: số answer bị xoá theo từng source.
+    """
+    principal = require_auth(authorization)
+    
+    if OIDC_ENABLED and principal:
+        if ADMIN_GROUP not in principal.get("groups", []):
+            raise HTTPException(
+                status_code=403, 
+                detail=f"Forbidden: {ADMIN_GROUP} group required"
+            )
+    
+    return {"invalidations": invalidation_log(limit)}
+
+
+@app.post("/admin/cache/invalidate_source")
+def admin_cache_invalidate_source(
+    authorization: str | None = Header(default=None),
+    source: str = Query(..., description="source path như trong rag_meta.retrieved, vd /app/docs/HR/handbook.pdf"),
+):
+    """
+    Xoá mọi cached answer đã retrieve từ một source (admin only), không bump version.
+    """
+    principal = require_auth(authorization)
+    
+    if OIDC_ENABLED and principal:
+        if ADMIN_GROUP not in principal.get("groups", []):
+            raise HTTPException(
+                status_code=403, 
+                detail=f"Forbidden: {ADMIN_GROUP} group required"
+            )
+    
+    return invalidate_sources([source], reason="admin")
+
+
+@app.get("/admin/admission/stats")
+def admin_admission_stats(
+    authorization: str | None = Header(default=None),
+):
+    """
+    Admission control của worker này (admin only) - JSON API.
+    in-flight / queued theo flow (group → principal), số 429 theo lý do, queue wait.
+    """
+    principal = require_auth(authorization)
+    
+    if OIDC_ENABLED and principal:
+        if ADMIN_GROUP not in principal.get("groups", []):
+            raise HTTPException(
+                status_code=403, 
+                detail=f"Forbidden: {ADMIN_GROUP} group required"
+            )
+    
+    return admission.stats()
+
+
+@app.get("/admin/llm/backends")
+def admin_llm_backends(
+    authorization: str | None = Header(default=None),
+):
+    """
+    Trạng thái LLM router (admin only) - JSON API.
+    outstanding, EWMA latency, circuit breaker state của từng backend + fallback.
+    """
+    principal = require_auth(authorization)
+    
+    if OIDC_ENABLED and principal:
+        if ADMIN_GROUP not in principal.get("groups", []):
+            raise HTTPException(
+                status_code=403, 
+                detail=f"Forbidden: {ADMIN_GROUP} group required"
+            )
+    
+    return llm_router.stats()
+
+
+@app.get("/admin/embed/stats")
+def admin_embed_stats(
+    authorization: str | None = Header(default=None),
+):
+    """
+    Query-embedding micro-batching metrics của worker này (admin only) - JSON API.
+    batch size histogram + queue delay (ms chờ trong cửa sổ gom batch).
+    """
+    principal = require_auth(authorization)
+    
+    if OIDC_ENABLED and principal:
+        if ADMIN_GROUP not in principal.get("groups", []):
+            raise HTTPException(
+                status_code=403, 
+                detail=f"Forbidden: {ADMIN_GROUP} group required"
+            )
+    
+    out: Dict[str, Any] = {
+        "micro_batching": store.query_batcher.stats() if store.query_batcher else None,
+        "embed_server": cfg.embed_url or None,
+    }
+    if cfg.embed_url:
+        try:
+            out["embed_server_stats"] = requests.get(f"{cfg.embed_url.rstrip('/')}/stats", timeout=5).json()
+        except Exception as e:
+            out["embed_server_stats"] = {"error": str(e)}
+    return out
+
+
+@app.get("/admin/prewarm/status")
+def admin_prewarm_status(
+    authorization: str | None = Header(default=None),
+    top: int = Query(default=20, ge=0, le=500),
+):
+    """
+    Trạng thái post-ingest pre-warm (admin only) - JSON API.
+    """
+    principal = require_auth(authorization)
+    
+    if OIDC_ENABLED and principal:
+        if ADMIN_GROUP not in principal.get("groups", []):
+            raise HTTPException(
+                status_code=403, 
+                detail=f"Forbidden: {ADMIN_GROUP} group required"
+            )
+    
+    return {
+        "enabled": PREWARM_ENABLED,
+        "status": prewarm_status(),
+        "queued_jobs": prewarm_queue_length(),
+        "pending_versions": pending_group_versions(),
+        "popular": popular_questions(top) if top else [],
+    }
+
+
 # ========= Admin UI Endpoints =========
 
 def require_admin(principal: dict):
@@ -456,6 +820,7 @@ def admin_ui(authorization: str | None = Header(default=None), limit: int = 100)
 
     ttl_days = int(os.environ.get("DEFAULT_CACHE_TTL_DAYS", "30"))
     cv = corpus_version()
+    gv = group_versions()
 
     bad_keys = scan_keys("bad:*", limit=limit)
     ans_keys = scan_keys("ans:*", limit=limit)
@@ -477,6 +842,37 @@ def admin_ui(authorization: str | None = Header(default=None), limit: int = 100)
             {extra}
         </li>"""
 
+    import html
+    group_list = "\n".join(
+        f"<li style='margin: 4px 0;'><code>{html.escape(g)}</code> = <strong>{v}</strong></li>"
+        for g, v in sorted(gv.items())
+    ) or "<li style='color: #999;'>(none)</li>"
+    group_options = "".join(f"<option value='{html.escape(g)}'></option>" for g in sorted(set(gv) | {PUBLIC_GROUP}))
+
+    def inv_li(e: Dict[str, Any]) -> str:
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e.get("ts", 0)))
+        per_src = ", ".join(
+            f"<code>{html.escape(src)}</code>: {n}" for src, n in list((e.get("by_source") or {}).items())[:10]
+        )
+        return f"""<li style="margin: 8px 0;">
+            <strong>{ts}</strong> ({html.escape(str(e.get("reason")))}) —
+            removed <strong>{e.get("removed", 0)}</strong> answers from {e.get("sources", 0)} source(s)
+            <div style="color: #666; font-size: 13px;">{per_src}</div>
+        </li>"""
+
+    inv_list = "\n".join(inv_li(e) for e in invalidation_log(20)) or "<li style='color: #999;'>(none)</li>"
+
+    pw = prewarm_status()
+    pw_total = pw.get("total") or 0
+    pw_pct = int(100 * (pw.get("done", 0) + pw.get("skipped", 0) + pw.get("failed", 0)) / pw_total) if pw_total else 0
+    pw_state = "disabled (PREWARM_ENABLED=false)" if not PREWARM_ENABLED else pw.get("state", "idle")
+    pw_pending = ", ".join(f"<code>{html.escape(g)}</code> → {v}" for g, v in sorted(pending_group_versions().items())) or "(none)"
+    pop_list = "\n".join(
+        f"<li style='margin: 4px 0;'><strong>{p['score']}</strong> — {html.escape(p['question'][:200])} "
+        f"<span style='color: #666;'>[{html.escape(', '.join(p['groups']) or 'public')}]</span></li>"
+        for p in popular_questions(20)
+    ) or "<li style='color: #999;'>(none)</li>"
+
     bad_list = "\n".join([li(k) for k in bad_keys]) or "<li style='color: #999;'>(none)</li>"
     ans_list = "\n".join([li(k) for k in ans_keys]) or "<li style='color: #999;'>(none)</li>"
 
@@ -581,6 +977,38 @@ def admin_ui(authorization: str | None = Header(default=None), limit: int = 100)
             <button type="submit" class="danger">🔄 Bump corpus_version (invalidate all caches)</button>
           </form>
 
+          <h3>🗂️ Group Versions</h3>
+          <p>Ingest một folder chỉ bump version của group đó; cache của các scope khác giữ nguyên.</p>
+          <ul>{group_list}</ul>
+          <form method="post" action="/api/admin/bump">
+            <input type="text" name="group" list="group-names" placeholder="doc_group, vd OPS-TEAM" required
+                   style="padding: 9px; border: 1px solid #ddd; border-radius: 4px; width: 260px;" />
+            <datalist id="group-names">{group_options}</datalist>
+            <button type="submit">🔄 Bump group version</button>
+          </form>
+
+          <hr/>
+
+          <h3>🧹 Selective invalidations (source → answers)</h3>
+          <p>Re-ingest một file chỉ xoá các answer đã retrieve chunk từ file đó.</p>
+          <ul>{inv_list}</ul>
+
+          <hr/>
+
+          <h3>🔥 Cache pre-warm</h3>
+          <p>Sau ingest, top câu hỏi phổ biến bị ảnh hưởng được trả lời lại trước khi version mới có hiệu lực.</p>
+          <div class="info">
+            <strong>State:</strong> {html.escape(str(pw_state))} |
+            <strong>Progress:</strong> {pw.get("done", 0)}/{pw_total} ({pw_pct}%), skipped {pw.get("skipped", 0)}, failed {pw.get("failed", 0)} |
+            <strong>Queued jobs:</strong> {prewarm_queue_length()}<br/>
+            <strong>Pending versions:</strong> {pw_pending}
+          </div>
+          <form method="post" action="/api/admin/prewarm">
+            <button type="submit">🔥 Pre-warm popular questions now</button>
+          </form>
+          <p>Top questions (decayed count):</p>
+          <ul>{pop_list}</ul>
+
           <hr/>
 
           <h3>🚫 Bad marks (reported by users)</h3>
@@ -596,7 +1024,7 @@ def admin_ui(authorization: str | None = Header(default=None), limit: int = 100)
           <hr/>
           
           <p style="color: #666; font-size: 14px;">
-            💡 <strong>Tip:</strong> Cache keys include corpus_version. Bumping version makes old caches naturally ignored.
+            💡 <strong>Tip:</strong> Cache keys include corpus_version + version của các group trong scope. Bumping version makes old caches naturally ignored.
           </p>
         </div>
       </body>
@@ -628,9 +1056,10 @@ def admin_view(key: str, authorization: str | None = Header(default=None)):
         <div style="background: #f8f9fa; padding: 12px; border-radius: 4px; margin: 15px 0;">
           <strong>Key Structure:</strong><br/>
           Type: <code>{key_type}</code><br/>
-          Corpus Version: <code>{ver}</code><br/>
-          Groups Hash: <code>{ghash}</code><br/>
-          Question Hash: <code>{qhash}</code>
+          Scope Version: <code>{ver}</code><br/>
+          Scope Hash: <code>{ghash}</code><br/>
+          Question Hash: <code>{qhash}</code><br/>
+          Storage Format: <code>{value_format(key)}</code>
         </div>
         """
 
@@ -753,12 +1182,27 @@ def admin_delete(key: str, authorization: str | None = Header(default=None)):
 async def admin_bump(request: Request, authorization: str | None = Header(default=None)):
     """
     Bump corpus version (admin only).
-    This invalidates all existing caches.
+    Form field `group` (optional): chỉ bump version của một doc_group
+    (PUBLIC_GROUP = docs không có group) → chỉ invalidate cache của các scope chứa group đó.
+    Không có `group`: bump global, invalidate all caches.
     """
     principal = require_auth(authorization)
     require_admin(principal)
 
-    new_v = bump_corpus_version()
+    import html
+    form = await request.form()
+    group = str(form.get("group", "")).strip()
+
+    if group:
+        new_v = bump_group_version(None if group == PUBLIC_GROUP else group)
+        title = f"Group version bumped: <code>{html.escape(group)}</code>"
+        note = f"Chỉ cache của các scope có quyền trên <code>{html.escape(group)}</code> (và scope không filter) bị invalidate."
+    else:
+        new_v = bump_corpus_version()
+        refresh_scope_groups()
+        title = "Corpus version bumped"
+        note = f"All old caches (with version {new_v - 1}) are now invalid and won't be used."
+
     return HTMLResponse(f"""
       <!DOCTYPE html>
       <html>
@@ -799,10 +1243,10 @@ async def admin_bump(request: Request, authorization: str | None = Header(defaul
         </head>
         <body>
           <div class="card">
-            <h3>✅ Corpus version bumped</h3>
-            <p>New corpus_version = <strong style="font-size: 28px; color: #007bff;">{new_v}</strong></p>
+            <h3>✅ {title}</h3>
+            <p>New version = <strong style="font-size: 28px; color: #007bff;">{new_v}</strong></p>
             <div class="warning">
-              ⚠️ All old caches (with version {new_v - 1}) are now invalid and won't be used.
+              ⚠️ {note}
             </div>
             <p><a href="/api/admin/ui">← Back to admin panel</a></p>
           </div>
@@ -811,6 +1255,61 @@ async def admin_bump(request: Request, authorization: str | None = Header(defaul
     """)
 
 
+@app.post("/admin/prewarm", response_class=HTMLResponse)
+def admin_prewarm(authorization: str | None = Header(default=None)):
+    """
+    Enqueue pre-warm thủ công (admin only): trả lời lại các câu hỏi phổ biến
+    hiện không có trong cache, kèm commit pending versions nếu có.
+    """
+    principal = require_auth(authorization)
+    require_admin(principal)
+
+    enqueue_prewarm({"manual": True, "by": principal.get("email") or principal.get("sub")})
+    note = "Job đã được đưa vào hàng đợi." if PREWARM_ENABLED else \
+        "PREWARM_ENABLED=false: job nằm trong hàng đợi đến khi pre-warm được bật."
+
+    return HTMLResponse(f"""
+      <!DOCTYPE html>
+      <html>
+        <head>
+          <meta charset="utf-8"/>
+          <title>Pre-warm Queued - Admin</title>
+          <style>
+            body {{
+              font-family: Arial, sans-serif;
+              margin: 40px;
+              background: #f5f5f5;
+            }}
+            .card {{
+              background: white;
+              padding: 30px;
+              border-radius: 8px;
+              box-shadow: 0 2px 8px rgba(0,0,0,0.1);
+              max-width: 600px;
+            }}
+            h3 {{
+              color: #007bff;
+            }}
+            a {{
+              color: #007bff;
+              text-decoration: none;
+            }}
+            a:hover {{
+              text-decoration: underline;
+            }}
+          </style>
+        </head>
+        <body>
+          <div class="card">
+            <h3>✅ Pre-warm queued</h3>
+            <p>{note}</p>
+            <p><a href="/api/admin/ui">← Back to admin panel</a></p>
+          </div>
+        </body>
+      </html>
+    """)
+
+
 @app.get("/admin/clear_bad", response_class=HTMLResponse)
 def admin_clear_bad(key: str, authorization: str | None = Header(default=None)):
     """
@@ -1144,6 +1643,8 @@ async def admin_override_save(request: Request, authorization: str | None = Head
         payload["choices"][0]["message"]["content"] = content
 
     payload.setdefault("rag_meta", {})
+    # entry ghi trước khi tách rag_meta.user ra khỏi cache
+    payload["rag_meta"].pop("user", None)
     payload["rag_meta"]["admin_override"] = {
         "by": principal.get("email") or principal.get("sub"),
         "ts": int(time.time()),
@@ -1153,10 +1654,7 @@ async def admin_override_save(request: Request, authorization: str | None = Head
 
     # Save back with TTL = DEFAULT_CACHE_TTL_DAYS
     ttl_days = int(os.environ.get("DEFAULT_CACHE_TTL_DAYS", "30"))
-    delete_key(key)
-    from cache import r as redis_client
-    redis_client.set(key, json.dumps(payload, ensure_ascii=False))
-    redis_client.expire(key, ttl_days * 86400)
+    put_json(key, payload, ttl_days * 86400)
 
     # Clear bad mark if exists for same ver/gh/qh
     bad = f"bad:{ver}:{gh}:{qh}"
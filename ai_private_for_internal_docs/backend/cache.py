@@ -3,17 +3,377 @@ Cache layer với 2-tier system + Admin helpers (v3):
 1. Answer Cache (ans:*) - stores LLM responses
 2. Negative Feedback Store (bad:*) - marks bad answers to bypass cache
 3. Admin helpers - scan, view, delete, parse keys
+
+Key scope = global corpus_version + version từng doc_group trong scope của user,
+nên ingest một group chỉ invalidate cache của các scope chứa group đó.
+
+L1 in-process LRU/TTL (ans:*, bad:* checks, corpus versions) đứng trước Redis (L2);
+invalidate giữa các worker qua Redis pub/sub.
+
+Giá trị ans:* và recent:* được lưu bằng compact codec (msgpack + zstd, xem codec.py);
+giá trị JSON cũ vẫn đọc được.
 """
 from __future__ import annotations
-import os, json, time, hashlib
-from typing import List, Dict, Any, Optional, Tuple
+import os, json, time, hashlib, threading, uuid, math
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, TYPE_CHECKING
 import redis
 
+import codec
+
+if TYPE_CHECKING:
+    import numpy as np
+
 REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
 DEFAULT_TTL = int(os.environ.get("DEFAULT_CACHE_TTL_DAYS", "30"))
 BAD_TTL = int(os.environ.get("BAD_MARK_TTL_DAYS", "365"))
 
 r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+# Binary client cho các giá trị đã encode bằng codec (ans:*, recent:*)
+rb = redis.Redis.from_url(REDIS_URL, decode_responses=False)
+
+CODEC_DICT_PREFIX = "codec:dict:"
+CODEC_CURRENT_KEY = "codec:dict:current"
+CODEC_STATS_KEY = "codec:stats"
+CODEC_REFRESH_SEC = 60
+
+def _load_codec_dict(dict_id: int) -> Optional[bytes]:
+    return rb.get(f"{CODEC_DICT_PREFIX}{dict_id}")
+
+_payload_codec = codec.Codec(dict_loader=_load_codec_dict)
+_codec_checked_at = 0.0
+
+def _sync_codec_dict():
+    """Pick up dictionary mới (train bởi worker khác) tối đa mỗi CODEC_REFRESH_SEC giây"""
+    global _codec_checked_at
+    now = time.time()
+    if now - _codec_checked_at < CODEC_REFRESH_SEC:
+        return
+    _codec_checked_at = now
+    try:
+        v = r.get(CODEC_CURRENT_KEY)
+        _payload_codec.use_dict(int(v) if v else None)
+    except Exception:
+        pass
+
+def _put(key: str, obj: Dict[str, Any], ttl_sec: int, kind: str) -> bytes:
+    """Internal: encode + SET EX trong một round-trip, cộng dồn thống kê dung lượng"""
+    _sync_codec_dict()
+    data = _payload_codec.encode(obj)
+    p = rb.pipeline(transaction=False)
+    p.set(key, data, ex=ttl_sec)
+    if codec.enabled():
+        json_len = len(json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+        p.hincrby(CODEC_STATS_KEY, f"{kind}:writes", 1)
+        p.hincrby(CODEC_STATS_KEY, f"{kind}:json_bytes", json_len)
+        p.hincrby(CODEC_STATS_KEY, f"{kind}:stored_bytes", len(data))
+    p.execute()
+    return data
+
+def _decode(raw: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    if not raw:
+        return None
+    try:
+        return _payload_codec.decode(raw)
+    except Exception:
+        return None
+
+def _get(key: str) -> Optional[Dict[str, Any]]:
+    """Internal: GET + decode (compact hoặc legacy JSON)"""
+    return _decode(rb.get(key))
+
+# ========= L1 in-process cache (trước Redis) =========
+L1_ENABLED = os.environ.get("L1_CACHE_ENABLED", "true").lower() == "true"
+L1_MAX_ENTRIES = int(os.environ.get("L1_MAX_ENTRIES", "2000"))
+L1_TTL_SEC = float(os.environ.get("L1_TTL_SEC", "60"))
+INVALIDATE_CHANNEL = "cache:invalidate"
+TIER_STATS_KEY = "cache:tier_stats"
+TIER_STATS_FLUSH_SEC = 10
+
+_MISS = object()
+_WORKER_ID = uuid.uuid4().hex[:12]
+
+class _L1:
+    """Bounded LRU + TTL, thread-safe. Lưu raw bytes (ans:*) hoặc bool (bad:*)."""
+    def __init__(self, max_entries: int, ttl_sec: float):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._d: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # tăng mỗi lần invalidate; set(..., gen=) bỏ qua giá trị đọc từ Redis trước invalidation
+        self.gen = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._d.get(key)
+            if item is None:
+                return _MISS
+            exp, val = item
+            if exp < time.monotonic():
+                del self._d[key]
+                return _MISS
+            self._d.move_to_end(key)
+            return val
+
+    def set(self, key: str, val: Any, gen: Optional[int] = None):
+        with self._lock:
+            if gen is not None and gen != self.gen:
+                return
+            self._d[key] = (time.monotonic() + self.ttl_sec, val)
+            self._d.move_to_end(key)
+            while len(self._d) > self.max_entries:
+                self._d.popitem(last=False)
+
+    def delete(self, keys: Iterable[str]):
+        with self._lock:
+            self.gen += 1
+            for k in keys:
+                self._d.pop(k, None)
+
+    def clear(self):
+        with self._lock:
+            self.gen += 1
+            self._d.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._d)
+
+_l1 = _L1(L1_MAX_ENTRIES, L1_TTL_SEC)
+_tier_counts: Dict[str, int] = {}
+_tier_lock = threading.Lock()
+_listener_started = False
+
+def _count(name: str):
+    with _tier_lock:
+        _tier_counts[name] = _tier_counts.get(name, 0) + 1
+
+def _flush_tier_stats():
+    """Đẩy counters của worker này vào Redis (tổng hợp cho mọi worker)"""
+    with _tier_lock:
+        pending = dict(_tier_counts)
+        _tier_counts.clear()
+    if not pending:
+        return
+    try:
+        p = r.pipeline(transaction=False)
+        for k, v in pending.items():
+            p.hincrby(TIER_STATS_KEY, k, v)
+        p.execute()
+    except Exception:
+        with _tier_lock:
+            for k, v in pending.items():
+                _tier_counts[k] = _tier_counts.get(k, 0) + v
+
+def _listen_invalidations():
+    """Background thread: nhận invalidation từ worker khác + flush stats định kỳ"""
+    last_flush = time.monotonic()
+    while True:
+        try:
+            ps = r.pubsub(ignore_subscribe_messages=True)
+            ps.subscribe(INVALIDATE_CHANNEL)
+            # có thể đã lỡ message trong lúc mất kết nối → xoá sạch L1, build lại Bloom filter
+            _l1.clear()
+            _bloom_mark_dirty()
+            while True:
+                msg = ps.get_message(timeout=1.0)
+                if msg and msg.get("type") == "message":
+                    _apply_invalidation(msg.get("data"))
+                if time.monotonic() - last_flush >= TIER_STATS_FLUSH_SEC:
+                    _flush_tier_stats()
+                    last_flush = time.monotonic()
+        except Exception as e:
+            print(f"[cache] invalidation listener error: {e}, reconnecting")
+            _l1.clear()
+            _bloom_mark_dirty()
+            time.sleep(1.0)
+
+def _apply_invalidation(data: Optional[str]):
+    try:
+        msg = json.loads(data or "{}")
+    except Exception:
+        return
+    if msg.get("origin") == _WORKER_ID:
+        return
+    if msg.get("op") == "flush":
+        _l1.clear()
+        _bloom_mark_dirty()
+    elif msg.get("op") == "del":
+        _l1.delete(msg.get("keys") or [])
+        _bloom_on_invalidate(msg.get("keys") or [])
+
+def _ensure_listener():
+    global _listener_started
+    if _listener_started or not (L1_ENABLED or BAD_BLOOM_ENABLED):
+        return
+    with _tier_lock:
+        if _listener_started:
+            return
+        _listener_started = True
+    threading.Thread(target=_listen_invalidations, name="cache-invalidate", daemon=True).start()
+    if BAD_BLOOM_ENABLED:
+        _bloom_wake.set()
+        threading.Thread(target=_bloom_rebuilder, name="cache-bad-bloom", daemon=True).start()
+
+def start_background():
+    """Start listener + Bloom rebuild thread lúc startup (các hàm cache cũng tự start khi cần)"""
+    _ensure_listener()
+
+def _invalidate(keys: Optional[List[str]] = None):
+    """Xoá khỏi L1 local + broadcast tới các worker khác (keys=None → flush toàn bộ)"""
+    if keys is None:
+        _l1.clear()
+        _bloom_mark_dirty()
+        msg = {"op": "flush", "origin": _WORKER_ID}
+    else:
+        _l1.delete(keys)
+        _bloom_on_invalidate(keys)
+        msg = {"op": "del", "keys": keys, "origin": _WORKER_ID}
+    try:
+        r.publish(INVALIDATE_CHANNEL, json.dumps(msg))
+    except Exception:
+        pass
+
+# ========= Bloom filter cho bad:* (mỗi worker) =========
+# Bad marks rất hiếm (vài trăm) so với số request → is_bad chỉ hỏi Redis khi filter
+# báo "có thể có". Build lại từ Redis khi khởi động, khi corpus versions đổi, khi có
+# bad mark bị xoá và khi listener mất kết nối (bỏ các mark đã hết hạn / bị xoá);
+# mark_bad của worker khác tới qua pub/sub. Build (SCAN bad:*) chạy ở thread nền,
+# request trong lúc đó hỏi Redis như khi không có filter.
+BAD_BLOOM_ENABLED = os.environ.get("BAD_BLOOM_ENABLED", "true").lower() == "true"
+BAD_BLOOM_CAPACITY = int(os.environ.get("BAD_BLOOM_CAPACITY", "10000"))
+BAD_BLOOM_FP_RATE = float(os.environ.get("BAD_BLOOM_FP_RATE", "0.001"))
+
+class _Bloom:
+    def __init__(self, capacity: int, fp_rate: float):
+        capacity = max(1, capacity)
+        self.m = max(64, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))))
+        self.k = max(1, int(round(self.m / capacity * math.log(2))))
+        self.capacity = capacity
+        self.bits = bytearray((self.m + 7) // 8)
+        self.n = 0
+
+    def _positions(self, key: str) -> List[int]:
+        # double hashing (Kirsch–Mitzenmacher) trên một digest 128-bit
+        d = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def add(self, key: str):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.n += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def expected_fp_rate(self) -> float:
+        fill = int.from_bytes(self.bits, "little").bit_count() / self.m
+        return fill ** self.k
+
+_bad_bloom: Optional[_Bloom] = None
+_bloom_dirty = True
+_bloom_rebuilding = False
+_bloom_pending: List[str] = []
+_bloom_lock = threading.Lock()
+_bloom_wake = threading.Event()
+_bloom_rebuilds = 0
+
+def _bloom_mark_dirty():
+    global _bloom_dirty
+    _bloom_dirty = True
+    _bloom_wake.set()
+
+def _bloom_add(key: str):
+    with _bloom_lock:
+        if _bad_bloom is not None:
+            _bad_bloom.add(key)
+        if _bloom_rebuilding:
+            _bloom_pending.append(key)
+
+def _bloom_on_invalidate(keys: Iterable[str]):
+    """bad:* vừa được set → thêm vào filter; vừa bị xoá / versions đổi → build lại"""
+    if not BAD_BLOOM_ENABLED:
+        return
+    for k in keys:
+        if k == "corpus_versions":
+            _bloom_mark_dirty()
+        elif k.startswith("bad:"):
+            try:
+                exists = r.exists(k) == 1
+            except Exception:
+                exists = False
+            if exists:
+                _bloom_add(k)
+            else:
+                _bloom_mark_dirty()
+
+def _rebuild_bad_bloom() -> bool:
+    global _bad_bloom, _bloom_dirty, _bloom_rebuilding, _bloom_rebuilds
+    with _bloom_lock:
+        if _bloom_rebuilding:
+            return True
+        _bloom_rebuilding = True
+        _bloom_dirty = False
+        _bloom_pending.clear()
+    try:
+        keys = list(r.scan_iter(match="bad:*", count=1000))
+        bf = _Bloom(max(BAD_BLOOM_CAPACITY, 2 * len(keys)), BAD_BLOOM_FP_RATE)
+        for k in keys:
+            bf.add(k)
+        with _bloom_lock:
+            # bad mark set trong lúc SCAN
+            for k in _bloom_pending:
+                bf.add(k)
+            _bad_bloom = bf
+            _bloom_rebuilds += 1
+        return True
+    except Exception as e:
+        print(f"[cache] bad bloom rebuild failed: {e}")
+        _bloom_mark_dirty()
+        return False
+    finally:
+        with _bloom_lock:
+            _bloom_rebuilding = False
+            _bloom_pending.clear()
+
+def _bloom_rebuilder():
+    """Background thread: build lại filter mỗi khi bị đánh dấu dirty (không bao giờ trên request thread)"""
+    while True:
+        _bloom_wake.wait()
+        _bloom_wake.clear()
+        # dirty lại trong lúc SCAN → wake đã set lại → vòng sau build tiếp
+        if _bloom_dirty and not _rebuild_bad_bloom():
+            time.sleep(1.0)
+
+def _bad_filter() -> Optional[_Bloom]:
+    """Filter dùng được ngay (None → hỏi Redis như cũ: chưa build / đang build lại ở thread nền)"""
+    if not BAD_BLOOM_ENABLED:
+        return None
+    _ensure_listener()
+    return None if (_bloom_dirty or _bloom_rebuilding) else _bad_bloom
+
+def bad_bloom_stats() -> Dict[str, Any]:
+    """Filter của worker này + false-positive rate quan sát được (tổng mọi worker)"""
+    raw = {k: int(v) for k, v in (r.hgetall(TIER_STATS_KEY) or {}).items()}
+    neg, fp, tp = raw.get("bad:bloom_negatives", 0), raw.get("bad:bloom_fp", 0), raw.get("bad:bloom_tp", 0)
+    bf = _bad_bloom
+    return {
+        "enabled": BAD_BLOOM_ENABLED,
+        "entries_this_worker": bf.n if bf else None,
+        "capacity": bf.capacity if bf else BAD_BLOOM_CAPACITY,
+        "bits": bf.m if bf else None,
+        "hashes": bf.k if bf else None,
+        "target_fp_rate": BAD_BLOOM_FP_RATE,
+        "expected_fp_rate": round(bf.expected_fp_rate(), 6) if bf else None,
+        "rebuilds_this_worker": _bloom_rebuilds,
+        # Redis lookup được bỏ qua / filter báo "maybe" nhưng key không tồn tại / đúng là bad
+        "skipped_lookups": neg,
+        "false_positives": fp,
+        "true_positives": tp,
+        "observed_fp_rate": round(fp / (fp + neg), 6) if (fp + neg) else None,
+    }
 
 def normalize_question(q: str) -> str:
     """Normalize question for consistent caching"""
@@ -23,83 +383,741 @@ def hash_str(s: str) -> str:
     """Generate stable hash for string"""
     return hashlib.sha1(s.encode("utf-8", errors="ignore")).hexdigest()
 
+def _clean_groups(groups: Iterable[str]) -> List[str]:
+    return sorted({g.strip() for g in groups if isinstance(g, str) and g.strip()})
+
 def groups_hash(groups: List[str]) -> str:
     """Generate stable hash for groups list"""
-    cleaned = [g.strip() for g in groups if isinstance(g, str) and g.strip()]
-    return hash_str(",".join(sorted(cleaned)))
+    return hash_str(",".join(_clean_groups(groups)))
+
+# ========= Scope normalization (groups ∩ doc_groups có trong corpus) =========
+CORPUS_GROUPS_KEY = "corpus:groups"
+CORPUS_GROUPS_VERSION_KEY = "corpus:groups:version"
+
+def corpus_groups() -> Optional[frozenset]:
+    """
+    Tập doc_group đang có trong corpus (superset: chỉ thêm khi ingest, thay mới khi refresh).
+    None nếu chưa được build → dùng full groups hash như cũ.
+    """
+    if L1_ENABLED:
+        _ensure_listener()
+        v = _l1.get("corpus_groups")
+        if v is not _MISS:
+            return v
+    gen = _l1.gen
+    p = r.pipeline(transaction=False)
+    p.exists(CORPUS_GROUPS_VERSION_KEY)
+    p.smembers(CORPUS_GROUPS_KEY)
+    ready, members = p.execute()
+    v = frozenset(members) if ready else None
+    if L1_ENABLED:
+        _l1.set("corpus_groups", v, gen=gen)
+    return v
+
+def register_corpus_groups(groups: Iterable[str]):
+    """Ingest: thêm doc_group vào tập TRƯỚC khi upsert (để key không bao giờ thiếu group)"""
+    cleaned = _clean_groups(groups)
+    if not cleaned:
+        return
+    p = r.pipeline(transaction=False)
+    p.sadd(CORPUS_GROUPS_KEY, *cleaned)
+    p.setnx(CORPUS_GROUPS_VERSION_KEY, "0")
+    p.execute()
+    _invalidate(["corpus_groups"])
+
+def refresh_corpus_groups(groups: Iterable[str]) -> int:
+    """Thay toàn bộ tập bằng danh sách lấy từ vector store (gọi khi corpus_version đổi)"""
+    cleaned = _clean_groups(groups)
+    tmp = f"{CORPUS_GROUPS_KEY}:tmp:{_WORKER_ID}"
+    p = r.pipeline(transaction=True)
+    p.delete(tmp)
+    if cleaned:
+        p.sadd(tmp, *cleaned)
+        p.rename(tmp, CORPUS_GROUPS_KEY)
+    else:
+        p.delete(CORPUS_GROUPS_KEY)
+    p.set(CORPUS_GROUPS_VERSION_KEY, str(corpus_version()))
+    p.execute()
+    _invalidate(["corpus_groups"])
+    return len(cleaned)
+
+def effective_groups(groups: List[str]) -> Optional[List[str]]:
+    """
+    Groups thực sự ảnh hưởng tới kết quả store.search: groups ∩ corpus_groups().
+    None = không filter (principal không có group → search toàn bộ, như hiện tại).
+    """
+    cleaned = _clean_groups(groups)
+    if not cleaned:
+        return None
+    known = corpus_groups()
+    if known is None:
+        return cleaned
+    return [g for g in cleaned if g in known]
+
+def scope_hash(groups: List[str]) -> str:
+    """
+    Hash của scope hiệu lực. Hai user có cùng groups ∩ corpus_groups dùng chung cache.
+    Scope "không filter" và scope "filter nhưng giao rỗng" (chỉ thấy public docs) luôn khác nhau.
+    """
+    return _scope_hash(effective_groups(groups))
+
+def _scope_hash(eff: Optional[List[str]]) -> str:
+    if eff is None:
+        return groups_hash([])
+    return hash_str("scope:" + ",".join(eff))
 
 def corpus_version() -> int:
     """Get current corpus version"""
+    if L1_ENABLED:
+        _ensure_listener()
+        v = _l1.get("corpus_version")
+        if v is not _MISS:
+            return v
+    gen = _l1.gen
     v = r.get("corpus_version")
     if not v:
         r.set("corpus_version", "1")
-        return 1
-    return int(v)
+        v = 1
+    v = int(v)
+    if L1_ENABLED:
+        _l1.set("corpus_version", v, gen=gen)
+    return v
 
 def bump_corpus_version() -> int:
-    """Increment corpus version (call after document ingestion)"""
-    return int(r.incr("corpus_version"))
+    """Increment global corpus version (invalidate ALL caches)"""
+    v = int(r.incr("corpus_version"))
+    _invalidate()
+    return v
+
+# ========= Per-group corpus versions =========
+CORPUS_VERSIONS_KEY = "corpus_versions"
+PUBLIC_GROUP = "__public__"
+
+CORPUS_VERSIONS_PENDING_KEY = "corpus_versions:pending"
+STAGED_AT_FIELD = "__staged_at"
+# Pending versions tự commit sau thời gian này dù pre-warm chưa xong (hoặc worker chết)
+PREWARM_MAX_SEC = int(os.environ.get("PREWARM_MAX_SEC", "900"))
+
+def group_versions() -> Dict[str, int]:
+    """Version counter (đang active) của từng doc_group (PUBLIC_GROUP = docs không có group)"""
+    if L1_ENABLED:
+        _ensure_listener()
+        v = _l1.get("corpus_versions")
+        if v is not _MISS:
+            return v
+    gen = _l1.gen
+    p = r.pipeline(transaction=False)
+    p.hgetall(CORPUS_VERSIONS_KEY)
+    p.hget(CORPUS_VERSIONS_PENDING_KEY, STAGED_AT_FIELD)
+    active, staged_at = p.execute()
+    if staged_at and time.time() - float(staged_at) > PREWARM_MAX_SEC:
+        commit_group_versions()
+        active = r.hgetall(CORPUS_VERSIONS_KEY)
+    v = {k: int(x) for k, x in (active or {}).items()}
+    if L1_ENABLED:
+        _l1.set("corpus_versions", v, gen=gen)
+    return v
+
+def bump_group_version(group: Optional[str]) -> int:
+    """Increment version of one doc_group (None → public docs). Chỉ invalidate scope chứa group đó."""
+    v = int(r.hincrby(CORPUS_VERSIONS_KEY, group or PUBLIC_GROUP, 1))
+    _invalidate(["corpus_versions"])
+    return v
 
-def _qhash(question: str) -> str:
-    """Internal: hash normalized question"""
-    return hash_str(normalize_question(question))
+def bump_group_versions(groups: Iterable[Optional[str]]) -> Dict[str, int]:
+    """Bump nhiều group trong một round-trip (gọi sau ingest)"""
+    fields = sorted({g or PUBLIC_GROUP for g in groups})
+    if not fields:
+        return {}
+    p = r.pipeline(transaction=False)
+    for f in fields:
+        p.hincrby(CORPUS_VERSIONS_KEY, f, 1)
+    out = dict(zip(fields, (int(x) for x in p.execute())))
+    _invalidate(["corpus_versions"])
+    return out
 
-def answer_key(question: str, groups: List[str]) -> str:
-    """Generate cache key for answer"""
-    return f"ans:{corpus_version()}:{groups_hash(groups)}:{_qhash(question)}"
+def stage_group_versions(groups: Iterable[Optional[str]]) -> Dict[str, int]:
+    """
+    Chuẩn bị version mới cho các group nhưng CHƯA active: cache cũ vẫn được serve
+    trong lúc pre-warm ghi answer vào key của version mới, rồi commit_group_versions().
+    """
+    fields = sorted({g or PUBLIC_GROUP for g in groups})
+    if not fields:
+        return {}
+    p = r.pipeline(transaction=False)
+    p.hgetall(CORPUS_VERSIONS_KEY)
+    p.hgetall(CORPUS_VERSIONS_PENDING_KEY)
+    active, pending = p.execute()
+    staged = {}
+    for f in fields:
+        cur = int((active or {}).get(f, 0))
+        prev = int((pending or {}).get(f, 0))
+        staged[f] = max(cur + 1, prev)
+    p = r.pipeline(transaction=False)
+    p.hset(CORPUS_VERSIONS_PENDING_KEY, mapping=staged)
+    # giữ thời điểm stage sớm nhất để deadline không bị đẩy lùi mãi
+    p.hsetnx(CORPUS_VERSIONS_PENDING_KEY, STAGED_AT_FIELD, str(time.time()))
+    p.execute()
+    return pending_group_versions()
+
+def pending_group_versions() -> Dict[str, int]:
+    """Versions đã stage, chưa active"""
+    raw = r.hgetall(CORPUS_VERSIONS_PENDING_KEY) or {}
+    return {k: int(v) for k, v in raw.items() if k != STAGED_AT_FIELD}
 
-def bad_key(question: str, groups: List[str]) -> str:
+def commit_group_versions() -> Dict[str, int]:
+    """Active các pending versions (atomic), old entries thôi được serve từ lúc này"""
+    with r.pipeline(transaction=True) as p:
+        try:
+            p.watch(CORPUS_VERSIONS_PENDING_KEY)
+            raw = p.hgetall(CORPUS_VERSIONS_PENDING_KEY) or {}
+            pending = {k: v for k, v in raw.items() if k != STAGED_AT_FIELD}
+            p.multi()
+            if pending:
+                p.hset(CORPUS_VERSIONS_KEY, mapping=pending)
+            p.delete(CORPUS_VERSIONS_PENDING_KEY)
+            p.execute()
+        except redis.WatchError:
+            # bị stage thêm trong lúc commit → lần đọc sau (hoặc prewarmer) sẽ commit lại
+            return {}
+    _invalidate(["corpus_versions"])
+    return {k: int(v) for k, v in pending.items()}
+
+def scope_version(groups: List[str]) -> str:
+    """
+    Version của scope = global corpus_version + version các group trong scope.
+    Scope không filter (không có group) thấy mọi doc → phụ thuộc mọi group.
+    """
+    return _scope_version(effective_groups(groups))
+
+def _scope_version(eff: Optional[List[str]], versions: Optional[Dict[str, int]] = None) -> str:
+    gv = versions if versions is not None else group_versions()
+    if eff is None:
+        parts = sorted(gv.items())
+    else:
+        parts = [(PUBLIC_GROUP, gv.get(PUBLIC_GROUP, 0))] + [(g, gv.get(g, 0)) for g in eff]
+    sig = ",".join(f"{g}={n}" for g, n in parts)
+    return f"{corpus_version()}-{hash_str(sig)[:10]}"
+
+def _scope_key(groups: List[str], versions: Optional[Dict[str, int]] = None) -> str:
+    """Internal: '<scope_version>:<scope_hash>' (tính effective groups một lần)"""
+    eff = effective_groups(groups)
+    return f"{_scope_version(eff, versions)}:{_scope_hash(eff)}"
+
+def conversation_fingerprint(turns: Iterable[Tuple[str, str]]) -> str:
+    """
+    Hash các lượt (role, content) trước câu hỏi cuối; "" = single-turn.
+    Follow-up "còn trường hợp thử việc thì sao?" ở hai hội thoại khác nhau → key khác nhau.
+    """
+    h = hashlib.sha1()
+    n = 0
+    for role, content in turns:
+        h.update(f"{role}\x1f{normalize_question(content)}\x1e".encode("utf-8", errors="ignore"))
+        n += 1
+    return h.hexdigest()[:16] if n else ""
+
+def _qhash(question: str, conv: str = "") -> str:
+    """Internal: hash normalized question (+ conversation fingerprint nếu multi-turn)"""
+    qh = hash_str(normalize_question(question))
+    return f"{qh}.{conv}" if conv else qh
+
+def answer_key(question: str, groups: List[str], versions: Optional[Dict[str, int]] = None, conv: str = "") -> str:
+    """Generate cache key for answer (versions: group versions khác active, dùng cho pre-warm)"""
+    return f"ans:{_scope_key(groups, versions)}:{_qhash(question, conv)}"
+
+def bad_key(question: str, groups: List[str], conv: str = "") -> str:
     """Generate cache key for negative feedback"""
-    return f"bad:{corpus_version()}:{groups_hash(groups)}:{_qhash(question)}"
-
-def get_answer(question: str, groups: List[str]) -> Optional[Dict[str, Any]]:
-    """Get cached answer if exists"""
-    val = r.get(answer_key(question, groups))
-    return json.loads(val) if val else None
-
-def set_answer(question: str, groups: List[str], payload: Dict[str, Any], ttl_days: int = DEFAULT_TTL) -> str:
-    """Store answer in cache with TTL"""
-    k = answer_key(question, groups)
-    r.set(k, json.dumps(payload, ensure_ascii=False))
-    r.expire(k, ttl_days * 86400)
+    return f"bad:{_scope_key(groups)}:{_qhash(question, conv)}"
+
+def get_answer(question: str, groups: List[str], conv: str = "") -> Optional[Dict[str, Any]]:
+    """Get cached answer if exists (L1 → Redis)"""
+    k = answer_key(question, groups, conv=conv)
+    if L1_ENABLED:
+        raw = _l1.get(k)
+        if raw is not _MISS:
+            _count("ans:l1_hits")
+            return _decode(raw)
+    gen = _l1.gen
+    raw = rb.get(k)
+    if not raw:
+        _count("ans:misses")
+        return None
+    _count("ans:l2_hits")
+    if L1_ENABLED:
+        _l1.set(k, raw, gen=gen)
+    return _decode(raw)
+
+def _register_hit_groups(groups: List[str], hits: List[Dict[str, Any]]):
+    """
+    Safety net trước khi tính key của mọi cache chứa kết quả retrieve: nếu hit có doc_group
+    chưa có trong corpus_groups (tập bị thay trong lúc ingest đang chạy) thì bổ sung trước,
+    để entry không bị chia sẻ sang scope hẹp hơn (user không có quyền đọc các chunk đó).
+    """
+    eff = effective_groups(groups)
+    if eff is None:
+        return
+    seen = {h.get("doc_group") for h in hits if h.get("doc_group")}
+    seen.update(g for h in hits for g in h.get("doc_groups") or [] if g != PUBLIC_GROUP)
+    if not seen.issubset(eff):
+        register_corpus_groups(seen)
+
+def set_answer(question: str, groups: List[str], payload: Dict[str, Any], ttl_days: int = DEFAULT_TTL,
+               versions: Optional[Dict[str, int]] = None, conv: str = "", ttl_sec: Optional[int] = None) -> str:
+    """Store answer in cache with TTL (ttl_sec, nếu có, thay cho ttl_days)"""
+    _register_hit_groups(groups, (payload.get("rag_meta") or {}).get("retrieved") or [])
+    ttl = ttl_sec if ttl_sec is not None else ttl_days * 86400
+    k = answer_key(question, groups, versions, conv)
+    data = _put(k, payload, ttl, "ans")
+    _record_dependencies(k, payload, ttl)
+    _invalidate([k])
+    if L1_ENABLED:
+        _l1.set(k, data)
     return k
 
-def mark_bad(question: str, groups: List[str], reason: Optional[str] = None) -> str:
+def mark_bad(question: str, groups: List[str], reason: Optional[str] = None, conv: str = "") -> str:
     """Mark answer as bad (user reported dissatisfaction)"""
-    k = bad_key(question, groups)
+    k = bad_key(question, groups, conv)
     data = {"ts": int(time.time()), "reason": reason}
-    r.set(k, json.dumps(data, ensure_ascii=False))
-    r.expire(k, BAD_TTL * 86400)
+    r.set(k, json.dumps(data, ensure_ascii=False), ex=BAD_TTL * 86400)
+    _invalidate([k])
     return k
 
-def is_bad(question: str, groups: List[str]) -> bool:
-    """Check if answer was marked as bad"""
-    return r.exists(bad_key(question, groups)) == 1
+def is_bad(question: str, groups: List[str], conv: str = "") -> bool:
+    """Check if answer was marked as bad (Bloom filter → L1 → Redis)"""
+    k = bad_key(question, groups, conv)
+    bf = _bad_filter()
+    if bf is not None and k not in bf:
+        _count("bad:bloom_negatives")
+        return False
+    v = _MISS
+    if L1_ENABLED:
+        v = _l1.get(k)
+        if v is not _MISS:
+            _count("bad:l1_hits")
+    if v is _MISS:
+        gen = _l1.gen
+        v = r.exists(k) == 1
+        _count("bad:l2_lookups")
+        if L1_ENABLED:
+            _l1.set(k, v, gen=gen)
+    if bf is not None:
+        _count("bad:bloom_tp" if v else "bad:bloom_fp")
+    return v
 
-def delete_answer(question: str, groups: List[str]):
+def delete_answer(question: str, groups: List[str], conv: str = ""):
     """Delete cached answer"""
-    r.delete(answer_key(question, groups))
+    k = answer_key(question, groups, conv=conv)
+    r.delete(k)
+    _invalidate([k])
 
-def delete_bad(question: str, groups: List[str]):
+def delete_bad(question: str, groups: List[str], conv: str = ""):
     """Delete bad mark (admin clear)"""
-    r.delete(bad_key(question, groups))
+    k = bad_key(question, groups, conv)
+    r.delete(k)
+    _invalidate([k])
 
-# ========= Recent response store (to link request_id -> question/groups/response) =========
-def recent_set(request_id: str, record: Dict[str, Any], ttl_sec: int = 86400):
-    """Store recent request data for feedback tracking"""
-    r.set(f"recent:{request_id}", json.dumps(record, ensure_ascii=False))
-    r.expire(f"recent:{request_id}", ttl_sec)
+# ========= Answer dependency index (source -> ans:* keys) =========
+DEP_PREFIX = "dep:src:"
+DEP_LOG_KEY = "dep:log"
+DEP_LOG_MAX = 200
 
-def recent_get(request_id: str) -> Optional[Dict[str, Any]]:
-    """Get recent request data"""
-    val = r.get(f"recent:{request_id}")
-    if not val:
+def _dep_key(source: str) -> str:
+    return f"{DEP_PREFIX}{hash_str(source)}"
+
+def _record_dependencies(key: str, payload: Dict[str, Any], ttl_sec: int, prefix: str = DEP_PREFIX):
+    """Ghi reverse index: mỗi source trong rag_meta.retrieved -> answer key"""
+    retrieved = (payload.get("rag_meta") or {}).get("retrieved") or []
+    sources = {h.get("source") for h in retrieved if h.get("source")}
+    if not sources:
+        return
+    p = r.pipeline(transaction=False)
+    for src in sources:
+        dk = f"{prefix}{hash_str(src)}"
+        p.sadd(dk, key)
+        # dep set sống ít nhất bằng answer sống lâu nhất trỏ vào nó: chỉ kéo dài, không rút
+        # ngắn TTL (answer TTL ngắn, vd fallback, không được làm mất index của answer 30 ngày).
+        # NX: set vừa tạo chưa có TTL (GT coi key không TTL là vô hạn); GT: chỉ tăng (Redis >= 7)
+        p.expire(dk, ttl_sec, nx=True)
+        p.expire(dk, ttl_sec, gt=True)
+    p.execute()
+
+def dependent_keys(sources: Iterable[str]) -> set:
+    """Tất cả ans:* key đang phụ thuộc vào các source"""
+    out: set = set()
+    for src in set(sources):
+        out.update(r.smembers(_dep_key(src)) or [])
+    return out
+
+def invalidate_sources(sources: Iterable[str], reason: str = "ingest", keep: Optional[set] = None) -> Dict[str, Any]:
+    """
+    Xoá chỉ những ans:* đã retrieve chunk từ các source này (không bump version).
+    keep: các key vừa được pre-warm lại (giữ nguyên).
+    Ghi log kết quả cho admin view.
+    """
+    keep = keep or set()
+    by_source: Dict[str, int] = {}
+    total = 0
+    for src in sorted(set(sources)):
+        dk = _dep_key(src)
+        keys = sorted(k for k in (r.smembers(dk) or []) if k not in keep)
+        removed = 0
+        # DEL theo batch; chỉ đếm key còn tồn tại (chưa hết hạn / chưa bị xoá)
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            removed += int(r.delete(*batch))
+            _invalidate(batch)
+            if keep:
+                r.srem(dk, *batch)
+        if not keep:
+            r.delete(dk)
+        by_source[src] = removed
+        total += removed
+    # retrieval cache (ret:* / conv:*) cũng chứa hit list cũ của các source này
+    ret_total = invalidate_retrieval_sources(sources)
+    entry = {
+        "ts": int(time.time()),
+        "reason": reason,
+        "sources": len(by_source),
+        "removed": total,
+        "retrieval_removed": ret_total,
+        "by_source": by_source,
+    }
+    if by_source:
+        p = r.pipeline(transaction=False)
+        p.lpush(DEP_LOG_KEY, json.dumps(entry, ensure_ascii=False))
+        p.ltrim(DEP_LOG_KEY, 0, DEP_LOG_MAX - 1)
+        p.execute()
+    return entry
+
+def invalidate_retrieval_sources(sources: Iterable[str]) -> int:
+    """Xoá các hit list (ret:* / conv:*) đã retrieve chunk từ các source này -> số key đã xoá"""
+    removed = 0
+    for src in sorted(set(sources)):
+        rk = f"{DEP_RET_PREFIX}{hash_str(src)}"
+        keys = list(r.smembers(rk) or [])
+        for i in range(0, len(keys), 500):
+            removed += int(r.delete(*keys[i:i + 500]))
+        r.delete(rk)
+    return removed
+
+def invalidation_log(limit: int = 50) -> List[Dict[str, Any]]:
+    """Các lần selective invalidation gần nhất (mới nhất trước)"""
+    out = []
+    for raw in r.lrange(DEP_LOG_KEY, 0, max(0, limit - 1)) or []:
+        try:
+            out.append(json.loads(raw))
+        except Exception:
+            continue
+    return out
+
+def dependents_count(source: str) -> int:
+    """Số answer key đang phụ thuộc vào source"""
+    return int(r.scard(_dep_key(source)))
+
+# ========= Retrieval cache (query embedding + hit list) =========
+# Bỏ qua embed + Qdrant search cả khi answer phải sinh lại (bad mark, cache miss do
+# câu hỏi lặp ở conversation khác). Key theo normalized query + effective scope +
+# scope version như ans:*, TTL và số entry riêng.
+RETRIEVAL_CACHE_ENABLED = os.environ.get("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+RETRIEVAL_CACHE_TTL_SEC = int(os.environ.get("RETRIEVAL_CACHE_TTL_SEC", "3600"))
+RETRIEVAL_CACHE_MAX = int(os.environ.get("RETRIEVAL_CACHE_MAX", "20000"))
+RETRIEVAL_INDEX_KEY = "ret:index"
+# dep set riêng: TTL của ret:* ngắn hơn nhiều so với ans:*, không được rút ngắn TTL của dep:src:*
+DEP_RET_PREFIX = "dep:ret:"
+
+def retrieval_key(query: str, groups: List[str], versions: Optional[Dict[str, int]] = None,
+                  top_k: Optional[int] = None) -> str:
+    k = f"ret:{_scope_key(groups, versions)}:{_qhash(query)}"
+    return f"{k}.k{top_k}" if top_k else k
+
+def query_embedding_key(query: str, model: str) -> str:
+    # embedding chỉ phụ thuộc câu hỏi + model, dùng chung mọi scope / version
+    return f"qemb:{hash_str(model)[:10]}:{_qhash(query)}"
+
+def _track_retrieval_keys(keys: List[str]):
+    """Giữ tối đa RETRIEVAL_CACHE_MAX key ret:* / qemb:* / conv:* (bỏ key cũ nhất)"""
+    now = time.time()
+    p = r.pipeline(transaction=False)
+    p.zadd(RETRIEVAL_INDEX_KEY, {k: now for k in keys})
+    p.zcard(RETRIEVAL_INDEX_KEY)
+    n = p.execute()[-1]
+    # trim theo lô (vượt 5%) để không phải trim ở mỗi lần ghi
+    if n > RETRIEVAL_CACHE_MAX * 1.05:
+        old = [k for k, _ in r.zpopmin(RETRIEVAL_INDEX_KEY, n - RETRIEVAL_CACHE_MAX)]
+        for i in range(0, len(old), 500):
+            r.delete(*old[i:i + 500])
+
+def get_retrieval(query: str, groups: List[str], versions: Optional[Dict[str, int]] = None,
+                  top_k: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+    if not RETRIEVAL_CACHE_ENABLED:
+        return None
+    obj = _get(retrieval_key(query, groups, versions, top_k))
+    _count("ret:hits" if obj is not None else "ret:misses")
+    return obj.get("hits") if obj is not None else None
+
+def set_retrieval(query: str, groups: List[str], hits: List[Dict[str, Any]],
+                  versions: Optional[Dict[str, int]] = None, top_k: Optional[int] = None):
+    if not RETRIEVAL_CACHE_ENABLED:
+        return
+    _register_hit_groups(groups, hits)
+    k = retrieval_key(query, groups, versions, top_k)
+    _put(k, {"hits": hits}, RETRIEVAL_CACHE_TTL_SEC, "ret")
+    _record_dependencies(k, {"rag_meta": {"retrieved": hits}}, RETRIEVAL_CACHE_TTL_SEC, prefix=DEP_RET_PREFIX)
+    _track_retrieval_keys([k])
+
+def get_query_embedding(query: str, model: str) -> Optional[np.ndarray]:
+    """float32 vector (read-only, như store.embed_query trả về ndarray) hoặc None"""
+    if not RETRIEVAL_CACHE_ENABLED:
+        return None
+    raw = rb.get(query_embedding_key(query, model))
+    _count("qemb:hits" if raw else "qemb:misses")
+    if not raw:
+        return None
+    import numpy as np
+    return np.frombuffer(raw, dtype="<f4")
+
+def set_query_embedding(query: str, model: str, vec) -> None:
+    if not RETRIEVAL_CACHE_ENABLED:
+        return
+    import numpy as np
+    k = query_embedding_key(query, model)
+    rb.set(k, np.asarray(vec, dtype="<f4").tobytes(), ex=RETRIEVAL_CACHE_TTL_SEC)
+    _track_retrieval_keys([k])
+
+def export_query_embeddings(model: str, batch: int = 1000) -> Iterator[List[Tuple[str, bytes, int]]]:
+    """Snapshot: [(key, vector bytes, ttl ms còn lại)] theo lô, chỉ của embed model hiện tại"""
+    out: List[Tuple[str, bytes, int]] = []
+    for k in r.scan_iter(match=f"qemb:{hash_str(model)[:10]}:*", count=1000):
+        p = rb.pipeline(transaction=False)
+        p.get(k)
+        p.pttl(k)
+        raw, ttl = p.execute()
+        if raw and ttl and ttl > 0:
+            out.append((k, raw, ttl))
+        if len(out) >= batch:
+            yield out
+            out = []
+    if out:
+        yield out
+
+def import_query_embeddings(items: List[Tuple[str, bytes, int]]) -> int:
+    if not RETRIEVAL_CACHE_ENABLED or not items:
+        return 0
+    p = rb.pipeline(transaction=False)
+    for k, raw, ttl in items:
+        p.set(k, raw, px=int(ttl))
+    p.execute()
+    _track_retrieval_keys([k for k, _, _ in items])
+    return len(items)
+
+# Hit list theo hội thoại: follow-up dùng lại context của các lượt trước, chỉ thêm hit mới.
+# Key theo chuỗi câu hỏi user (không gồm câu trả lời: client có thể sửa / cắt bớt).
+CONV_CACHE_TTL_SEC = int(os.environ.get("CONV_CACHE_TTL_SEC", "1800"))
+
+def conversation_key(groups: List[str], user_turns: List[str], versions: Optional[Dict[str, int]] = None) -> str:
+    fp = conversation_fingerprint(("user", t) for t in user_turns)
+    return f"conv:{_scope_key(groups, versions)}:{fp}"
+
+def get_conversation_hits(groups: List[str], user_turns: List[str],
+                          versions: Optional[Dict[str, int]] = None) -> Optional[List[Dict[str, Any]]]:
+    if not RETRIEVAL_CACHE_ENABLED or not user_turns:
+        return None
+    obj = _get(conversation_key(groups, user_turns, versions))
+    _count("conv:hits" if obj is not None else "conv:misses")
+    return obj.get("hits") if obj is not None else None
+
+def set_conversation_hits(groups: List[str], user_turns: List[str], hits: List[Dict[str, Any]],
+                          versions: Optional[Dict[str, int]] = None):
+    if not RETRIEVAL_CACHE_ENABLED or not user_turns:
+        return
+    _register_hit_groups(groups, hits)
+    k = conversation_key(groups, user_turns, versions)
+    _put(k, {"hits": hits}, CONV_CACHE_TTL_SEC, "conv")
+    _record_dependencies(k, {"rag_meta": {"retrieved": hits}}, CONV_CACHE_TTL_SEC, prefix=DEP_RET_PREFIX)
+    _track_retrieval_keys([k])
+
+def retrieval_stats() -> Dict[str, Any]:
+    _flush_tier_stats()
+    raw = {k: int(v) for k, v in (r.hgetall(TIER_STATS_KEY) or {}).items()}
+    hits, misses = raw.get("ret:hits", 0), raw.get("ret:misses", 0)
+    eh, em = raw.get("qemb:hits", 0), raw.get("qemb:misses", 0)
+    return {
+        "enabled": RETRIEVAL_CACHE_ENABLED,
+        "ttl_sec": RETRIEVAL_CACHE_TTL_SEC,
+        "max_entries": RETRIEVAL_CACHE_MAX,
+        "entries": int(r.zcard(RETRIEVAL_INDEX_KEY)),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        "embedding_hits": eh,
+        "embedding_misses": em,
+        "conversation_hits": raw.get("conv:hits", 0),
+        "conversation_misses": raw.get("conv:misses", 0),
+    }
+
+# ========= Question popularity (decayed counts, cho pre-warm) =========
+POP_ZSET_KEY = "pop:z"
+POP_META_KEY = "pop:meta"
+POP_EPOCH_KEY = "pop:epoch"
+POP_HALF_LIFE_SEC = float(os.environ.get("POP_HALF_LIFE_HOURS", "72")) * 3600
+POP_MAX_ENTRIES = int(os.environ.get("POP_MAX_ENTRIES", "5000"))
+POP_FLUSH_SEC = 10
+# forward decay: score = Σ 2^((t - epoch)/half_life); rescale khi số mũ quá lớn
+POP_RESCALE_AT = 60
+
+_pop_pending: Dict[str, List[Any]] = {}
+_pop_lock = threading.Lock()
+_pop_flushed_at = time.monotonic()
+
+def track_question(question: str, groups: List[str]):
+    """Đếm câu hỏi theo scope (buffer trong process, flush mỗi POP_FLUSH_SEC giây)"""
+    global _pop_flushed_at
+    member = f"{scope_hash(groups)}:{_qhash(question)}"
+    with _pop_lock:
+        item = _pop_pending.get(member)
+        if item is None:
+            _pop_pending[member] = [1, question, list(groups)]
+        else:
+            item[0] += 1
+        due = time.monotonic() - _pop_flushed_at >= POP_FLUSH_SEC
+        if due:
+            _pop_flushed_at = time.monotonic()
+    if due:
+        try:
+            _flush_popularity()
+        except Exception as e:
+            print(f"[cache] popularity flush failed: {e}")
+
+def _pop_epoch() -> float:
+    """Epoch của forward decay; rescale toàn bộ zset khi cần (WATCH để tránh 2 worker cùng làm)"""
+    now = time.time()
+    with r.pipeline(transaction=True) as p:
+        try:
+            p.watch(POP_EPOCH_KEY)
+            cur = p.get(POP_EPOCH_KEY)
+            if cur is None:
+                p.multi()
+                p.set(POP_EPOCH_KEY, str(now))
+                p.execute()
+                return now
+            cur = float(cur)
+            k = int((now - cur) / POP_HALF_LIFE_SEC)
+            if k < POP_RESCALE_AT:
+                p.unwatch()
+                return cur
+            p.multi()
+            p.zunionstore(POP_ZSET_KEY, {POP_ZSET_KEY: 2.0 ** -k})
+            p.set(POP_EPOCH_KEY, str(cur + k * POP_HALF_LIFE_SEC))
+            p.execute()
+            return cur + k * POP_HALF_LIFE_SEC
+        except redis.WatchError:
+            return float(r.get(POP_EPOCH_KEY) or now)
+
+def _flush_popularity():
+    with _pop_lock:
+        pending = dict(_pop_pending)
+        _pop_pending.clear()
+    if not pending:
+        return
+    w = 2.0 ** ((time.time() - _pop_epoch()) / POP_HALF_LIFE_SEC)
+    p = r.pipeline(transaction=False)
+    for member, (count, question, groups) in pending.items():
+        p.zincrby(POP_ZSET_KEY, count * w, member)
+        p.hset(POP_META_KEY, member, json.dumps({"q": question, "groups": groups}, ensure_ascii=False))
+    p.execute()
+    # giữ tối đa POP_MAX_ENTRIES câu hỏi phổ biến nhất
+    drop = r.zrange(POP_ZSET_KEY, 0, -(POP_MAX_ENTRIES + 1))
+    if drop:
+        p = r.pipeline(transaction=False)
+        p.zrem(POP_ZSET_KEY, *drop)
+        p.hdel(POP_META_KEY, *drop)
+        p.execute()
+
+def popular_questions(limit: int = 100) -> List[Dict[str, Any]]:
+    """Top câu hỏi theo decayed count: [{question, groups, score}]"""
+    _flush_popularity()
+    rows = r.zrevrange(POP_ZSET_KEY, 0, max(0, limit - 1), withscores=True)
+    if not rows:
+        return []
+    metas = r.hmget(POP_META_KEY, [m for m, _ in rows])
+    epoch = float(r.get(POP_EPOCH_KEY) or time.time())
+    norm = 2.0 ** (-(time.time() - epoch) / POP_HALF_LIFE_SEC)
+    out = []
+    for (member, score), meta in zip(rows, metas):
+        if not meta:
+            continue
+        m = json.loads(meta)
+        out.append({"question": m["q"], "groups": m.get("groups") or [], "score": round(score * norm, 2)})
+    return out
+
+# ========= Pre-warm jobs + status =========
+PREWARM_JOBS_KEY = "prewarm:jobs"
+PREWARM_STATUS_KEY = "prewarm:status"
+
+def enqueue_prewarm(job: Dict[str, Any]):
+    """Ingest → API: yêu cầu pre-warm (groups đã stage và/hoặc sources thay đổi)"""
+    job = {**job, "ts": int(time.time())}
+    r.lpush(PREWARM_JOBS_KEY, json.dumps(job, ensure_ascii=False))
+
+def pop_prewarm_job(timeout: int = 5) -> Optional[Dict[str, Any]]:
+    """Blocking pop; mỗi job chỉ một worker nhận"""
+    res = r.brpop(PREWARM_JOBS_KEY, timeout=timeout)
+    if not res:
         return None
     try:
-        return json.loads(val)
+        return json.loads(res[1])
     except Exception:
         return None
 
+def prewarm_queue_length() -> int:
+    return int(r.llen(PREWARM_JOBS_KEY))
+
+def set_prewarm_status(status: Dict[str, Any]):
+    r.set(PREWARM_STATUS_KEY, json.dumps(status, ensure_ascii=False))
+
+def prewarm_status() -> Dict[str, Any]:
+    raw = r.get(PREWARM_STATUS_KEY)
+    try:
+        return json.loads(raw) if raw else {"state": "idle"}
+    except Exception:
+        return {"state": "idle"}
+
+# ========= Recent response store (to link request_id -> question/groups/response) =========
+def recent_set(request_id: str, record: Dict[str, Any], ttl_sec: int = 86400,
+               answer_key: Optional[str] = None):
+    """
+    Store recent request data for feedback tracking.
+    answer_key: response chính là answer đang cache ở key này → chỉ lưu pointer
+    (+ id của response để nhận ra answer đã bị thay), không copy cả response.
+    """
+    rec = dict(record)
+    if rec.get("question") is not None:
+        rec["qhash"] = _qhash(rec["question"], rec.get("conv", ""))
+    resp = rec.get("response")
+    if answer_key and isinstance(resp, dict) and resp.get("id"):
+        del rec["response"]
+        rec["answer_key"] = answer_key
+        rec["answer_id"] = resp["id"]
+    _put(f"recent:{request_id}", rec, ttl_sec, "recent")
+
+def recent_get(request_id: str) -> Optional[Dict[str, Any]]:
+    """Get recent request data (response đọc lại từ answer key nếu record chỉ giữ pointer)"""
+    rec = _get(f"recent:{request_id}")
+    if rec is None or "response" in rec or not rec.get("answer_key"):
+        return rec
+    obj = _get(rec["answer_key"])
+    if obj is None or obj.get("id") != rec.get("answer_id"):
+        # answer đã hết hạn / bị invalidate / được sinh lại
+        rec["response"] = None
+        return rec
+    meta = obj.setdefault("rag_meta", {})
+    meta["request_id"] = request_id
+    meta["feedback_url"] = f"/api/feedback/ui?request_id={request_id}"
+    if rec.get("cached"):
+        meta["cache"] = {"hit": True, "bypassed": False}
+    rec["response"] = obj
+    return rec
+
 # ========= Admin listing helpers =========
 def scan_keys(pattern: str, limit: int = 200) -> List[str]:
     """Scan Redis keys matching pattern (non-blocking SCAN)"""
@@ -117,25 +1135,73 @@ def key_ttl(key: str) -> int:
     return int(r.ttl(key))
 
 def get_json(key: str) -> Optional[Dict[str, Any]]:
-    """Get JSON value from Redis key"""
-    val = r.get(key)
-    if not val:
+    """Get JSON value from Redis key (decode compact codec nếu cần)"""
+    return _get(key)
+
+def put_json(key: str, payload: Dict[str, Any], ttl_sec: int):
+    """Write value with compact codec (admin override)"""
+    kind = key.split(":", 1)[0]
+    _put(key, payload, ttl_sec, kind)
+    _invalidate([key])
+
+def value_format(key: str) -> str:
+    """Storage format of a key: json | msgpack-zstd | msgpack-zstd-dict | none"""
+    return codec.format_name(rb.get(key))
+
+# ========= Codec dictionary =========
+def train_codec_dict(sample_limit: int = 2000) -> Optional[Dict[str, Any]]:
+    """
+    Train zstd dictionary từ các ans:*/recent:* hiện có rồi kích hoạt cho mọi worker.
+    Trả về None nếu không đủ mẫu hoặc thiếu msgpack/zstandard.
+    """
+    if not codec.enabled():
         return None
-    try:
-        return json.loads(val)
-    except Exception:
+    samples = []
+    for pattern in ("ans:*", "recent:*"):
+        for k in scan_keys(pattern, limit=sample_limit // 2):
+            obj = _get(k)
+            if obj is not None:
+                samples.append(obj)
+    raw = codec.train_dictionary(samples)
+    if not raw:
         return None
+    dict_id = codec.dict_id_of(raw)
+    rb.set(f"{CODEC_DICT_PREFIX}{dict_id}", raw)
+    r.set(CODEC_CURRENT_KEY, str(dict_id))
+    _payload_codec.use_dict(dict_id)
+    return {"dict_id": dict_id, "samples": len(samples), "dict_bytes": len(raw)}
+
+def codec_stats() -> Dict[str, Any]:
+    """Dung lượng JSON gốc vs dung lượng thực lưu trong Redis, theo prefix"""
+    _sync_codec_dict()
+    raw = r.hgetall(CODEC_STATS_KEY) or {}
+    out: Dict[str, Any] = {
+        "format": "msgpack-zstd" if codec.enabled() else "json",
+        "dict_id": _payload_codec.current_dict_id,
+    }
+    for kind in ("ans", "recent"):
+        jb = int(raw.get(f"{kind}:json_bytes", 0))
+        sb = int(raw.get(f"{kind}:stored_bytes", 0))
+        out[kind] = {
+            "writes": int(raw.get(f"{kind}:writes", 0)),
+            "json_bytes": jb,
+            "stored_bytes": sb,
+            "saved_bytes": jb - sb,
+            "ratio": round(sb / jb, 3) if jb else None,
+        }
+    return out
 
 def delete_key(key: str):
     """Delete any Redis key"""
     r.delete(key)
+    _invalidate([key])
 
 def parse_cache_key(key: str) -> Tuple[str, str, str, str]:
     """
     Parse cache key structure:
-    ans:<ver>:<groups_hash>:<qhash>
-    bad:<ver>:<groups_hash>:<qhash>
-    Returns: (type, version, groups_hash, qhash)
+    ans:<scope_version>:<scope_hash>:<qhash>
+    bad:<scope_version>:<scope_hash>:<qhash>
+    Returns: (type, scope_version, scope_hash, qhash)
     """
     parts = key.split(":")
     if len(parts) != 4:
@@ -149,16 +1215,55 @@ def ping() -> bool:
     except Exception:
         return False
 
+def tier_stats() -> Dict[str, Any]:
+    """L1 (in-process) vs L2 (Redis) hit rates, tổng hợp mọi worker"""
+    _flush_tier_stats()
+    raw = {k: int(v) for k, v in (r.hgetall(TIER_STATS_KEY) or {}).items()}
+    ans_l1 = raw.get("ans:l1_hits", 0)
+    ans_l2 = raw.get("ans:l2_hits", 0)
+    ans_miss = raw.get("ans:misses", 0)
+    ans_total = ans_l1 + ans_l2 + ans_miss
+    bad_l1 = raw.get("bad:l1_hits", 0)
+    bad_l2 = raw.get("bad:l2_lookups", 0)
+    return {
+        "l1": {
+            "enabled": L1_ENABLED,
+            "entries_this_worker": len(_l1),
+            "max_entries": L1_MAX_ENTRIES,
+            "ttl_sec": L1_TTL_SEC,
+        },
+        "ans": {
+            "lookups": ans_total,
+            "l1_hits": ans_l1,
+            "l2_hits": ans_l2,
+            "misses": ans_miss,
+            "l1_hit_rate": round(ans_l1 / ans_total, 3) if ans_total else None,
+            # L2 hit rate tính trên các lookup đã miss L1
+            "l2_hit_rate": round(ans_l2 / (ans_l2 + ans_miss), 3) if (ans_l2 + ans_miss) else None,
+        },
+        "bad_checks": {
+            "lookups": bad_l1 + bad_l2 + raw.get("bad:bloom_negatives", 0),
+            "l1_hits": bad_l1,
+            "l2_lookups": bad_l2,
+            "l1_hit_rate": round(bad_l1 / (bad_l1 + bad_l2), 3) if (bad_l1 + bad_l2) else None,
+            "bloom": bad_bloom_stats(),
+        },
+    }
+
 def cache_stats() -> Dict[str, Any]:
     """Get cache statistics"""
     info = r.info()
     return {
         "corpus_version": corpus_version(),
+        "group_versions": group_versions(),
         "redis": {
             "used_memory_human": info.get("used_memory_human"),
             "total_keys": r.dbsize(),
             "uptime_in_days": info.get("uptime_in_days"),
-        }
+        },
+        "codec": codec_stats(),
+        "tiers": tier_stats(),
+        "retrieval": retrieval_stats(),
     }
 
 
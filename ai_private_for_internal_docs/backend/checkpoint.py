@@ -0,0 +1,191 @@
+"""
+Durable ingest checkpoints (SQLite trong CACHE_DIR, cạnh OCR cache).
+
+Mỗi lần chạy ingest.py là một run. Ghi lại:
+  files   : file đã bắt đầu / xong / lỗi (kèm mtime+size để biết file có đổi không)
+  batches : mỗi lần upsert thành công (một page PDF hoặc cả file) + số chunks
+
+`python ingest.py --resume` tiếp tục run dang dở gần nhất của cùng target:
+bỏ qua file đã xong (nếu chưa đổi) và page đã upsert. Point id là stable_id
+theo source/page/chunk nên upsert lại một batch dở dang là idempotent.
+"""
+from __future__ import annotations
+import os
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from utils import ensure_dir
+
+CHECKPOINT_DB = os.environ.get(
+    "INGEST_CHECKPOINT_DB",
+    str(Path(os.environ.get("CACHE_DIR", "/app/.cache")) / "ingest_checkpoints.sqlite"),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    target TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    report TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    run_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime REAL,
+    size INTEGER,
+    doc_group TEXT,
+    is_new INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    docs INTEGER NOT NULL DEFAULT 0,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (run_id, path)
+);
+CREATE TABLE IF NOT EXISTS batches (
+    run_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    chunks INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    PRIMARY KEY (run_id, path, page)
+);
+"""
+
+def file_signature(path: Path) -> Tuple[float, int]:
+    st = path.stat()
+    return st.st_mtime, st.st_size
+
+class IngestCheckpoint:
+    def __init__(self, db_path: str = CHECKPOINT_DB):
+        ensure_dir(Path(db_path).parent)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        self.run_id: Optional[str] = None
+
+    # ---------- runs ----------
+    def start_run(self, target: str) -> str:
+        self.run_id = uuid.uuid4().hex[:12]
+        with self.conn:
+            self.conn.execute("INSERT INTO runs(run_id, target, started_at) VALUES (?,?,?)",
+                              (self.run_id, target, time.time()))
+        return self.run_id
+
+    def resume_run(self, target: str, run_id: Optional[str] = None) -> Optional[str]:
+        """Mở lại run chưa finish gần nhất của target (hoặc run_id chỉ định)"""
+        if run_id:
+            row = self.conn.execute("SELECT run_id FROM runs WHERE run_id=?", (run_id,)).fetchone()
+        else:
+            row = self.conn.execute(
+                "SELECT run_id FROM runs WHERE target=? AND finished_at IS NULL ORDER BY started_at DESC LIMIT 1",
+                (target,),
+            ).fetchone()
+        self.run_id = row[0] if row else None
+        return self.run_id
+
+    def finish_run(self, report: str):
+        with self.conn:
+            self.conn.execute("UPDATE runs SET finished_at=?, report=? WHERE run_id=?",
+                              (time.time(), report, self.run_id))
+
+    # ---------- files / batches ----------
+    def file_row(self, path: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(
+            "SELECT mtime, size, doc_group, is_new, status FROM files WHERE run_id=? AND path=?",
+            (self.run_id, path),
+        ).fetchone()
+        if not row:
+            return None
+        return {"mtime": row[0], "size": row[1], "doc_group": row[2], "is_new": bool(row[3]), "status": row[4]}
+
+    def is_done(self, path: Path) -> bool:
+        """File đã ingest xong trong run này và chưa bị sửa từ đó"""
+        row = self.file_row(str(path))
+        return bool(row) and row["status"] == "done" and (row["mtime"], row["size"]) == file_signature(path)
+
+    def begin_file(self, path: Path, doc_group: Optional[str], is_new: bool) -> Optional[Dict[str, Any]]:
+        """
+        Đánh dấu file đang ingest. Trả về row cũ (nếu có) để giữ is_new của lần đầu.
+        File đã đổi từ lần trước → bỏ các batch cũ của nó.
+        """
+        prev = self.file_row(str(path))
+        mtime, size = file_signature(path)
+        changed = prev is not None and (prev["mtime"], prev["size"]) != (mtime, size)
+        with self.conn:
+            if changed:
+                self.conn.execute("DELETE FROM batches WHERE run_id=? AND path=?", (self.run_id, str(path)))
+            self.conn.execute(
+                "INSERT INTO files(run_id, path, mtime, size, doc_group, is_new, status) VALUES (?,?,?,?,?,?,'running') "
+                "ON CONFLICT(run_id, path) DO UPDATE SET mtime=excluded.mtime, size=excluded.size, status='running', error=NULL",
+                (self.run_id, str(path), mtime, size, doc_group, int(is_new)),
+            )
+        return prev
+
+    def done_pages(self, path: Path) -> Set[int]:
+        rows = self.conn.execute("SELECT page FROM batches WHERE run_id=? AND path=?", (self.run_id, str(path)))
+        return {r[0] for r in rows}
+
+    def record_batch(self, path: Path, page: Optional[int], chunks: int):
+        """Sau mỗi upsert thành công (page=None → cả file, lưu là 0)"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO batches(run_id, path, page, chunks, ts) VALUES (?,?,?,?,?)",
+                (self.run_id, str(path), page or 0, chunks, time.time()),
+            )
+
+    def finish_file(self, path: Path):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE files SET status='done', "
+                "docs=(SELECT COUNT(*) FROM batches b WHERE b.run_id=files.run_id AND b.path=files.path), "
+                "chunks=(SELECT COALESCE(SUM(chunks),0) FROM batches b WHERE b.run_id=files.run_id AND b.path=files.path) "
+                "WHERE run_id=? AND path=?",
+                (self.run_id, str(path)),
+            )
+
+    def fail_file(self, path: Path, error: str):
+        with self.conn:
+            self.conn.execute("UPDATE files SET status='failed', error=? WHERE run_id=? AND path=?",
+                              (error[:1000], self.run_id, str(path)))
+
+    def sources(self) -> List[Tuple[str, Optional[str], bool]]:
+        """(path, doc_group, is_new) của mọi file đã đụng tới trong run (kể cả trước khi resume)"""
+        rows = self.conn.execute("SELECT path, doc_group, is_new FROM files WHERE run_id=?", (self.run_id,))
+        return [(r[0], r[1], bool(r[2])) for r in rows]
+
+    def totals(self) -> Dict[str, int]:
+        rows = self.conn.execute(
+            "SELECT status, COUNT(*), SUM(docs), SUM(chunks) FROM files WHERE run_id=? GROUP BY status", (self.run_id,)
+        ).fetchall()
+        out = {"files_done": 0, "files_failed": 0, "files_running": 0, "docs": 0, "chunks": 0}
+        for status, n, docs, chunks in rows:
+            out[f"files_{status}"] = n
+            if status == "done":
+                out["docs"] = docs or 0
+                out["chunks"] = chunks or 0
+        return out
+
+    def consistency_report(self, store) -> Dict[str, Any]:
+        """
+        So sánh số chunks đã ghi checkpoint với số points thật trong Qdrant theo source.
+        missing: Qdrant ít hơn checkpoint (upsert bị mất); extra: chunk cũ từ phiên bản trước của file.
+        """
+        rows = self.conn.execute(
+            "SELECT path, chunks FROM files WHERE run_id=? AND status='done'", (self.run_id,)
+        ).fetchall()
+        missing, extra = [], []
+        for path, expected in rows:
+            actual = store.count_source(path)
+            if actual < expected:
+                missing.append({"path": path, "expected": expected, "actual": actual})
+            elif actual > expected:
+                extra.append({"path": path, "expected": expected, "actual": actual})
+        failed = [
+            {"path": r[0], "error": r[1]}
+            for r in self.conn.execute("SELECT path, error FROM files WHERE run_id=? AND status='failed'", (self.run_id,))
+        ]
+        return {"run_id": self.run_id, **self.totals(), "missing": missing, "extra": extra, "failed": failed}
@@ -0,0 +1,151 @@
+"""
+Compact codec cho cache payloads trong Redis (ans:*, recent:*).
+
+Format (bytes), version nằm ở 2 byte đầu để đọc được cả dữ liệu cũ:
+  legacy JSON : b"{..." / b"[..."  (giá trị ghi bởi các version trước)
+  v1          : b"\\x00\\x01" + zstd(msgpack(obj))
+  v2          : b"\\x00\\x02" + dict_id (4 bytes, big-endian) + zstd_dict(msgpack(obj))
+
+v2 dùng zstd dictionary đã train từ các payload thật (train_dictionary) nên nén
+tốt hơn nhiều với payload nhỏ, lặp cấu trúc (OpenAI response + rag_meta).
+Nếu thiếu msgpack/zstandard thì tự fallback về JSON.
+"""
+from __future__ import annotations
+import json
+import os
+import struct
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+try:
+    import msgpack
+    import zstandard as zstd
+    CODEC_AVAILABLE = True
+except Exception:
+    CODEC_AVAILABLE = False
+
+MAGIC = b"\x00"
+V1 = b"\x01"
+V2 = b"\x02"
+
+CODEC = os.environ.get("CACHE_CODEC", "msgpack-zstd").lower()
+ZSTD_LEVEL = int(os.environ.get("CACHE_ZSTD_LEVEL", "3"))
+DICT_SIZE = int(os.environ.get("CACHE_ZSTD_DICT_KB", "110")) * 1024
+
+def enabled() -> bool:
+    return CODEC_AVAILABLE and CODEC != "json"
+
+class Codec:
+    """
+    Encode/decode cache values.
+    dict_loader(dict_id) -> raw dictionary bytes (lấy từ Redis), được gọi lazy
+    khi gặp dict_id chưa có trong process.
+    """
+    def __init__(self, dict_loader: Optional[Callable[[int], Optional[bytes]]] = None):
+        self._dict_loader = dict_loader
+        self._dicts: Dict[int, Any] = {}
+        self._current_id: Optional[int] = None
+        # zstd contexts không thread-safe → mỗi thread một bộ
+        self._local = threading.local()
+
+    # ---------- dictionary management ----------
+    def _get_dict(self, dict_id: int):
+        d = self._dicts.get(dict_id)
+        if d is None and self._dict_loader:
+            raw = self._dict_loader(dict_id)
+            if raw:
+                d = zstd.ZstdCompressionDict(raw)
+                self._dicts[dict_id] = d
+        return d
+
+    def use_dict(self, dict_id: Optional[int]):
+        """Chọn dictionary dùng khi encode (None = không dùng dictionary)."""
+        if dict_id is not None and self._get_dict(dict_id) is None:
+            dict_id = None
+        self._current_id = dict_id
+
+    @property
+    def current_dict_id(self) -> Optional[int]:
+        return self._current_id
+
+    def _contexts(self, name: str) -> Dict[Optional[int], Any]:
+        ctx = getattr(self._local, name, None)
+        if ctx is None:
+            ctx = {}
+            setattr(self._local, name, ctx)
+        return ctx
+
+    def _compressor(self, dict_id: Optional[int]):
+        cctx = self._contexts("cctx")
+        c = cctx.get(dict_id)
+        if c is None:
+            d = self._dicts.get(dict_id) if dict_id is not None else None
+            c = zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=d)
+            cctx[dict_id] = c
+        return c
+
+    def _decompressor(self, dict_id: Optional[int]):
+        dctx = self._contexts("dctx")
+        c = dctx.get(dict_id)
+        if c is None:
+            d = self._get_dict(dict_id) if dict_id is not None else None
+            if dict_id is not None and d is None:
+                raise ValueError(f"unknown zstd dictionary id={dict_id}")
+            c = zstd.ZstdDecompressor(dict_data=d)
+            dctx[dict_id] = c
+        return c
+
+    # ---------- encode / decode ----------
+    def encode(self, obj: Any) -> bytes:
+        if not enabled():
+            return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        packed = msgpack.packb(obj, use_bin_type=True)
+        dict_id = self._current_id
+        if dict_id is None:
+            return MAGIC + V1 + self._compressor(None).compress(packed)
+        return MAGIC + V2 + struct.pack(">I", dict_id) + self._compressor(dict_id).compress(packed)
+
+    def decode(self, raw: Optional[bytes]) -> Any:
+        if raw is None:
+            return None
+        if isinstance(raw, str):
+            return json.loads(raw)
+        if not raw.startswith(MAGIC):
+            # legacy JSON value
+            return json.loads(raw.decode("utf-8"))
+        if not CODEC_AVAILABLE:
+            raise ValueError("compact cache value but msgpack/zstandard not installed")
+        ver = raw[1:2]
+        if ver == V1:
+            return msgpack.unpackb(self._decompressor(None).decompress(raw[2:]), raw=False)
+        if ver == V2:
+            (dict_id,) = struct.unpack(">I", raw[2:6])
+            return msgpack.unpackb(self._decompressor(dict_id).decompress(raw[6:]), raw=False)
+        raise ValueError(f"unknown cache codec version {ver!r}")
+
+def format_name(raw: Optional[bytes]) -> str:
+    """Tên format của một giá trị đã lưu (dùng cho admin/stats)."""
+    if not raw:
+        return "none"
+    if isinstance(raw, str) or not raw.startswith(MAGIC):
+        return "json"
+    return {V1: "msgpack-zstd", V2: "msgpack-zstd-dict"}.get(raw[1:2], "unknown")
+
+def train_dictionary(samples: Iterable[Any], dict_size: int = DICT_SIZE) -> Optional[bytes]:
+    """
+    Train zstd dictionary từ các object mẫu (đã decode).
+    Trả về raw dictionary bytes, hoặc None nếu không đủ mẫu.
+    """
+    if not CODEC_AVAILABLE:
+        return None
+    packed: List[bytes] = [msgpack.packb(s, use_bin_type=True) for s in samples]
+    if len(packed) < 8:
+        return None
+    try:
+        d = zstd.train_dictionary(dict_size, packed)
+    except zstd.ZstdError:
+        return None
+    return d.as_bytes()
+
+def dict_id_of(raw_dict: bytes) -> int:
+    return zstd.ZstdCompressionDict(raw_dict).dict_id()
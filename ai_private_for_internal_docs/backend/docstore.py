@@ -0,0 +1,145 @@
+"""
+Local compressed docstore cho chunk text (thay vì payload "text" trong Qdrant).
+
+    DOCSTORE_ENABLED=true   DOCSTORE_DB=/app/.cache/docstore.sqlite
+
+Payload Qdrant chỉ còn field để filter / trích dẫn (source, page_number, chunk_index,
+doc_group, doc_groups, aliases) → collection nhỏ hơn nhiều trong RAM, search with_payload nhanh hơn.
+Text nằm trong SQLite (WAL, dùng chung giữa backend và ingest-watcher qua volume cache),
+nén zstd từng chunk, key = point id. RagStore.search hydrate text cho top-k cuối cùng
+bằng một lần đọc batch.
+
+    python docstore.py migrate    # chuyển text của collection hiện có sang docstore
+    python docstore.py stats
+"""
+from __future__ import annotations
+import os
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils import ensure_dir
+
+try:
+    import zstandard as zstd
+    ZSTD_AVAILABLE = True
+except Exception:
+    ZSTD_AVAILABLE = False
+
+DOCSTORE_ENABLED = os.environ.get("DOCSTORE_ENABLED", "false").lower() in ("1", "true", "yes")
+DOCSTORE_DB = os.environ.get(
+    "DOCSTORE_DB",
+    str(Path(os.environ.get("CACHE_DIR", "/app/.cache")) / "docstore.sqlite"),
+)
+DOCSTORE_ZSTD_LEVEL = int(os.environ.get("DOCSTORE_ZSTD_LEVEL", "9"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    source TEXT,
+    body BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source);
+"""
+
+# byte đầu của body: codec đã dùng (đọc được dữ liệu ghi khi chưa có / đã có zstandard)
+_ZSTD, _ZLIB = b"z", b"d"
+
+def _compress(text: str) -> bytes:
+    raw = text.encode("utf-8")
+    if ZSTD_AVAILABLE:
+        return _ZSTD + zstd.ZstdCompressor(level=DOCSTORE_ZSTD_LEVEL).compress(raw)
+    return _ZLIB + zlib.compress(raw, 6)
+
+def _decompress(body: bytes) -> str:
+    tag, data = body[:1], body[1:]
+    raw = zstd.ZstdDecompressor().decompress(data) if tag == _ZSTD else zlib.decompress(data)
+    return raw.decode("utf-8")
+
+class DocStore:
+    def __init__(self, db_path: str = DOCSTORE_DB):
+        ensure_dir(Path(db_path).parent)
+        self.db_path = db_path
+        # một connection mỗi thread (API đọc song song từ thread pool)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put_many(self, items: Iterable[Tuple[str, Optional[str], str]]):
+        """items: (point id, source, text)"""
+        rows = [(str(pid), source, _compress(text or "")) for pid, source, text in items]
+        if not rows:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO chunks(id, source, body) VALUES (?,?,?)", rows)
+
+    def get_many(self, ids: List[str]) -> Dict[str, str]:
+        out: Dict[str, str] = {}
+        conn = self._conn()
+        ids = [str(i) for i in ids]
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            for pid, body in conn.execute(
+                    f"SELECT id, body FROM chunks WHERE id IN ({','.join('?' * len(part))})", part):
+                out[pid] = _decompress(body)
+        return out
+
+    def delete_source(self, source: str) -> int:
+        conn = self._conn()
+        with conn:
+            return conn.execute("DELETE FROM chunks WHERE source=?", (source,)).rowcount
+
+    def delete_ids(self, ids: List[str]):
+        conn = self._conn()
+        with conn:
+            conn.executemany("DELETE FROM chunks WHERE id=?", [(str(i),) for i in ids])
+
+    def stats(self) -> Dict[str, int]:
+        n, stored = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM chunks").fetchone()
+        return {"chunks": n, "stored_bytes": stored}
+
+def migrate(store_cfg=None, batch: int = 512) -> Dict[str, int]:
+    """Chuyển payload "text" của collection hiện có vào docstore rồi xoá khỏi payload"""
+    from ingest import make_config
+    from rag import make_vector_client
+
+    cfg = store_cfg or make_config()
+    client = make_vector_client(cfg)
+    ds = DocStore(cfg.docstore_path or DOCSTORE_DB)
+    moved, offset = 0, None
+    while True:
+        recs, offset = client.scroll(collection_name=cfg.collection, with_payload=["source", "text"],
+                                     with_vectors=False, limit=batch, offset=offset)
+        items = [(str(r.id), (r.payload or {}).get("source"), r.payload["text"])
+                 for r in recs if (r.payload or {}).get("text") is not None]
+        if items:
+            # ghi docstore trước, xoá payload sau: search luôn thấy text ở một trong hai nơi
+            ds.put_many(items)
+            client.delete_payload(collection_name=cfg.collection, keys=["text"], points=[pid for pid, _, _ in items])
+            moved += len(items)
+        if offset is None:
+            break
+    return {"moved": moved, **ds.stats()}
+
+def main():
+    import argparse
+    import json
+    ap = argparse.ArgumentParser(description="Chunk text docstore")
+    ap.add_argument("command", choices=["migrate", "stats"])
+    args = ap.parse_args()
+    res = migrate() if args.command == "migrate" else DocStore().stats()
+    print(json.dumps(res))
+
+if __name__ == "__main__":
+    main()
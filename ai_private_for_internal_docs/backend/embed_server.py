@@ -0,0 +1,164 @@
+"""
+Shared embedding server: load SentenceTransformer một lần cho cả API workers và ingest.
+
+    python embed_server.py --host 0.0.0.0 --port 8090      (service embedder trong docker-compose)
+
+Protocol (HTTP, binary reply, không trả JSON list of floats):
+    POST /embed   body JSON {"texts": [...], "normalize": true}
+                  → 200 application/octet-stream: float32 little-endian, row-major
+                    headers X-Embedding-Count, X-Embedding-Dim
+    GET  /info    → {"model", "dim"}
+    GET  /stats   → micro-batching metrics (batch size, queue delay)
+    GET  /health  → {"ok": true}
+
+EmbedClient có cùng interface với SentenceTransformer (encode,
+get_sentence_embedding_dimension) nên RagStore dùng thay thế trực tiếp khi
+EMBED_SERVER_URL được đặt.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+import requests
+
+from microbatch import MicroBatcher
+
+# request nhỏ (query từ API workers) đi qua micro-batcher để gom giữa các process
+SMALL_REQUEST = int(os.environ.get("EMBED_MICROBATCH_MAX_TEXTS", "4"))
+
+class EmbedClient:
+    """Client cho embed_server (drop-in cho SentenceTransformer trong RagStore)"""
+    def __init__(self, url: str, timeout: float = 60.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+        self._dim: Optional[int] = None
+
+    def _session(self) -> requests.Session:
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = requests.Session()
+            self._local.session = s
+        return s
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dim is None:
+            r = self._session().get(f"{self.url}/info", timeout=self.timeout)
+            r.raise_for_status()
+            self._dim = int(r.json()["dim"])
+        return self._dim
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True, **_) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        r = self._session().post(
+            f"{self.url}/embed",
+            data=json.dumps({"texts": list(texts), "normalize": normalize_embeddings}, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            timeout=self.timeout,
+        )
+        if r.status_code >= 400:
+            raise RuntimeError(f"embed server error {r.status_code}: {r.text[:300]}")
+        n = int(r.headers["X-Embedding-Count"])
+        dim = int(r.headers["X-Embedding-Dim"])
+        return np.frombuffer(r.content, dtype="<f4").reshape(n, dim)
+
+class _Model:
+    def __init__(self, name: str, batch_size: int):
+        from sentence_transformers import SentenceTransformer
+        self.name = name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        # một forward pass tại một thời điểm; request song song xếp hàng ở đây
+        self._lock = threading.Lock()
+        wait_ms = float(os.environ.get("QUERY_BATCH_WAIT_MS", "3"))
+        self.batcher = MicroBatcher(lambda ts: self.encode(ts, True), batch_size, wait_ms, name="server") \
+            if wait_ms > 0 else None
+
+    def encode_small(self, texts: List[str]) -> np.ndarray:
+        futs = [self.batcher.submit(t) for t in texts]
+        return np.stack([f.result() for f in futs]).astype("<f4")
+
+    def encode(self, texts: List[str], normalize: bool) -> np.ndarray:
+        with self._lock:
+            vecs = self.model.encode(texts, normalize_embeddings=normalize, batch_size=self.batch_size)
+        return np.ascontiguousarray(vecs, dtype="<f4")
+
+def make_handler(model: _Model):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _json(self, code: int, obj):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._json(200, {"ok": True})
+            elif self.path == "/info":
+                self._json(200, {"model": model.name, "dim": model.dim})
+            elif self.path == "/stats":
+                self._json(200, model.batcher.stats() if model.batcher else {})
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/embed":
+                self._json(404, {"error": "not found"})
+                return
+            try:
+                n = int(self.headers.get("Content-Length") or 0)
+                req = json.loads(self.rfile.read(n) or b"{}")
+                texts = req.get("texts") or []
+                if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                    raise ValueError("texts must be a list of strings")
+            except Exception as e:
+                self._json(400, {"error": str(e)})
+                return
+            normalize = bool(req.get("normalize", True))
+            if not texts:
+                vecs = np.zeros((0, model.dim), "<f4")
+            elif model.batcher and normalize and len(texts) <= SMALL_REQUEST:
+                vecs = model.encode_small(texts)
+            else:
+                vecs = model.encode(texts, normalize)
+            body = vecs.tobytes()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("X-Embedding-Count", str(vecs.shape[0]))
+            self.send_header("X-Embedding-Dim", str(model.dim))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+def main():
+    ap = argparse.ArgumentParser(description="Shared embedding server")
+    ap.add_argument("--host", default=os.environ.get("EMBED_SERVER_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.environ.get("EMBED_SERVER_PORT", "8090")))
+    ap.add_argument("--model", default=os.environ.get("EMBED_MODEL", "sentence-transformers/bge-m3"))
+    ap.add_argument("--batch-size", type=int, default=int(os.environ.get("EMBED_BATCH_SIZE", "32")))
+    args = ap.parse_args()
+
+    model = _Model(args.model, args.batch_size)
+    srv = ThreadingHTTPServer((args.host, args.port), make_handler(model))
+    srv.daemon_threads = True
+    print(f"[embed] model={args.model} dim={model.dim} listening on {args.host}:{args.port}")
+    srv.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,121 @@
 from __future__ import annotations
 from pathlib import Path
 import os
-from typing import Optional
+import json
+from typing import Optional, Dict, Any, Tuple
 
-from loaders import load_documents, load_pdf_pages, load_txt, load_docx, load_md
+from loaders import load_pdf_pages, load_docx, load_md, iter_text_chunks, plan_text_windows
 from rag import RagConfig, RagStore
+from checkpoint import IngestCheckpoint
+from dedup import DedupIndex, DEDUP_ENABLED
+from docstore import DOCSTORE_ENABLED, DOCSTORE_DB
+from cache import (
+    register_corpus_groups, bump_group_versions, invalidate_sources,
+    stage_group_versions, enqueue_prewarm, PUBLIC_GROUP,
+)
+from prewarm import PREWARM_ENABLED
+
+# source: chỉ xoá answer đã retrieve từ source bị re-ingest (dependency index);
+# group: bump version của mọi doc_group vừa ingest
+INVALIDATION_MODE = os.environ.get("INGEST_INVALIDATION", "source").lower()
+# ghi checkpoint cho mỗi lần chạy ingest.py (resume bằng --resume)
+INGEST_CHECKPOINT = os.environ.get("INGEST_CHECKPOINT", "true").lower() in ("1", "true", "yes")
+# flush BulkWriter (barrier) sau mỗi N file → checkpoint chỉ ghi những gì đã durable
+INGEST_FLUSH_EVERY = int(os.environ.get("INGEST_FLUSH_EVERY", "20"))
+
+DOCS_BASE = Path("/app/docs")
+
+_registered_groups: set = set()
+# source đã ingest trong lần chạy này: source -> (doc_group, is_new)
+_ingested_sources: Dict[str, Tuple[Optional[str], bool]] = {}
+
+def _before_upsert(store: RagStore, source: str, doc_group: Optional[str]):
+    """
+    Add doc_group to the cache scope set BEFORE upserting its chunks,
+    so answer keys never omit a group that search can already see.
+    Also remember whether the source is new (no chunks yet) for cache invalidation.
+    """
+    if source not in _ingested_sources:
+        _ingested_sources[source] = (doc_group, not store.has_source(source))
+    if doc_group and doc_group not in _registered_groups:
+        register_corpus_groups([doc_group])
+        _registered_groups.add(doc_group)
+
+def invalidate_caches() -> Dict[str, Any]:
+    """
+    Invalidate answer cache cho những gì vừa ingest.
+    - Source đã có trước đó: chỉ xoá các answer phụ thuộc (không bump version).
+    - Source mới: chưa answer nào retrieve nó → bump version của group chứa nó,
+      để câu hỏi liên quan được trả lời lại với tài liệu mới.
+    PREWARM_ENABLED: chỉ stage versions + enqueue job; API pre-warm top câu hỏi rồi mới commit.
+    """
+    if INVALIDATION_MODE == "group":
+        groups = {g for g, _ in _ingested_sources.values()}
+        changed = []
+    else:
+        changed = [s for s, (_, is_new) in _ingested_sources.items() if not is_new]
+        groups = {g for g, is_new in _ingested_sources.values() if is_new}
+    if not groups and not changed:
+        return {}
+    if PREWARM_ENABLED:
+        staged = stage_group_versions(groups) if groups else {}
+        enqueue_prewarm({"groups": sorted(g or PUBLIC_GROUP for g in groups), "sources": changed})
+        return {"prewarm": {"staged": staged, "sources": len(changed)}}
+    if INVALIDATION_MODE == "group":
+        return {"group_versions": bump_group_versions(groups)}
+    out: Dict[str, Any] = {}
+    if changed:
+        res = invalidate_sources(changed)
+        out["selective"] = {"sources": res["sources"], "removed": res["removed"]}
+    if groups:
+        out["group_versions"] = bump_group_versions(groups)
+    return out
+
+def reset_ingest_state():
+    """Quên các source đã ghi nhận (watcher gọi sau mỗi batch đã invalidate)"""
+    _ingested_sources.clear()
+
+def make_config() -> RagConfig:
+    return RagConfig(
+        qdrant_url=os.environ.get("QDRANT_URL", "http://qdrant:6333"),
+        collection=os.environ.get("QDRANT_COLLECTION", "internal_docs"),
+        embed_model=os.environ.get("EMBED_MODEL", "sentence-transformers/bge-m3"),
+        chunk_size=int(os.environ.get("CHUNK_SIZE", "900")),
+        chunk_overlap=int(os.environ.get("CHUNK_OVERLAP", "150")),
+        top_k=int(os.environ.get("TOP_K", "6")),
+        embed_url=os.environ.get("EMBED_SERVER_URL", ""),
+        upsert_batch_size=int(os.environ.get("QDRANT_UPSERT_BATCH", "256")),
+        upsert_concurrency=int(os.environ.get("QDRANT_UPSERT_CONCURRENCY", "4")),
+        upsert_max_inflight=int(os.environ.get("QDRANT_UPSERT_MAX_INFLIGHT", "8")),
+        prefer_grpc=os.environ.get("QDRANT_PREFER_GRPC", "false").lower() in ("1", "true", "yes"),
+        vector_backend=os.environ.get("VECTOR_BACKEND", "qdrant"),
+        local_index_path=os.environ.get("LOCAL_INDEX_PATH", ""),
+        local_index_dtype=os.environ.get("LOCAL_INDEX_DTYPE", "float32"),
+        docstore_path=DOCSTORE_DB if DOCSTORE_ENABLED else "",
+        content_ids=os.environ.get("CONTENT_ADDRESSED_CHUNKS", "false").lower() in ("1", "true", "yes"),
+    )
+
+def make_store() -> RagStore:
+    return RagStore(make_config(), dedup=DedupIndex() if DEDUP_ENABLED else None)
+
+def reingest_file(store: RagStore, path: Path) -> tuple[int, int]:
+    """
+    File mới hoặc vừa sửa: xoá chunks cũ của source rồi ingest lại
+    (chunk id phụ thuộc nội dung nên không xoá thì chunk cũ vẫn nằm lại).
+    """
+    source = str(path)
+    _before_upsert(store, source, infer_group_from_path(path, DOCS_BASE))
+    if not _ingested_sources[source][1]:
+        store.delete_source(source)
+    return ingest_path(store, path)
+
+def remove_file(store: RagStore, path: Path) -> int:
+    """File bị xoá: xoá chunks của nó; answer phụ thuộc bị invalidate như source re-ingest"""
+    source = str(path)
+    n = store.delete_source(source)
+    if n and source not in _ingested_sources:
+        _ingested_sources[source] = (infer_group_from_path(path, DOCS_BASE), False)
+    return n
 
 def infer_group_from_path(path: Path, base: Path) -> Optional[str]:
     """
@@ -26,101 +137,197 @@ def infer_group_from_path(path: Path, base: Path) -> Optional[str]:
     except ValueError:
         return None
 
-def ingest_path(store: RagStore, path: Path) -> tuple[int, int]:
+SUPPORTED_SUFFIXES = {".txt", ".log", ".pdf", ".docx", ".md", ".markdown"}
+
+def iter_files(path: Path):
+    """Các file có loader dưới path, thứ tự cố định (để resume đúng chỗ)"""
+    for p in sorted(path.rglob("*")):
+        if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES:
+            yield p
+
+def ingest_path(store: RagStore, path: Path, ckpt: Optional[IngestCheckpoint] = None) -> tuple[int, int]:
     """
     returns (docs_count, chunks_count)
+    Folder được ingest từng file một (không load toàn bộ vào RAM); ckpt ghi tiến độ để resume.
     """
+    if not path.is_dir():
+        return ingest_file(store, path, ckpt)
+
     docs_count = 0
     chunks_count = 0
-    base = Path("/app/docs")
-
-    if path.is_dir():
-        docs = load_documents(path)
-        for d in docs:
-            if d.get("error"):
-                print(f"[SKIP] {d['path']} error={d['error']}")
-                continue
-
-            # Infer doc_group from path
-            doc_path = Path(d["path"])
-            doc_group = infer_group_from_path(doc_path, base)
-
-            # PDF page objects have page_number
-            page_no = d.get("page_number")
-            meta = {"mode": d.get("mode")} if d.get("mode") else {}
-            if doc_group:
-                meta["doc_group"] = doc_group
+    since_flush = 0
+    for p in iter_files(path):
+        if ckpt and ckpt.is_done(p):
+            continue
+        try:
+            d, c = ingest_file(store, p, ckpt)
+        except Exception as e:
+            print(f"[SKIP] {p} error={e}")
+            if ckpt:
+                ckpt.fail_file(p, str(e))
+            continue
+        docs_count += d
+        chunks_count += c
+        since_flush += 1
+        if since_flush >= INGEST_FLUSH_EVERY:
+            store.flush()
+            since_flush = 0
+    return docs_count, chunks_count
 
-            n = store.upsert_chunked(d["path"], d["text"], page_number=page_no, meta=meta)
-            docs_count += 1
-            chunks_count += n
-            group_info = f" group={doc_group}" if doc_group else ""
-            if page_no:
-                print(f"[INGEST] {d['path']} page={page_no}{group_info} chunks={n}")
-            else:
-                print(f"[INGEST] {d['path']}{group_info} chunks={n}")
-
-        return docs_count, chunks_count
-
-    # file
+def ingest_file(store: RagStore, path: Path, ckpt: Optional[IngestCheckpoint] = None) -> tuple[int, int]:
+    """
+    Ingest một file. PDF: mỗi page một batch upsert; file khác: một batch.
+    Với ckpt: page đã upsert ở lần chạy trước được bỏ qua, mỗi batch xong được ghi lại.
+    """
+    docs_count = 0
+    chunks_count = 0
     suffix = path.suffix.lower()
-    doc_group = infer_group_from_path(path, base)
+    source = str(path)
+    doc_group = infer_group_from_path(path, DOCS_BASE)
     meta = {"doc_group": doc_group} if doc_group else {}
-    
+    _before_upsert(store, source, doc_group)
+    done_pages: set = set()
+    if ckpt:
+        prev = ckpt.begin_file(path, doc_group, _ingested_sources[source][1])
+        if prev:
+            # resume: giữ "is_new" của lần đầu thấy file (lúc đó Qdrant chưa có chunk nào)
+            _ingested_sources[source] = (doc_group, prev["is_new"])
+        done_pages = ckpt.done_pages(path)
+    group_info = f" group={doc_group}" if doc_group else ""
+
     if suffix == ".pdf":
         pages = load_pdf_pages(path)
         for p in pages:
+            if p["page_number"] in done_pages:
+                continue
             page_meta = {"mode": p.get("mode")}
             if doc_group:
                 page_meta["doc_group"] = doc_group
             n = store.upsert_chunked(p["path"], p["text"], page_number=p["page_number"], meta=page_meta)
+            if ckpt:
+                store.after_flush(lambda pg=p["page_number"], n=n: ckpt.record_batch(path, pg, n))
             docs_count += 1
             chunks_count += n
-            group_info = f" group={doc_group}" if doc_group else ""
             print(f"[INGEST] {p['path']} page={p['page_number']}{group_info} chunks={n}")
+        if ckpt:
+            store.after_flush(lambda: ckpt.finish_file(path))
         return docs_count, chunks_count
 
+    if suffix in [".txt", ".log"]:
+        return _ingest_text_stream(store, path, source, meta, group_info, ckpt)
+
     # For non-pdf single file
     text = ""
     try:
-        if suffix in [".txt", ".log"]:
-            text = load_txt(path).strip()
-        elif suffix == ".docx":
+        if suffix == ".docx":
             text = load_docx(path).strip()
         elif suffix in [".md", ".markdown"]:
             text = load_md(path).strip()
     except Exception as e:
         print(f"[SKIP] {path} error={e}")
+        if ckpt:
+            ckpt.fail_file(path, str(e))
         return 0, 0
 
     if text:
-        n = store.upsert_chunked(str(path), text, page_number=None, meta=meta)
-        group_info = f" group={doc_group}" if doc_group else ""
+        n = store.upsert_chunked(source, text, page_number=None, meta=meta)
+        if ckpt:
+            store.after_flush(lambda: (ckpt.record_batch(path, None, n), ckpt.finish_file(path)))
         print(f"[INGEST] {path}{group_info} chunks={n}")
         return 1, n
+    if ckpt:
+        store.after_flush(lambda: ckpt.finish_file(path))
     return 0, 0
 
-def main(target: Optional[str] = None):
-    cfg = RagConfig(
-        qdrant_url=os.environ["QDRANT_URL"],
-        collection=os.environ.get("QDRANT_COLLECTION", "internal_docs"),
-        embed_model=os.environ.get("EMBED_MODEL", "sentence-transformers/bge-m3"),
-        chunk_size=int(os.environ.get("CHUNK_SIZE", "900")),
-        chunk_overlap=int(os.environ.get("CHUNK_OVERLAP", "150")),
-        top_k=int(os.environ.get("TOP_K", "6")),
-    )
-    store = RagStore(cfg)
+def _ingest_text_stream(store: RagStore, path: Path, source: str, meta: Dict[str, Any], group_info: str,
+                        ckpt: Optional[IngestCheckpoint]) -> tuple[int, int]:
+    """.txt/.log: chunk trực tiếp từ mmap, upsert theo lô → RAM không phụ thuộc kích thước file"""
+    produced = 0
 
-    base = Path("/app/docs")
+    def counted(chunks):
+        nonlocal produced
+        for item in chunks:
+            produced += 1
+            yield item
+
+    try:
+        windows, policy = plan_text_windows(path)
+        if policy == "skip":
+            raise ValueError(f"file too large ({path.stat().st_size} bytes), TEXT_LARGE_FILE_POLICY=skip")
+        chunks = iter_text_chunks(path, store.cfg.chunk_size, store.cfg.chunk_overlap, windows)
+        n = store.upsert_stream(source, counted(chunks), page_number=None, meta=meta)
+    except (OSError, ValueError) as e:
+        print(f"[SKIP] {path} error={e}")
+        if ckpt:
+            ckpt.fail_file(path, str(e))
+        return 0, 0
+
+    if not produced:
+        if ckpt:
+            store.after_flush(lambda: ckpt.finish_file(path))
+        return 0, 0
+    if ckpt:
+        store.after_flush(lambda: (ckpt.record_batch(path, None, n), ckpt.finish_file(path)))
+    policy_info = f" policy={policy} windows={len(windows)}" if policy != "full" else ""
+    print(f"[INGEST] {path}{group_info}{policy_info} chunks={n}")
+    return 1, n
+
+def main(target: Optional[str] = None, resume: bool = False, run_id: Optional[str] = None,
+         checkpoint: bool = INGEST_CHECKPOINT):
+    store = make_store()
+
+    base = DOCS_BASE
     path = Path(target) if target else base
     if not path.is_absolute():
         # allow relative paths inside /app/docs
         path = (base / path).resolve()
 
-    docs, chunks = ingest_path(store, path)
+    ckpt = None
+    if checkpoint or resume:
+        ckpt = IngestCheckpoint()
+        if resume and ckpt.resume_run(str(path), run_id):
+            # file đã xong ở lần chạy trước vẫn cần được invalidate cache ở cuối run này
+            for src, group, is_new in ckpt.sources():
+                _ingested_sources.setdefault(src, (group, is_new))
+                if group:
+                    _registered_groups.add(group)
+            print(f"[CHECKPOINT] resuming run={ckpt.run_id} target={path} progress={ckpt.totals()}")
+        else:
+            ckpt.start_run(str(path))
+            print(f"[CHECKPOINT] new run={ckpt.run_id} target={path}")
+
+    docs, chunks = ingest_path(store, path, ckpt)
+    # barrier: mọi chunk đã search được trước khi invalidate cache
+    store.flush()
+    if store.writer is not None:
+        print(f"[QDRANT] upsert batches={store.writer.batches} points={store.writer.points}")
     print(f"Done. ingested_units={docs}, chunks={chunks}, target={path}")
+    if store.dedup is not None:
+        st = store.dedup.stats()
+        print(f"[DEDUP] chunks={st['chunks']} duplicates={st['duplicates']} ratio={st['dedup_ratio']:.1%}")
+
+    # Invalidate cache chỉ cho những gì vừa ingest (không bump global corpus_version)
+    res = invalidate_caches()
+    if res:
+        print(f"[CACHE] invalidation: {res}")
+
+    if ckpt:
+        report = ckpt.consistency_report(store)
+        ckpt.finish_run(json.dumps(report, ensure_ascii=False))
+        print(f"[CHECKPOINT] run={report['run_id']} files_done={report['files_done']} "
+              f"files_failed={report['files_failed']} chunks={report['chunks']} "
+              f"missing={len(report['missing'])} extra={len(report['extra'])}")
+        for m in report["missing"][:20]:
+            print(f"[CHECKPOINT] MISSING {m['path']} expected={m['expected']} actual={m['actual']}")
+        for f in report["failed"][:20]:
+            print(f"[CHECKPOINT] FAILED {f['path']} error={f['error']}")
 
 if __name__ == "__main__":
-    import sys
-    arg = sys.argv[1] if len(sys.argv) > 1 else None
-    main(arg)
+    import argparse
+    ap = argparse.ArgumentParser(description="Ingest docs into Qdrant")
+    ap.add_argument("target", nargs="?", default=None, help="file/folder, relative to /app/docs or absolute")
+    ap.add_argument("--resume", action="store_true", help="tiếp tục run dang dở gần nhất của target")
+    ap.add_argument("--run-id", default=None, help="resume một run cụ thể")
+    ap.add_argument("--no-checkpoint", action="store_true", help="không ghi checkpoint")
+    args = ap.parse_args()
+    main(args.target, resume=args.resume, run_id=args.run_id, checkpoint=not args.no_checkpoint)
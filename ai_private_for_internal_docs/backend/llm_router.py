@@ -0,0 +1,204 @@
+"""
+Health-aware router cho pool LLM backend OpenAI-compatible (vLLM replicas + fallback).
+
+    LLM_BACKENDS=http://vllm-1:8000/v1,gpu2=http://vllm-2:8000/v1   (rỗng = LLM_BASE_URL)
+    LLM_FALLBACK_URL=http://llm-cpu:8000/v1   LLM_FALLBACK_MODEL=qwen2.5-3b-instruct
+
+Chọn backend primary có điểm thấp nhất = (outstanding + 1) * EWMA latency. Backend
+lỗi liên tiếp (connection error / 5xx / 429) LLM_BREAKER_FAILURES lần → circuit
+open trong LLM_BREAKER_COOLDOWN_SEC, sau đó half-open cho đúng một request thử.
+Mọi primary bận (outstanding >= LLM_BACKEND_MAX_OUTSTANDING) hoặc open → fallback.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+LLM_BACKENDS = os.environ.get("LLM_BACKENDS", "")
+LLM_FALLBACK_URL = os.environ.get("LLM_FALLBACK_URL", "")
+LLM_FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL", "")
+# answer từ fallback chỉ cache ngắn (primary hồi phục thì trả lời lại bằng model chính); 0 = không cache
+LLM_FALLBACK_CACHE_TTL_SEC = int(os.environ.get("LLM_FALLBACK_CACHE_TTL_SEC", "600"))
+LLM_BACKEND_MAX_OUTSTANDING = int(os.environ.get("LLM_BACKEND_MAX_OUTSTANDING", "16"))
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN_SEC = float(os.environ.get("LLM_BREAKER_COOLDOWN_SEC", "30"))
+LLM_TIMEOUT_SEC = float(os.environ.get("LLM_TIMEOUT_SEC", "120"))
+# số backend thử tối đa cho một request (failover khi lỗi)
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "2"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class LLMError(Exception):
+    """Backend trả lỗi phía client (4xx) hoặc mọi lần thử đều lỗi"""
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+class LLMUnavailable(Exception):
+    """Không còn backend nào nhận request (tất cả open / bận)"""
+
+class Backend:
+    def __init__(self, name: str, url: str, model: str = "", fallback: bool = False):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.model = model
+        self.fallback = fallback
+        self.outstanding = 0
+        self.ewma_ms: Optional[float] = None
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.served = 0
+        self.errors = 0
+        self.last_error = ""
+
+    def score(self, default_ms: float) -> float:
+        return (self.outstanding + 1) * (self.ewma_ms or default_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "model": self.model or None,
+            "fallback": self.fallback,
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "latency_ms_ewma": round(self.ewma_ms, 1) if self.ewma_ms is not None else None,
+            "consecutive_failures": self.failures,
+            "served": self.served,
+            "errors": self.errors,
+            "last_error": self.last_error or None,
+        }
+
+def parse_backends(spec: str) -> List[Tuple[str, str]]:
+    """"url,name=url" → [(name, url)]"""
+    out = []
+    for i, item in enumerate(x.strip() for x in spec.split(",")):
+        if not item:
+            continue
+        name, _, url = item.partition("=") if "=" in item.split("://")[0] else ("", "", item)
+        out.append((name or f"llm-{i + 1}", url))
+    return out
+
+class LLMRouter:
+    def __init__(self, primaries: List[Backend], fallbacks: Optional[List[Backend]] = None,
+                 max_outstanding: int = LLM_BACKEND_MAX_OUTSTANDING):
+        self.primaries = primaries
+        self.fallbacks = fallbacks or []
+        self.max_outstanding = max(1, max_outstanding)
+        self._lock = threading.Lock()
+        self._session = threading.local()
+        self.fallback_served = 0
+        self.unavailable = 0
+
+    @classmethod
+    def from_env(cls, default_url: str) -> "LLMRouter":
+        primaries = [Backend(n, u) for n, u in parse_backends(LLM_BACKENDS or default_url)]
+        fallbacks = [Backend("fallback", LLM_FALLBACK_URL, LLM_FALLBACK_MODEL, fallback=True)] if LLM_FALLBACK_URL else []
+        return cls(primaries, fallbacks)
+
+    def _http(self) -> requests.Session:
+        s = getattr(self._session, "s", None)
+        if s is None:
+            s = self._session.s = requests.Session()
+        return s
+
+    # ---------- selection (giữ _lock) ----------
+    def _available(self, b: Backend, now: float) -> bool:
+        if b.state == OPEN:
+            if now - b.opened_at < LLM_BREAKER_COOLDOWN_SEC:
+                return False
+            b.state = HALF_OPEN
+        if b.state == HALF_OPEN:
+            return not b.probing
+        return b.outstanding < self.max_outstanding
+
+    def _pick(self, exclude: set) -> Optional[Backend]:
+        now = time.monotonic()
+        with self._lock:
+            for pool in (self.primaries, self.fallbacks):
+                known = [b.ewma_ms for b in pool if b.ewma_ms is not None]
+                default_ms = sum(known) / len(known) if known else 1000.0
+                cands = [b for b in pool if b.name not in exclude and self._available(b, now)]
+                if cands:
+                    b = min(cands, key=lambda x: x.score(default_ms))
+                    b.outstanding += 1
+                    if b.state == HALF_OPEN:
+                        b.probing = True
+                    return b
+        return None
+
+    def _done(self, b: Backend, ok: bool, elapsed_ms: float, error: str = ""):
+        with self._lock:
+            b.outstanding -= 1
+            b.probing = False
+            if ok:
+                b.served += 1
+                b.failures = 0
+                b.state = CLOSED
+                b.ewma_ms = elapsed_ms if b.ewma_ms is None else 0.8 * b.ewma_ms + 0.2 * elapsed_ms
+                if b.fallback:
+                    self.fallback_served += 1
+                return
+            b.errors += 1
+            b.failures += 1
+            b.last_error = error[:300]
+            if b.state == HALF_OPEN or b.failures >= LLM_BREAKER_FAILURES:
+                b.state = OPEN
+                b.opened_at = time.monotonic()
+
+    # ---------- public ----------
+    def chat(self, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """POST /chat/completions qua backend tốt nhất → (response JSON, thông tin backend)"""
+        tried: set = set()
+        last: Optional[LLMError] = None
+        for _ in range(max(1, LLM_MAX_ATTEMPTS)):
+            b = self._pick(tried)
+            if b is None:
+                break
+            tried.add(b.name)
+            body = dict(payload, model=b.model) if b.model else payload
+            t0 = time.monotonic()
+            try:
+                r = self._http().post(f"{b.url}/chat/completions", json=body, timeout=LLM_TIMEOUT_SEC)
+            except requests.RequestException as e:
+                self._done(b, False, 0.0, str(e))
+                last = LLMError(502, f"{b.name}: {e}")
+                continue
+            elapsed = (time.monotonic() - t0) * 1000
+            if r.status_code >= 500 or r.status_code == 429:
+                self._done(b, False, elapsed, f"HTTP {r.status_code}")
+                last = LLMError(502, f"LLM error {r.status_code}: {r.text[:500]}")
+                continue
+            # 4xx khác là lỗi của request, không phải của backend → không failover
+            self._done(b, True, elapsed)
+            if r.status_code >= 400:
+                raise LLMError(502, f"LLM error {r.status_code}: {r.text[:500]}")
+            return r.json(), {
+                "name": b.name,
+                "model": body.get("model"),
+                "fallback": b.fallback,
+                "attempts": len(tried),
+                "latency_ms": int(elapsed),
+            }
+        if last is not None:
+            raise last
+        with self._lock:
+            self.unavailable += 1
+        raise LLMUnavailable("no LLM backend available (all open or saturated)")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_outstanding_per_backend": self.max_outstanding,
+                "breaker": {"failures": LLM_BREAKER_FAILURES, "cooldown_sec": LLM_BREAKER_COOLDOWN_SEC},
+                "primaries": [b.stats() for b in self.primaries],
+                "fallbacks": [b.stats() for b in self.fallbacks],
+                "fallback_served": self.fallback_served,
+                "unavailable": self.unavailable,
+            }
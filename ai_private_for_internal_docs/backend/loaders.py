@@ -1,6 +1,9 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
+import codecs
+import io
+import mmap
 import os
 
 from pypdf import PdfReader
@@ -12,6 +15,107 @@ from utils import sha1_file, ensure_dir
 def load_txt(path: Path) -> str:
     return path.read_text(encoding="utf-8", errors="ignore")
 
+# .txt / .log rất lớn: đọc qua mmap, decode UTF-8 tăng dần, chunk trên buffer trượt
+TEXT_STREAM_BLOCK_BYTES = int(os.environ.get("TEXT_STREAM_BLOCK_BYTES", str(1 << 20)))
+# giới hạn số byte index mỗi file; vượt quá → áp dụng TEXT_LARGE_FILE_POLICY
+TEXT_MAX_FILE_MB = float(os.environ.get("TEXT_MAX_FILE_MB", "256"))
+TEXT_LARGE_FILE_POLICY = os.environ.get("TEXT_LARGE_FILE_POLICY", "sample").lower()  # sample | head | tail | skip
+TEXT_SAMPLE_WINDOWS = int(os.environ.get("TEXT_SAMPLE_WINDOWS", "64"))
+
+def plan_text_windows(path: Path) -> Tuple[List[Tuple[int, int]], str]:
+    """
+    Các khoảng byte [start, end) sẽ được index và policy đã áp dụng ("full" khi file dưới giới hạn).
+    sample: TEXT_SAMPLE_WINDOWS cửa sổ trải đều cả file, tổng cộng TEXT_MAX_FILE_MB.
+    """
+    size = path.stat().st_size
+    limit = int(TEXT_MAX_FILE_MB * 1024 * 1024)
+    if limit <= 0 or size <= limit:
+        return [(0, size)], "full"
+    policy = TEXT_LARGE_FILE_POLICY
+    if policy == "skip":
+        return [], policy
+    if policy == "head":
+        return [(0, limit)], policy
+    if policy == "tail":
+        return [(size - limit, size)], policy
+    n = max(1, TEXT_SAMPLE_WINDOWS)
+    width, stride = limit // n, size // n
+    return [(k * stride, k * stride + width) for k in range(n)], "sample"
+
+def _align_window(mm: mmap.mmap, start: int, end: int) -> Tuple[int, int]:
+    """Cắt cửa sổ về ranh giới dòng (không bắt đầu / kết thúc giữa một dòng log hay một ký tự UTF-8)"""
+    size = len(mm)
+    if start > 0:
+        nl = mm.find(b"\n", start - 1, end)
+        if nl >= 0:
+            start = nl + 1
+        else:
+            while start < end and mm[start] & 0xC0 == 0x80:  # byte tiếp nối UTF-8
+                start += 1
+    if end < size:
+        nl = mm.rfind(b"\n", start, end)
+        if nl >= 0:
+            end = nl + 1
+    return start, end
+
+def _decode_blocks(mm: mmap.mmap, start: int, end: int, block: int) -> Iterator[str]:
+    # decoder tăng dần giữ lại ký tự nhiều byte / "\r\n" bị cắt ở biên block;
+    # dịch newline như read_text() để chunk (và point id) khớp load_txt
+    dec = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(errors="ignore"), translate=True)
+    for off in range(start, end, block):
+        piece = dec.decode(mm[off:min(off + block, end)])
+        if piece:
+            yield piece
+    tail = dec.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def _chunk_pieces(pieces: Iterator[str], chunk_size: int, overlap: int) -> Iterator[str]:
+    """Cùng kết quả với chunk_text(("".join(pieces)).strip(), ...) nhưng chỉ giữ ~chunk_size + 1 block trong RAM"""
+    step = max(1, chunk_size - overlap)
+    buf, pos = "", 0
+    started = False
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        buf = buf[pos:] + piece
+        pos = 0
+        # chunk bắt đầu tại pos đã đủ chunk_size ký tự → không phụ thuộc phần còn lại của file
+        while pos + chunk_size <= len(buf):
+            chunk = buf[pos:pos + chunk_size].strip()
+            if chunk:
+                yield chunk
+            pos += step
+    buf = buf[pos:].rstrip()
+    for i in range(0, len(buf), step):
+        chunk = buf[i:i + chunk_size].strip()
+        if chunk:
+            yield chunk
+
+def iter_text_chunks(path: Path, chunk_size: int, overlap: int,
+                     windows: List[Tuple[int, int]] = None) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (chunk_index, text) cho .txt/.log mà không đọc cả file vào RAM.
+    windows=None → cả file; chunk giống hệt chunk_text(load_txt(path).strip()) nên point id không đổi.
+    Nhiều cửa sổ (sampling) được chunk riêng, chunk_index đánh liên tục.
+    """
+    size = path.stat().st_size
+    if size == 0:
+        return
+    windows = [(0, size)] if windows is None else windows
+    idx = 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for start, end in windows:
+            start, end = _align_window(mm, start, min(end, size))
+            if start >= end:
+                continue
+            for chunk in _chunk_pieces(_decode_blocks(mm, start, end, TEXT_STREAM_BLOCK_BYTES), chunk_size, overlap):
+                yield idx, chunk
+                idx += 1
+
 def load_docx(path: Path) -> str:
     doc = Document(str(path))
     return "\n".join([p.text for p in doc.paragraphs]).strip()
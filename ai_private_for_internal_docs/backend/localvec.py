@@ -0,0 +1,648 @@
+"""
+Embedded vector index (không cần Qdrant) cho edge box chi nhánh và test.
+
+    VECTOR_BACKEND=local   LOCAL_INDEX_PATH=/app/.cache/vector_index
+
+LocalVectorClient cài đặt đúng phần QdrantClient mà RagStore / BulkWriter dùng
+(get_collections, create_collection, upsert, retrieve, set_payload, delete_payload,
+count, delete, scroll, search) với cùng model objects (qm.Filter, qm.PointStruct, ...), nên
+RagStore không phải biết backend nào đang chạy.
+
+Mỗi collection là một thư mục:
+    points.sqlite   row → id, payload (JSON), cột source / doc_group / doc_groups để lọc nhanh
+    vectors.bin     numpy memmap float32 [capacity, dim] (hoặc int8 + scales.bin)
+    ivf.npz / ivf_lists.bin   IVF index (tuỳ chọn, khi > LOCAL_IVF_MIN_POINTS)
+
+Search: brute-force theo block (BLAS matmul) trên memmap, mask doc_group / doc_groups bằng
+cột in-memory (cùng ngữ nghĩa Qdrant: is_null chỉ khớp field có mặt và bằng null; doc_groups
+lưu thành mã của tập group, số tập khác nhau nhỏ nên MatchAny vẫn là một np.isin).
+Nhiều process (API + ingest/watcher) dùng chung thư mục: mỗi lần ghi tăng
+"generation" trong SQLite, process khác thấy generation đổi thì nạp lại cột.
+"""
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from utils import ensure_dir
+
+LOCAL_INDEX_PATH = os.environ.get(
+    "LOCAL_INDEX_PATH",
+    str(Path(os.environ.get("CACHE_DIR", "/app/.cache")) / "vector_index"),
+)
+# float32 | int8 (int8: 4x nhỏ hơn, scale riêng từng vector)
+LOCAL_INDEX_DTYPE = os.environ.get("LOCAL_INDEX_DTYPE", "float32")
+LOCAL_IVF_MIN_POINTS = int(os.environ.get("LOCAL_IVF_MIN_POINTS", "1000000"))
+LOCAL_IVF_NPROBE = int(os.environ.get("LOCAL_IVF_NPROBE", "16"))
+# số row mỗi block khi quét memmap (giới hạn RAM tạm cho matmul)
+_BLOCK = 65536
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS points (
+    row INTEGER PRIMARY KEY,
+    id TEXT UNIQUE,
+    source TEXT,
+    doc_group TEXT,
+    has_group INTEGER NOT NULL DEFAULT 0,
+    doc_groups TEXT,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS points_source ON points(source);
+"""
+
+# mã doc_group (và mã tập doc_groups) trong cột in-memory
+_MISSING, _NULL = -2, -1
+_GROUP_KEYS = ("doc_group", "doc_groups")
+
+def _groups_col(p: Dict[str, Any]) -> Optional[str]:
+    """Cột doc_groups: NULL = field không có, còn lại JSON (kể cả "null")"""
+    return json.dumps(p["doc_groups"], ensure_ascii=False) if "doc_groups" in p else None
+
+class _NS:
+    """Record / ScoredPoint / CountResult tối giản, đủ thuộc tính như qdrant_client"""
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+# ---------- filter (cùng ngữ nghĩa Qdrant cho phần RagStore dùng) ----------
+def _values(payload: Dict[str, Any], key: str) -> Tuple[bool, List[Any]]:
+    """-> (field có mặt, danh sách giá trị); hỗ trợ "aliases[].source" """
+    if "[]." in key:
+        head, _, rest = key.partition("[].")
+        items = payload.get(head)
+        if not isinstance(items, list):
+            return False, []
+        vals = [it.get(rest) for it in items if isinstance(it, dict) and rest in it]
+        return bool(vals), vals
+    if key not in payload:
+        return False, []
+    v = payload[key]
+    return True, (v if isinstance(v, list) else [v])
+
+def _cond(payload: Dict[str, Any], c) -> bool:
+    if hasattr(c, "must") or hasattr(c, "should") or hasattr(c, "must_not"):
+        return match_filter(payload, c)
+    if hasattr(c, "is_null"):
+        present, _ = _values(payload, c.is_null.key)
+        return present and payload.get(c.is_null.key) is None
+    if hasattr(c, "is_empty"):
+        present, vals = _values(payload, c.is_empty.key)
+        return not present or all(v is None for v in vals) or vals == []
+    present, vals = _values(payload, c.key)
+    m = c.match
+    if hasattr(m, "any") and getattr(m, "any", None) is not None:
+        return any(v in m.any for v in vals)
+    return any(v == m.value for v in vals)
+
+def match_filter(payload: Dict[str, Any], flt) -> bool:
+    if flt is None:
+        return True
+    must = getattr(flt, "must", None) or []
+    should = getattr(flt, "should", None) or []
+    must_not = getattr(flt, "must_not", None) or []
+    if not all(_cond(payload, c) for c in must):
+        return False
+    if any(_cond(payload, c) for c in must_not):
+        return False
+    return not should or any(_cond(payload, c) for c in should)
+
+def _group_only(flt) -> bool:
+    """Filter chỉ dùng doc_group / doc_groups (filter ACL của RagStore.search) → mask bằng cột in-memory"""
+    for c in (getattr(flt, "must", None) or []) + (getattr(flt, "should", None) or []) + (getattr(flt, "must_not", None) or []):
+        if hasattr(c, "must") or hasattr(c, "should"):
+            if not _group_only(c):
+                return False
+            continue
+        key = c.is_null.key if hasattr(c, "is_null") else c.is_empty.key if hasattr(c, "is_empty") else c.key
+        if key not in _GROUP_KEYS:
+            return False
+    return True
+
+def _source_value(flt) -> Optional[str]:
+    """FieldCondition source == X trong must → prefilter SQL theo index"""
+    for c in getattr(flt, "must", None) or []:
+        if getattr(c, "key", None) == "source" and getattr(c.match, "value", None) is not None:
+            return c.match.value
+    return None
+
+class _Collection:
+    def __init__(self, path: Path, dim: Optional[int] = None, dtype: str = LOCAL_INDEX_DTYPE):
+        self.path = ensure_dir(path)
+        self.conn = sqlite3.connect(str(path / "points.sqlite"), check_same_thread=False, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        if "doc_groups" not in {r[1] for r in self.conn.execute("PRAGMA table_info(points)")}:
+            # index tạo trước khi có doc_groups
+            self.conn.execute("ALTER TABLE points ADD COLUMN doc_groups TEXT")
+            self.conn.commit()
+        self.lock = threading.RLock()
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        if "dim" not in meta:
+            if dim is None:
+                raise ValueError(f"collection {path.name} does not exist")
+            with self.conn:
+                self.conn.executemany("INSERT INTO meta(key, value) VALUES (?,?)",
+                                      [("dim", str(dim)), ("dtype", dtype), ("generation", "0")])
+            meta = {"dim": str(dim), "dtype": dtype, "generation": "0"}
+        self.dim = int(meta["dim"])
+        self.dtype = meta["dtype"]
+        self.generation = -1
+        self.capacity = 0
+        self.vecs: Optional[np.memmap] = None
+        self.scales: Optional[np.memmap] = None
+        self.alive = np.zeros(0, dtype=bool)
+        self.gcode = np.zeros(0, dtype=np.int32)
+        self.codes: Dict[str, int] = {}
+        # doc_groups: mã của tập group theo row
+        self.scode = np.zeros(0, dtype=np.int32)
+        self.sets: Dict[frozenset, int] = {}
+        self.ivf_centroids: Optional[np.ndarray] = None
+        self.ivf_lists: Optional[np.memmap] = None
+        self._ivf_building = False
+        self._refresh()
+
+    # ---------- storage ----------
+    @property
+    def _itemsize(self) -> int:
+        return 1 if self.dtype == "int8" else 4
+
+    def _open_maps(self):
+        vpath = self.path / "vectors.bin"
+        size = vpath.stat().st_size if vpath.exists() else 0
+        self.capacity = size // (self.dim * self._itemsize)
+        if not self.capacity:
+            self.vecs = self.scales = self.ivf_lists = None
+            return
+        self.vecs = np.memmap(vpath, dtype=np.int8 if self.dtype == "int8" else np.float32,
+                              mode="r+", shape=(self.capacity, self.dim))
+        if self.dtype == "int8":
+            self.scales = np.memmap(self.path / "scales.bin", dtype=np.float32, mode="r+", shape=(self.capacity,))
+        ivf = self.path / "ivf.npz"
+        if ivf.exists():
+            self.ivf_centroids = np.load(ivf)["centroids"]
+            self.ivf_lists = np.memmap(self.path / "ivf_lists.bin", dtype=np.int32, mode="r+", shape=(self.capacity,))
+        else:
+            self.ivf_centroids = self.ivf_lists = None
+
+    def _grow(self, rows_needed: int):
+        if rows_needed <= self.capacity:
+            return
+        cap = max(1024, self.capacity)
+        while cap < rows_needed:
+            cap *= 2
+        files = [("vectors.bin", self.dim * self._itemsize)]
+        if self.dtype == "int8":
+            files.append(("scales.bin", 4))
+        if (self.path / "ivf.npz").exists():
+            files.append(("ivf_lists.bin", 4))
+        for name, width in files:
+            with open(self.path / name, "ab") as f:
+                f.truncate(cap * width)
+        self._open_maps()
+
+    def _refresh(self):
+        """Nạp lại cột in-memory nếu process khác vừa ghi (generation đổi)"""
+        gen = int(self.conn.execute("SELECT value FROM meta WHERE key='generation'").fetchone()[0])
+        if gen == self.generation:
+            return
+        self._open_maps()
+        n = self.capacity
+        alive = np.zeros(n, dtype=bool)
+        gcode = np.full(n, _MISSING, dtype=np.int32)
+        scode = np.full(n, _MISSING, dtype=np.int32)
+        codes: Dict[str, int] = {}
+        self.sets = {}
+        for row, has_group, grp, groups in self.conn.execute(
+                "SELECT row, has_group, doc_group, doc_groups FROM points WHERE id IS NOT NULL"):
+            if row >= n:
+                continue
+            alive[row] = True
+            if has_group:
+                gcode[row] = _NULL if grp is None else codes.setdefault(grp, len(codes))
+            if groups is not None:
+                scode[row] = self._set_code(json.loads(groups))
+        self.alive, self.gcode, self.scode, self.codes = alive, gcode, scode, codes
+        self.generation = gen
+
+    def _set_code(self, groups: Any) -> int:
+        if groups is None:
+            return _NULL
+        key = frozenset(groups if isinstance(groups, list) else [groups])
+        return self.sets.setdefault(key, len(self.sets))
+
+    def _bump(self):
+        self.conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key='generation'")
+
+    def _mark_local(self, rows: Iterable[int], payloads: Iterable[Optional[Dict[str, Any]]]):
+        """Cập nhật cột in-memory của process đang ghi (khỏi reload toàn bộ)"""
+        n = self.capacity
+        if len(self.alive) < n:
+            self.alive = np.concatenate([self.alive, np.zeros(n - len(self.alive), dtype=bool)])
+            self.gcode = np.concatenate([self.gcode, np.full(n - len(self.gcode), _MISSING, dtype=np.int32)])
+            self.scode = np.concatenate([self.scode, np.full(n - len(self.scode), _MISSING, dtype=np.int32)])
+        for row, p in zip(rows, payloads):
+            self.alive[row] = p is not None
+            if p is None or "doc_group" not in p:
+                self.gcode[row] = _MISSING
+            else:
+                g = p["doc_group"]
+                self.gcode[row] = _NULL if g is None else self.codes.setdefault(g, len(self.codes))
+            self.scode[row] = _MISSING if p is None or "doc_groups" not in p else self._set_code(p["doc_groups"])
+
+    def _commit_write(self):
+        """Gọi trong transaction, sau khi ghi xong: generation++ → commit"""
+        self._bump()
+        self.conn.commit()
+        self.generation = int(self.conn.execute("SELECT value FROM meta WHERE key='generation'").fetchone()[0])
+
+    def _encode(self, vecs: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self.dtype != "int8":
+            return vecs.astype(np.float32), None
+        scale = np.abs(vecs).max(axis=1)
+        scale[scale == 0] = 1.0
+        q = np.clip(np.rint(vecs / scale[:, None] * 127), -127, 127).astype(np.int8)
+        return q, (scale / 127).astype(np.float32)
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        v = np.asarray(self.vecs[rows], dtype=np.float32)
+        if self.dtype == "int8":
+            v *= np.asarray(self.scales[rows])[:, None]
+        return v
+
+    # ---------- writes ----------
+    def upsert(self, points: List[Any]):
+        if not points:
+            return
+        ids = [str(p.id) for p in points]
+        vecs = np.asarray([p.vector for p in points], dtype=np.float32)
+        with self.lock:
+            self._refresh()
+            # không giữ cursor ngoài lock: cursor bị GC ở thread khác sẽ reset statement
+            # giữa lúc connection đang được dùng
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = {}
+                for i in range(0, len(ids), 500):
+                    part = ids[i:i + 500]
+                    existing.update(self.conn.execute(
+                        f"SELECT id, row FROM points WHERE id IN ({','.join('?' * len(part))})", part))
+                new = [i for i in ids if i not in existing]
+                free = [r[0] for r in self.conn.execute(
+                    "SELECT row FROM points WHERE id IS NULL LIMIT ?", (len(new),))]
+                top = self.conn.execute("SELECT COALESCE(MAX(row), -1) FROM points").fetchone()[0]
+                rows_of = dict(existing)
+                for pid in new:
+                    if pid in rows_of:
+                        continue
+                    if free:
+                        rows_of[pid] = free.pop()
+                    else:
+                        top += 1
+                        rows_of[pid] = top
+                rows = [rows_of[pid] for pid in ids]
+                self._grow(max(rows) + 1)
+                q, scale = self._encode(vecs)
+                self.vecs[rows] = q
+                if scale is not None:
+                    self.scales[rows] = scale
+                if self.ivf_lists is not None:
+                    self.ivf_lists[rows] = self._assign(vecs)
+                self.vecs.flush()
+                self.conn.executemany(
+                    "INSERT INTO points(row, id, source, doc_group, has_group, doc_groups, payload) VALUES (?,?,?,?,?,?,?) "
+                    "ON CONFLICT(row) DO UPDATE SET id=excluded.id, source=excluded.source, "
+                    "doc_group=excluded.doc_group, has_group=excluded.has_group, doc_groups=excluded.doc_groups, "
+                    "payload=excluded.payload",
+                    [
+                        (row, pid, (p.payload or {}).get("source"), (p.payload or {}).get("doc_group"),
+                         int("doc_group" in (p.payload or {})), _groups_col(p.payload or {}),
+                         json.dumps(p.payload or {}, ensure_ascii=False))
+                        for row, pid, p in zip(rows, ids, points)
+                    ],
+                )
+                self._commit_write()
+            except Exception:
+                self.conn.rollback()
+                raise
+            self._mark_local(rows, [p.payload or {} for p in points])
+        self._maybe_build_ivf()
+
+    def set_payload(self, payload: Dict[str, Any], ids: List[str], drop: Iterable[str] = ()):
+        with self.lock:
+            self._refresh()
+            rows, payloads = [], []
+            for row, raw in self._rows_by_ids(ids):
+                p = json.loads(raw or "{}")
+                p.update(payload)
+                for k in drop:
+                    p.pop(k, None)
+                rows.append(row)
+                payloads.append(p)
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "UPDATE points SET source=?, doc_group=?, has_group=?, doc_groups=?, payload=? WHERE row=?",
+                [(p.get("source"), p.get("doc_group"), int("doc_group" in p), _groups_col(p),
+                  json.dumps(p, ensure_ascii=False), row)
+                 for row, p in zip(rows, payloads)],
+            )
+            self._commit_write()
+            self._mark_local(rows, payloads)
+
+    def delete_rows(self, rows: List[int]):
+        if not rows:
+            return
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "UPDATE points SET id=NULL, source=NULL, doc_group=NULL, has_group=0, doc_groups=NULL, payload=NULL WHERE row=?",
+                [(r,) for r in rows],
+            )
+            self._commit_write()
+            self._mark_local(rows, [None] * len(rows))
+
+    # ---------- reads ----------
+    def _rows_by_ids(self, ids: List[str]) -> List[Tuple[int, str]]:
+        out = []
+        for i in range(0, len(ids), 500):
+            part = [str(x) for x in ids[i:i + 500]]
+            out.extend(self.conn.execute(
+                f"SELECT row, payload FROM points WHERE id IN ({','.join('?' * len(part))})", part))
+        return out
+
+    def matching_rows(self, flt) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """(row, id, payload) của các point khớp filter (dùng cho count / scroll / delete)"""
+        src = _source_value(flt) if flt is not None else None
+        if src is not None:
+            cur = self.conn.execute("SELECT row, id, payload FROM points WHERE source=? ORDER BY row", (src,))
+        else:
+            cur = self.conn.execute("SELECT row, id, payload FROM points WHERE id IS NOT NULL ORDER BY row")
+        out = []
+        for row, pid, raw in cur:
+            p = json.loads(raw or "{}")
+            if match_filter(p, flt):
+                out.append((row, pid, p))
+        return out
+
+    def records(self, rows: List[int], with_payload, with_vectors: bool, scores: Optional[List[float]] = None):
+        if not rows:
+            return []
+        info: Dict[int, Tuple[str, str]] = {}
+        for i in range(0, len(rows), 500):
+            part = [int(r) for r in rows[i:i + 500]]
+            for row, pid, raw in self.conn.execute(
+                    f"SELECT row, id, payload FROM points WHERE row IN ({','.join('?' * len(part))})", part):
+                info[row] = (pid, raw)
+        vecs = self._decode(np.asarray(rows)) if with_vectors else None
+        out = []
+        for i, row in enumerate(rows):
+            if int(row) not in info or info[int(row)][0] is None:
+                continue
+            pid, raw = info[int(row)]
+            p = json.loads(raw or "{}") if with_payload else None
+            if isinstance(with_payload, list):
+                p = {k: v for k, v in p.items() if k in with_payload}
+            rec = _NS(id=pid, payload=p, vector=vecs[i].tolist() if vecs is not None else None)
+            if scores is not None:
+                rec.score = float(scores[i])
+            out.append(rec)
+        return out
+
+    def _mask(self, flt) -> Optional[np.ndarray]:
+        """Bool mask theo row (alive & filter); None = không còn point nào"""
+        n = min(self.capacity, len(self.alive))
+        if n == 0:
+            return None
+        if flt is None:
+            return self.alive[:n]
+        if _group_only(flt):
+            return self.alive[:n] & self._group_mask(flt, n)
+        mask = np.zeros(n, dtype=bool)
+        for row, _, _ in self.matching_rows(flt):
+            if row < n:
+                mask[row] = True
+        return mask
+
+    def _group_mask(self, flt, n: int) -> np.ndarray:
+        def cond(c) -> np.ndarray:
+            if hasattr(c, "must") or hasattr(c, "should"):
+                return self._group_mask(c, n)
+            key = c.is_null.key if hasattr(c, "is_null") else c.is_empty.key if hasattr(c, "is_empty") else c.key
+            g = self.gcode[:n] if key == "doc_group" else self.scode[:n]
+            if hasattr(c, "is_null"):
+                return g == _NULL
+            if hasattr(c, "is_empty"):
+                empty = [code for grp, code in self.sets.items() if not grp] if key == "doc_groups" else []
+                return (g < 0) | np.isin(g, empty)
+            vals = c.match.any if getattr(c.match, "any", None) is not None else [c.match.value]
+            if key == "doc_group":
+                codes = [self.codes[v] for v in vals if v in self.codes]
+            else:
+                # doc_groups khớp khi tập group của row giao với vals
+                want = set(vals)
+                codes = [code for grp, code in self.sets.items() if grp & want]
+            return np.isin(g, codes) if codes else np.zeros(n, dtype=bool)
+        m = np.ones(n, dtype=bool)
+        for c in getattr(flt, "must", None) or []:
+            m &= cond(c)
+        for c in getattr(flt, "must_not", None) or []:
+            m &= ~cond(c)
+        should = getattr(flt, "should", None) or []
+        if should:
+            s = np.zeros(n, dtype=bool)
+            for c in should:
+                s |= cond(c)
+            m &= s
+        return m
+
+    def _scores(self, rows: np.ndarray, q: np.ndarray) -> np.ndarray:
+        block = np.asarray(self.vecs[rows], dtype=np.float32)
+        sc = block @ q
+        if self.dtype == "int8":
+            sc *= np.asarray(self.scales[rows])
+        return sc
+
+    def search(self, q: np.ndarray, limit: int, flt) -> Tuple[List[int], List[float]]:
+        with self.lock:
+            self._refresh()
+            mask = self._mask(flt)
+        if mask is None or limit <= 0:
+            return [], []
+        q = np.asarray(q, dtype=np.float32)
+        if self.ivf_centroids is not None and self.ivf_lists is not None:
+            probe = np.argsort(-(self.ivf_centroids @ q))[:LOCAL_IVF_NPROBE]
+            cand = np.nonzero(mask & np.isin(np.asarray(self.ivf_lists[:len(mask)]), probe))[0]
+        else:
+            cand = None
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_sc = np.zeros(0, dtype=np.float32)
+        n = len(mask)
+        for start in range(0, len(cand) if cand is not None else n, _BLOCK):
+            if cand is not None:
+                rows = cand[start:start + _BLOCK]
+            else:
+                rows = np.nonzero(mask[start:start + _BLOCK])[0] + start
+            if not len(rows):
+                continue
+            # block liên tục → slice memmap (không copy qua fancy index)
+            if cand is None and len(rows) == min(_BLOCK, n - start):
+                blk = np.asarray(self.vecs[start:start + len(rows)], dtype=np.float32)
+                sc = blk @ q
+                if self.dtype == "int8":
+                    sc *= np.asarray(self.scales[start:start + len(rows)])
+            else:
+                sc = self._scores(rows, q)
+            rows_all = np.concatenate([best_rows, rows])
+            sc_all = np.concatenate([best_sc, sc])
+            if len(sc_all) > limit:
+                top = np.argpartition(-sc_all, limit - 1)[:limit]
+                rows_all, sc_all = rows_all[top], sc_all[top]
+            best_rows, best_sc = rows_all, sc_all
+        order = np.argsort(-best_sc)
+        return best_rows[order].tolist(), best_sc[order].tolist()
+
+    # ---------- IVF (tuỳ chọn) ----------
+    def _assign(self, vecs: np.ndarray) -> np.ndarray:
+        return np.argmax(vecs @ self.ivf_centroids.T, axis=1).astype(np.int32)
+
+    def _maybe_build_ivf(self):
+        if self._ivf_building or self.ivf_centroids is not None or int(self.alive.sum()) < LOCAL_IVF_MIN_POINTS:
+            return
+        self._ivf_building = True
+        threading.Thread(target=self.build_ivf, name="localvec-ivf", daemon=True).start()
+
+    def build_ivf(self, n_lists: Optional[int] = None, iters: int = 10, sample: int = 200000):
+        """k-means (spherical) trên mẫu vector → centroids + list id cho mọi row"""
+        try:
+            with self.lock:
+                self._refresh()
+                alive = np.nonzero(self.alive)[0]
+            if not len(alive):
+                return
+            n_lists = n_lists or max(16, int(4 * np.sqrt(len(alive))))
+            rng = np.random.RandomState(0)
+            pick = np.sort(rng.choice(alive, size=min(sample, len(alive)), replace=False))
+            x = self._decode(pick)
+            cent = x[rng.choice(len(x), size=min(n_lists, len(x)), replace=False)].copy()
+            for _ in range(iters):
+                assign = np.argmax(x @ cent.T, axis=1)
+                for c in range(len(cent)):
+                    members = x[assign == c]
+                    if len(members):
+                        v = members.sum(axis=0)
+                        cent[c] = v / (np.linalg.norm(v) or 1.0)
+            with self.lock:
+                lists_path = self.path / "ivf_lists.bin"
+                with open(lists_path, "wb") as f:
+                    f.truncate(self.capacity * 4)
+                lists = np.memmap(lists_path, dtype=np.int32, mode="r+", shape=(self.capacity,))
+                self.ivf_centroids = cent.astype(np.float32)
+                for s in range(0, self.capacity, _BLOCK):
+                    rows = np.arange(s, min(s + _BLOCK, self.capacity))
+                    lists[rows] = self._assign(self._decode(rows))
+                lists.flush()
+                np.savez(self.path / "ivf.npz", centroids=self.ivf_centroids)
+                self.ivf_lists = lists
+                self.conn.execute("BEGIN IMMEDIATE")
+                self._commit_write()
+        finally:
+            self._ivf_building = False
+
+class LocalVectorClient:
+    """Drop-in cho phần QdrantClient mà RagStore dùng"""
+    def __init__(self, path: str = LOCAL_INDEX_PATH, dtype: str = LOCAL_INDEX_DTYPE):
+        self.path = ensure_dir(Path(path))
+        self.dtype = dtype
+        self._cols: Dict[str, _Collection] = {}
+        self._lock = threading.Lock()
+
+    def _col(self, name: str) -> _Collection:
+        with self._lock:
+            if name not in self._cols:
+                self._cols[name] = _Collection(self.path / name)
+            return self._cols[name]
+
+    def get_collections(self):
+        names = [p.name for p in self.path.iterdir() if (p / "points.sqlite").exists()]
+        return _NS(collections=[_NS(name=n) for n in sorted(names)])
+
+    def create_collection(self, collection_name: str, vectors_config, **_):
+        with self._lock:
+            self._cols[collection_name] = _Collection(self.path / collection_name, dim=vectors_config.size, dtype=self.dtype)
+
+    def upsert(self, collection_name: str, points: List[Any], wait: bool = True, **_):
+        self._col(collection_name).upsert(points)
+
+    def set_payload(self, collection_name: str, payload: Dict[str, Any], points: List[Any], **_):
+        self._col(collection_name).set_payload(payload, [str(p) for p in points])
+
+    def delete_payload(self, collection_name: str, keys: List[str], points: List[Any], **_):
+        self._col(collection_name).set_payload({}, [str(p) for p in points], drop=keys)
+
+    def retrieve(self, collection_name: str, ids: List[Any], with_payload=True, with_vectors: bool = False, **_):
+        col = self._col(collection_name)
+        with col.lock:
+            rows = [row for row, _ in col._rows_by_ids([str(i) for i in ids])]
+            return col.records(rows, with_payload, with_vectors)
+
+    def count(self, collection_name: str, count_filter=None, exact: bool = True, **_):
+        col = self._col(collection_name)
+        with col.lock:
+            col._refresh()
+            if count_filter is None:
+                return _NS(count=int(col.alive.sum()))
+            return _NS(count=len(col.matching_rows(count_filter)))
+
+    def delete(self, collection_name: str, points_selector, wait: bool = True, **_):
+        col = self._col(collection_name)
+        with col.lock:
+            if hasattr(points_selector, "points"):
+                rows = [row for row, _ in col._rows_by_ids([str(i) for i in points_selector.points])]
+            else:
+                rows = [row for row, _, _ in col.matching_rows(points_selector.filter)]
+            col.delete_rows(rows)
+
+    def scroll(self, collection_name: str, scroll_filter=None, with_payload=True, with_vectors: bool = False,
+               limit: int = 100, offset: Optional[int] = None, **_):
+        """offset = row bắt đầu (opaque với caller, như Qdrant)"""
+        col = self._col(collection_name)
+        with col.lock:
+            col._refresh()
+            rows = [row for row, _, _ in col.matching_rows(scroll_filter) if offset is None or row >= offset]
+            page, rest = rows[:limit], rows[limit:]
+            return col.records(page, with_payload, with_vectors), (rest[0] if rest else None)
+
+    def search(self, collection_name: str, query_vector, limit: int = 10, query_filter=None,
+               with_payload=True, **_):
+        col = self._col(collection_name)
+        rows, scores = col.search(np.asarray(query_vector, dtype=np.float32), limit, query_filter)
+        with col.lock:
+            return col.records(rows, with_payload, False, scores)
+
+    def build_ivf(self, collection_name: str, n_lists: Optional[int] = None):
+        self._col(collection_name).build_ivf(n_lists)
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Local vector index tools")
+    ap.add_argument("command", choices=["info", "build-ivf"])
+    ap.add_argument("--path", default=LOCAL_INDEX_PATH)
+    ap.add_argument("--collection", default=os.environ.get("QDRANT_COLLECTION", "internal_docs"))
+    ap.add_argument("--lists", type=int, default=None)
+    args = ap.parse_args()
+    client = LocalVectorClient(args.path)
+    if args.command == "build-ivf":
+        client.build_ivf(args.collection, args.lists)
+    col = client._col(args.collection)
+    print(json.dumps({
+        "collection": args.collection, "dim": col.dim, "dtype": col.dtype,
+        "points": int(col.alive.sum()), "capacity": col.capacity,
+        "ivf_lists": None if col.ivf_centroids is None else len(col.ivf_centroids),
+    }))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Dynamic micro-batching cho query embeddings.
+
+Mỗi chat request embed đúng một câu hỏi → dưới tải đồng thời CPU chạy rất nhiều
+forward pass batch-size-1. MicroBatcher gom text từ các request đồng thời trong tối
+đa max_wait_ms (hoặc tới max_batch), encode một lần, rồi trả kết quả cho từng caller.
+"""
+from __future__ import annotations
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+class MicroBatcher:
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch: int = 32,
+                 max_wait_ms: float = 3.0, name: str = "query"):
+        self.encode_fn = encode_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self._q: "queue.Queue[Tuple[str, Future, float]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._hist = {b: 0 for b in _BATCH_BUCKETS}
+        # queue delay (ms) của các item gần nhất: từ lúc submit tới lúc batch bắt đầu encode
+        self._delays: deque = deque(maxlen=2000)
+        self._encode_ms: deque = deque(maxlen=500)
+        self._thread = threading.Thread(target=self._loop, name=f"microbatch-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        fut: Future = Future()
+        self._q.put((text, fut, time.perf_counter()))
+        return fut
+
+    def encode_one(self, text: str, timeout: float = 60.0) -> np.ndarray:
+        return self.submit(text).result(timeout=timeout)
+
+    def _collect(self) -> List[Tuple[str, Future, float]]:
+        first = self._q.get()
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                vecs = self.encode_fn([t for t, _, _ in batch])
+                for (_, fut, _), v in zip(batch, vecs):
+                    fut.set_result(v)
+            except Exception as e:
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            self._record(batch, started, time.perf_counter())
+
+    def _record(self, batch, started: float, finished: float):
+        n = len(batch)
+        with self._lock:
+            self._batches += 1
+            self._items += n
+            bucket = next((b for b in _BATCH_BUCKETS if n <= b), _BATCH_BUCKETS[-1])
+            self._hist[bucket] += 1
+            self._delays.extend((started - t0) * 1000 for _, _, t0 in batch)
+            self._encode_ms.append((finished - started) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            delays = sorted(self._delays)
+            enc = sorted(self._encode_ms)
+            batches, items = self._batches, self._items
+            hist = {f"<={b}": c for b, c in self._hist.items()}
+
+        def pct(vals, p):
+            return round(vals[min(len(vals) - 1, int(p / 100.0 * len(vals)))], 2) if vals else None
+
+        return {
+            "name": self.name,
+            "max_batch": self.max_batch,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "batches": batches,
+            "items": items,
+            "avg_batch_size": round(items / batches, 2) if batches else 0.0,
+            "batch_size_hist": hist,
+            "queue_delay_ms": {"p50": pct(delays, 50), "p95": pct(delays, 95), "max": round(delays[-1], 2) if delays else None},
+            "encode_ms": {"p50": pct(enc, 50), "p95": pct(enc, 95)},
+            "queued": self._q.qsize(),
+        }
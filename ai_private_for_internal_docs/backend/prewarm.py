@@ -0,0 +1,114 @@
+"""
+Post-ingest cache pre-warming.
+
+Ingest (khi PREWARM_ENABLED) không bump/invalidate ngay mà:
+  1. stage version mới cho các doc_group vừa ingest (corpus_versions:pending)
+  2. enqueue job {"groups", "sources"} vào prewarm:jobs
+
+Prewarmer (thread trong API process) nhận job, trả lời lại top câu hỏi phổ biến
+bị ảnh hưởng và ghi answer vào key của version mới, trong lúc user vẫn được serve
+cache cũ. Xong thì commit versions + xoá các answer phụ thuộc source cũ còn lại,
+nên user đầu tiên sau ingest không phải trả giá cold miss.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+from cache import (
+    popular_questions, pending_group_versions, commit_group_versions, group_versions,
+    answer_key, dependent_keys, invalidate_sources, invalidate_retrieval_sources, is_bad, key_ttl,
+    pop_prewarm_job, set_prewarm_status,
+)
+
+PREWARM_ENABLED = os.environ.get("PREWARM_ENABLED", "false").lower() in ("1", "true", "yes")
+PREWARM_TOP_N = int(os.environ.get("PREWARM_TOP_N", "200"))
+PREWARM_CONCURRENCY = int(os.environ.get("PREWARM_CONCURRENCY", "2"))
+# số câu hỏi phổ biến được xét để chọn ra TOP_N câu bị ảnh hưởng
+PREWARM_SCAN = int(os.environ.get("PREWARM_SCAN", str(PREWARM_TOP_N * 5)))
+
+# answer_fn(question, groups, versions) -> cache key vừa ghi, None nếu answer không được cache
+AnswerFn = Callable[[str, List[str], Dict[str, int]], Optional[str]]
+
+class Prewarmer:
+    def __init__(self, answer_fn: AnswerFn):
+        self.answer_fn = answer_fn
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="cache-prewarm", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                job = pop_prewarm_job(timeout=5)
+                if job is not None:
+                    self.run_job(job)
+            except Exception as e:
+                print(f"[prewarm] worker error: {e}")
+                time.sleep(5)
+
+    def _select(self, target: Dict[str, int], changed_keys: set, manual: bool) -> List[Dict[str, Any]]:
+        """Top câu hỏi phổ biến mà job làm thay đổi câu trả lời"""
+        out = []
+        for item in popular_questions(PREWARM_SCAN):
+            q, groups = item["question"], item["groups"]
+            cur = answer_key(q, groups)
+            affected = answer_key(q, groups, target) != cur or cur in changed_keys
+            # manual trigger: hâm nóng các câu phổ biến hiện không có trong cache
+            if not affected and not (manual and key_ttl(cur) == -2):
+                continue
+            if is_bad(q, groups):
+                continue
+            out.append(item)
+            if len(out) >= PREWARM_TOP_N:
+                break
+        return out
+
+    def run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        sources = job.get("sources") or []
+        target = {**group_versions(), **pending_group_versions()}
+        status: Dict[str, Any] = {
+            "state": "running", "job": job, "started_at": int(time.time()),
+            "total": 0, "done": 0, "skipped": 0, "failed": 0,
+        }
+        set_prewarm_status(status)
+        refreshed: set = set()
+        try:
+            # hit list cache trước ingest còn chunk text cũ (version group không đổi khi
+            # chỉ source thay đổi) → xoá trước để answer pre-warm retrieve lại từ store
+            if sources:
+                invalidate_retrieval_sources(sources)
+            selected = self._select(target, dependent_keys(sources), bool(job.get("manual")))
+            status["total"] = len(selected)
+            set_prewarm_status(status)
+            with ThreadPoolExecutor(max_workers=max(1, PREWARM_CONCURRENCY)) as ex:
+                futs = [ex.submit(self.answer_fn, it["question"], it["groups"], target) for it in selected]
+                for f in as_completed(futs):
+                    try:
+                        key = f.result()
+                        if key is None:
+                            # vd fallback LLM với LLM_FALLBACK_CACHE_TTL_SEC=0: không có gì để giữ lại
+                            status["skipped"] += 1
+                        else:
+                            refreshed.add(key)
+                            status["done"] += 1
+                    except Exception as e:
+                        status["failed"] += 1
+                        status["last_error"] = str(e)[:300]
+                    set_prewarm_status(status)
+        finally:
+            # luôn active version mới + dọn answer cũ, kể cả khi pre-warm lỗi giữa chừng
+            status["committed"] = commit_group_versions()
+            if sources:
+                res = invalidate_sources(sources, reason="ingest+prewarm", keep=refreshed)
+                status["invalidated"] = res["removed"]
+            status["state"] = "idle"
+            status["finished_at"] = int(time.time())
+            set_prewarm_status(status)
+        print(f"[prewarm] done={status['done']} skipped={status['skipped']} failed={status['failed']} total={status['total']}")
+        return status
@@ -1,13 +1,17 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple, Iterable
+from concurrent.futures import ThreadPoolExecutor, Future
 import hashlib
+import threading
 
 import numpy as np
 from qdrant_client import QdrantClient
 from qdrant_client.http import models as qm
 from sentence_transformers import SentenceTransformer
 
+from microbatch import MicroBatcher
+
 @dataclass
 class RagConfig:
     qdrant_url: str
@@ -16,6 +20,29 @@ class RagConfig:
     chunk_size: int
     chunk_overlap: int
     top_k: int
+    # bulk ingest: > 0 → gom points thành batch, upsert song song với wait=False (xem BulkWriter)
+    upsert_batch_size: int = 0
+    upsert_concurrency: int = 4
+    upsert_max_inflight: int = 8
+    prefer_grpc: bool = False
+    # shared embedding server (embed_server.py); rỗng → load model trong process
+    embed_url: str = ""
+    # micro-batching query embeddings giữa các request đồng thời (0 = tắt)
+    query_batch_wait_ms: float = 0.0
+    query_batch_max: int = 32
+    # "qdrant" | "local" (localvec.py: memmap + SQLite, không cần Qdrant server)
+    vector_backend: str = "qdrant"
+    local_index_path: str = ""
+    local_index_dtype: str = "float32"
+    # adaptive top-k (select_context): top_k là số candidate tối đa; 0 = tắt từng điều kiện
+    min_score: float = 0.0
+    max_score_gap: float = 0.0
+    max_context_chars: int = 0
+    min_k: int = 1
+    # docstore.py: chunk text trong SQLite+zstd thay vì payload Qdrant ("" = giữ text trong payload)
+    docstore_path: str = ""
+    # point id = hash nội dung chunk: bản copy ở source / group khác chỉ thêm alias + doc_groups
+    content_ids: bool = False
 
 def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
     # simple char-based chunking (v1). Later you can switch to token-based chunking.
@@ -30,14 +57,181 @@ def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
         i += step
     return chunks
 
+def make_vector_client(cfg: RagConfig):
+    """Vector backend theo cfg.vector_backend; LocalVectorClient có cùng API con mà RagStore dùng"""
+    if cfg.vector_backend == "local":
+        from localvec import LocalVectorClient, LOCAL_INDEX_PATH
+        return LocalVectorClient(cfg.local_index_path or LOCAL_INDEX_PATH, cfg.local_index_dtype)
+    if cfg.vector_backend != "qdrant":
+        raise ValueError(f"unknown vector backend: {cfg.vector_backend}")
+    return QdrantClient(url=cfg.qdrant_url, prefer_grpc=cfg.prefer_grpc)
+
 def stable_id(s: str) -> str:
     return hashlib.sha1(s.encode("utf-8", errors="ignore")).hexdigest()
 
+def content_id(chunk: str) -> str:
+    """Point id chỉ phụ thuộc nội dung chunk (content-addressed)"""
+    return stable_id(f"chunk::{chunk}")
+
+# phần tử doc_groups của bản copy không có group (cùng giá trị cache.PUBLIC_GROUP)
+PUBLIC_DOC_GROUP = "__public__"
+
+def doc_groups_of(payload: Dict[str, Any]) -> List[str]:
+    """
+    Group của chunk chính + mọi alias. Alias ghi trước khi có doc_groups không có key
+    "doc_group": đó là near-duplicate cùng group với chunk chính.
+    """
+    own = payload.get("doc_group")
+    groups = {own or PUBLIC_DOC_GROUP}
+    for a in payload.get("aliases") or []:
+        g = a["doc_group"] if "doc_group" in a else own
+        groups.add(g or PUBLIC_DOC_GROUP)
+    return sorted(groups)
+
+def acl_filter(allowed_groups: List[str]) -> qm.Filter:
+    """Point thấy được với các group này: thuộc một group được phép, hoặc có bản copy public"""
+    allowed = list(allowed_groups)
+    return qm.Filter(
+        should=[
+            qm.FieldCondition(key="doc_groups", match=qm.MatchAny(any=allowed + [PUBLIC_DOC_GROUP])),
+            # point ingest trước khi có doc_groups: theo doc_group; không có doc_group = public
+            # (IsEmpty chứ không phải IsNull: IsNull không khớp field vắng mặt)
+            qm.Filter(
+                must=[qm.IsEmptyCondition(is_empty=qm.PayloadField(key="doc_groups"))],
+                should=[
+                    qm.FieldCondition(key="doc_group", match=qm.MatchAny(any=allowed)),
+                    qm.IsEmptyCondition(is_empty=qm.PayloadField(key="doc_group")),
+                ],
+            ),
+        ]
+    )
+
+def _cited(payload: Dict[str, Any], allowed_groups: Optional[List[str]]) -> Dict[str, Any]:
+    """Bản copy dùng để trích dẫn: chunk chính nếu user thấy được, không thì alias đầu tiên của group user"""
+    if not allowed_groups or not payload.get("doc_group") or payload["doc_group"] in allowed_groups:
+        return payload
+    for a in payload.get("aliases") or []:
+        if "doc_group" in a and (not a["doc_group"] or a["doc_group"] in allowed_groups):
+            return a
+    return payload
+
+BARRIER_POINT_ID = "00000000-0000-0000-0000-000000000000"
+
+class BulkWriter:
+    """
+    Buffer PointStructs, gửi từng batch upsert(wait=False) trên nhiều connection song song.
+    - backpressure: tối đa max_inflight batch chưa được ack, add() block khi vượt
+    - flush(): gửi phần còn lại, chờ mọi ack rồi một thao tác wait=True làm barrier
+      (Qdrant apply theo thứ tự WAL) → sau flush() data đã search được
+    - after_flush(cb): cb chạy sau barrier kế tiếp (vd ghi checkpoint chỉ khi data đã durable)
+    """
+    def __init__(self, client: QdrantClient, collection: str, batch_size: int = 256,
+                 concurrency: int = 4, max_inflight: int = 8):
+        self.client = client
+        self.collection = collection
+        self.batch_size = max(1, batch_size)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="qdrant-upsert")
+        self._slots = threading.BoundedSemaphore(max(1, max_inflight))
+        self._lock = threading.Lock()
+        self._buf: List[qm.PointStruct] = []
+        self._inflight: Dict[str, Future] = {}
+        self._futures: List[Future] = []
+        self._callbacks: List[Callable[[], None]] = []
+        self.batches = 0
+        self.points = 0
+
+    def add(self, points: List[qm.PointStruct]):
+        with self._lock:
+            self._buf.extend(points)
+            ready = []
+            while len(self._buf) >= self.batch_size:
+                ready.append(self._buf[:self.batch_size])
+                self._buf = self._buf[self.batch_size:]
+        for batch in ready:
+            self._send(batch)
+
+    def _send(self, batch: List[qm.PointStruct]):
+        self._slots.acquire()
+        fut = self._pool.submit(self.client.upsert, collection_name=self.collection, points=batch, wait=False)
+        fut.add_done_callback(lambda _f: self._slots.release())
+        with self._lock:
+            self._futures.append(fut)
+            for p in batch:
+                self._inflight[str(p.id)] = fut
+            self.batches += 1
+            self.points += len(batch)
+
+    def _barrier(self):
+        # delete một id không tồn tại với wait=True: không đổi data, nhưng chỉ trả về
+        # khi mọi thao tác nhận trước nó đã được apply
+        self.client.delete(collection_name=self.collection,
+                           points_selector=qm.PointIdsList(points=[BARRIER_POINT_ID]), wait=True)
+
+    def wait_for(self, ids: List[str]):
+        """Đảm bảo các point id (nếu còn pending) đã được apply, trước khi đọc / set_payload lên chúng"""
+        ids = {str(i) for i in ids}
+        with self._lock:
+            if not any(str(p.id) in ids for p in self._buf) and not ids & self._inflight.keys():
+                return
+            batch, self._buf = self._buf, []
+        if batch:
+            self._send(batch)
+        with self._lock:
+            futs = {self._inflight[i] for i in ids if i in self._inflight}
+        for f in futs:
+            f.result()
+        self._barrier()
+
+    def after_flush(self, cb: Callable[[], None]):
+        with self._lock:
+            self._callbacks.append(cb)
+
+    def flush(self):
+        with self._lock:
+            rest, self._buf = self._buf, []
+            futs, self._futures = self._futures, []
+        for f in futs:
+            f.result()
+        if rest:
+            self.client.upsert(collection_name=self.collection, points=rest, wait=True)
+            self.batches += 1
+            self.points += len(rest)
+        elif futs:
+            self._barrier()
+        with self._lock:
+            self._inflight.clear()
+            cbs, self._callbacks = self._callbacks, []
+        for cb in cbs:
+            cb()
+
+# payload cần cho một hit khi text nằm trong docstore
+_HIT_FIELDS = ["source", "page_number", "chunk_index", "doc_group", "doc_groups", "aliases", "text"]
+
+def _alias_key(a: Dict[str, Any]) -> tuple:
+    return (a.get("source"), a.get("page_number"), a.get("chunk_index"))
+
 class RagStore:
-    def __init__(self, cfg: RagConfig):
+    def __init__(self, cfg: RagConfig, dedup=None):
         self.cfg = cfg
-        self.client = QdrantClient(url=cfg.qdrant_url)
-        self.embedder = SentenceTransformer(cfg.embed_model)
+        self.client = make_vector_client(cfg)
+        if cfg.embed_url:
+            from embed_server import EmbedClient
+            self.embedder = EmbedClient(cfg.embed_url)
+        else:
+            self.embedder = SentenceTransformer(cfg.embed_model)
+        # optional DedupIndex (dedup.py): near-duplicate chunks become "aliases" of an existing point
+        self.dedup = dedup
+        self.docstore = None
+        if cfg.docstore_path:
+            from docstore import DocStore
+            self.docstore = DocStore(cfg.docstore_path)
+        self.query_batcher: Optional[MicroBatcher] = None
+        if cfg.query_batch_wait_ms > 0:
+            self.query_batcher = MicroBatcher(self.embed, cfg.query_batch_max, cfg.query_batch_wait_ms)
+        self.writer: Optional[BulkWriter] = None
+        if cfg.upsert_batch_size > 0:
+            self.writer = BulkWriter(self.client, cfg.collection, cfg.upsert_batch_size,
+                                     cfg.upsert_concurrency, cfg.upsert_max_inflight)
 
         self._ensure_collection()
 
@@ -54,69 +248,368 @@ class RagStore:
         vecs = self.embedder.encode(texts, normalize_embeddings=True)
         return np.array(vecs, dtype=np.float32)
 
+    def embed_query(self, query: str) -> np.ndarray:
+        if self.query_batcher is not None:
+            return self.query_batcher.encode_one(query)
+        return self.embed([query])[0]
+
     def upsert_chunked(self, source_path: str, text: str, page_number: Optional[int] = None, meta: Optional[Dict[str, Any]] = None) -> int:
         chunks = chunk_text(text, self.cfg.chunk_size, self.cfg.chunk_overlap)
+        return self._upsert_chunks(source_path, dict(enumerate(chunks)), page_number, meta)
+
+    def upsert_stream(self, source_path: str, chunks: Iterable[Tuple[int, str]], page_number: Optional[int] = None,
+                      meta: Optional[Dict[str, Any]] = None, batch_size: int = 256) -> int:
+        """(chunk_index, text) từ iterator (loaders.iter_text_chunks) → upsert theo lô, không giữ cả file"""
+        n = 0
+        batch: Dict[int, str] = {}
+        for i, chunk in chunks:
+            batch[i] = chunk
+            if len(batch) >= batch_size:
+                n += self._upsert_chunks(source_path, batch, page_number, meta)
+                batch = {}
+        if batch:
+            n += self._upsert_chunks(source_path, batch, page_number, meta)
+        return n
+
+    def _upsert_chunks(self, source_path: str, chunks: Dict[int, str], page_number: Optional[int],
+                       meta: Optional[Dict[str, Any]]) -> int:
+        """chunks: chunk_index -> text (index là một phần của point id)"""
         if not chunks:
             return 0
 
-        vecs = self.embed(chunks)
+        doc_group = (meta or {}).get("doc_group")
+        if self.cfg.content_ids:
+            ids = {i: content_id(chunk) for i, chunk in chunks.items()}
+        else:
+            ids = {i: stable_id(f"{source_path}::p{page_number}::c{i}::{chunk[:120]}") for i, chunk in chunks.items()}
+        # content_ids: nội dung đã có (source / group khác, hoặc lặp lại trong file) → chỉ thêm membership
+        shared = self._stored_content(ids) if self.cfg.content_ids else {}
+        sigs: Dict[int, Any] = {}
+        dups: Dict[int, str] = {}
+        if self.dedup is not None:
+            for i, chunk in chunks.items():
+                if i in shared:
+                    continue
+                match, sigs[i] = self.dedup.find(chunk, doc_group, source_path)
+                if match:
+                    dups[i] = match
+            dups = self._existing_dups(dups)
+        if shared and dups:
+            # lặp lại trong lô của một chunk near-duplicate → alias của cùng point gốc
+            first_of = {ids[j]: j for j in chunks if j not in shared}
+            shared = {i: dups.get(first_of.get(pid), pid) for i, pid in shared.items()}
+        keep = [i for i in chunks if i not in dups and i not in shared]
 
         points = []
-        for i, (chunk, vec) in enumerate(zip(chunks, vecs)):
-            pid = stable_id(f"{source_path}::p{page_number}::c{i}::{chunk[:120]}")
-            payload = {
-                "source": source_path,
-                "page_number": page_number,
-                "chunk_index": i,
-                "text": chunk,
-            }
-            if meta:
-                payload.update(meta)
-            points.append(qm.PointStruct(
-                id=pid,
-                vector=vec.tolist(),
-                payload=payload
-            ))
-
-        self.client.upsert(collection_name=self.cfg.collection, points=points)
+        if keep:
+            vecs = self.embed([chunks[i] for i in keep])
+            # upsert thay cả payload → giữ lại aliases đã gom vào các point này trước đó
+            prev_aliases = self._aliases_of([ids[i] for i in keep]) if self.dedup is not None and not self.cfg.content_ids else {}
+            for i, vec in zip(keep, vecs):
+                payload = {
+                    "source": source_path,
+                    "page_number": page_number,
+                    "chunk_index": i,
+                }
+                if self.docstore is None:
+                    payload["text"] = chunks[i]
+                if meta:
+                    payload.update(meta)
+                if prev_aliases.get(ids[i]):
+                    payload["aliases"] = prev_aliases[ids[i]]
+                payload["doc_groups"] = doc_groups_of(payload)
+                points.append(qm.PointStruct(
+                    id=ids[i],
+                    vector=vec.tolist(),
+                    payload=payload
+                ))
+            # text phải có trong docstore trước khi point search được
+            if self.docstore is not None:
+                self.docstore.put_many((ids[i], source_path, chunks[i]) for i in keep)
+            self._write(points)
+
+        if self.dedup is not None:
+            self.dedup.add((ids[i], source_path, doc_group, sigs[i]) for i in keep)
+        if dups or shared:
+            self._add_aliases({
+                i: (canon, {"source": source_path, "page_number": page_number, "chunk_index": i, "doc_group": doc_group})
+                for i, canon in {**dups, **shared}.items()
+            })
         return len(points)
 
-    def search(self, query: str, top_k: Optional[int] = None, allowed_groups: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    def _stored_content(self, ids: Dict[int, str]) -> Dict[int, str]:
+        """chunk_index -> point id của các chunk mà nội dung đã có point (trong collection hoặc trước đó trong lô)"""
+        first: Dict[str, int] = {}
+        shared: Dict[int, str] = {}
+        for i, pid in ids.items():
+            if pid in first:
+                shared[i] = pid
+            else:
+                first[pid] = i
+        candidates = list(first)
+        if self.writer is not None:
+            self.writer.wait_for(candidates)
+        recs = self.client.retrieve(collection_name=self.cfg.collection, ids=candidates, with_payload=False)
+        for r in recs:
+            shared[first[str(r.id)]] = str(r.id)
+        return shared
+
+    def _write(self, points: List[qm.PointStruct]):
+        if self.writer is not None:
+            self.writer.add(points)
+        else:
+            self.client.upsert(collection_name=self.cfg.collection, points=points)
+
+    def flush(self):
+        """Barrier: mọi point đã upsert đều search được (no-op khi không dùng BulkWriter)"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def after_flush(self, cb: Callable[[], None]):
+        """Chạy cb khi các point đã ghi tới giờ durable (ngay lập tức khi ghi đồng bộ)"""
+        if self.writer is not None:
+            self.writer.after_flush(cb)
+        else:
+            cb()
+
+    def _aliases_of(self, ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        recs = self.client.retrieve(collection_name=self.cfg.collection, ids=ids, with_payload=["aliases"])
+        return {str(r.id): (r.payload or {}).get("aliases") or [] for r in recs}
+
+    def _existing_dups(self, dups: Dict[int, str]) -> Dict[int, str]:
+        """Bỏ các match mà point gốc không còn trong Qdrant (index cũ) → chunk được upsert bình thường"""
+        if not dups:
+            return dups
+        canon = sorted(set(dups.values()))
+        if self.writer is not None:
+            # point gốc có thể vẫn đang trong buffer / chưa được apply
+            self.writer.wait_for(canon)
+        found = set(self._aliases_of(canon))
+        gone = {c for c in dups.values() if c not in found}
+        if gone:
+            self.dedup.forget(gone)
+            for _ in (c for c in dups.values() if c in gone):
+                self.dedup.not_duplicate()
+        return {i: c for i, c in dups.items() if c in found}
+
+    def _add_aliases(self, dups: Dict[int, tuple]):
+        """Ghi thêm bản copy (alias) vào point gốc và cập nhật doc_groups; bỏ qua nếu không đổi gì"""
+        by_canon: Dict[str, List[Dict[str, Any]]] = {}
+        for canon, alias in dups.values():
+            by_canon.setdefault(canon, []).append(alias)
+        if self.writer is not None:
+            # point gốc có thể vừa được upsert trong cùng lô
+            self.writer.wait_for(list(by_canon))
+        recs = self.client.retrieve(collection_name=self.cfg.collection, ids=list(by_canon),
+                                    with_payload=["source", "page_number", "chunk_index", "doc_group", "doc_groups", "aliases"])
+        for rec in recs:
+            p = rec.payload or {}
+            current = p.get("aliases") or []
+            merged = {_alias_key(a): a for a in current}
+            for a in by_canon[str(rec.id)]:
+                if _alias_key(a) != _alias_key(p):
+                    merged[_alias_key(a)] = a
+            aliases = list(merged.values())
+            groups = doc_groups_of({**p, "aliases": aliases})
+            if aliases == current and groups == p.get("doc_groups"):
+                continue
+            self.client.set_payload(
+                collection_name=self.cfg.collection,
+                payload={"aliases": aliases, "doc_groups": groups},
+                points=[rec.id],
+            )
+
+    def has_source(self, source_path: str) -> bool:
+        """True if the collection already has chunks from this source"""
+        res = self.client.count(
+            collection_name=self.cfg.collection,
+            count_filter=qm.Filter(must=[qm.FieldCondition(key="source", match=qm.MatchValue(value=source_path))]),
+            exact=False,
+        )
+        return res.count > 0
+
+    def count_source(self, source_path: str) -> int:
+        """Exact number of chunks stored for a source"""
+        flt = qm.Filter(must=[qm.FieldCondition(key="source", match=qm.MatchValue(value=source_path))])
+        return self.client.count(collection_name=self.cfg.collection, count_filter=flt, exact=True).count
+
+    def delete_source(self, source_path: str) -> int:
+        """Delete every chunk of a source (file removed / re-ingest after edit). Returns chunks removed"""
+        flt = qm.Filter(must=[qm.FieldCondition(key="source", match=qm.MatchValue(value=source_path))])
+        # chunk của source có thể còn trong BulkWriter → apply hết trước khi xoá
+        self.flush()
+        n = self.count_source(source_path)
+        has_aliases = self.dedup is not None or self.cfg.content_ids
+        if n:
+            if has_aliases:
+                self._promote_aliases(source_path, flt)
+            self.client.delete(collection_name=self.cfg.collection, points_selector=qm.FilterSelector(filter=flt))
+        if self.docstore is not None:
+            self.docstore.delete_source(source_path)
+        if self.dedup is not None:
+            self.dedup.forget_source(source_path)
+        if has_aliases:
+            self._drop_alias_source(source_path)
+        return n
+
+    def _drop_alias_source(self, source_path: str):
+        """Source bị xoá cũng không còn là alias của chunk nào"""
+        flt = qm.Filter(must=[qm.FieldCondition(key="aliases[].source", match=qm.MatchValue(value=source_path))])
+        offset = None
+        while True:
+            recs, offset = self.client.scroll(
+                collection_name=self.cfg.collection, scroll_filter=flt,
+                with_payload=["doc_group", "aliases"], with_vectors=False, limit=256, offset=offset,
+            )
+            for rec in recs:
+                p = rec.payload or {}
+                aliases = [a for a in p.get("aliases") or [] if a.get("source") != source_path]
+                self.client.set_payload(
+                    collection_name=self.cfg.collection,
+                    payload={"aliases": aliases, "doc_groups": doc_groups_of({**p, "aliases": aliases})},
+                    points=[rec.id],
+                )
+            if offset is None:
+                break
+
+    def _promote_aliases(self, source_path: str, flt: qm.Filter):
+        """
+        Point sắp bị xoá nhưng đang đại diện cho chunk trùng của source khác:
+        chuyển nó sang alias đầu tiên (cùng vector/text) để source kia không mất nội dung.
+        content_ids: giữ nguyên point id, chỉ đổi chunk chính + doc_groups.
+        """
+        flt = qm.Filter(must=flt.must, must_not=[qm.IsEmptyCondition(is_empty=qm.PayloadField(key="aliases"))])
+        offset = None
+        while True:
+            recs, offset = self.client.scroll(
+                collection_name=self.cfg.collection, scroll_filter=flt,
+                with_payload=True, with_vectors=True, limit=256, offset=offset,
+            )
+            promoted, index_items, texts = [], [], []
+            stored = self.docstore.get_many([str(r.id) for r in recs]) if self.docstore is not None else {}
+            for rec in recs:
+                p = dict(rec.payload or {})
+                # bản lặp lại trong chính source này cũng bị xoá theo
+                aliases = [a for a in p["aliases"] if a.get("source") != source_path]
+                if not aliases:
+                    continue
+                first, rest = aliases[0], aliases[1:]
+                p.update(first)
+                if p.get("doc_group") is None:
+                    p.pop("doc_group", None)
+                p["aliases"] = rest
+                p["doc_groups"] = doc_groups_of(p)
+                text = p.get("text") or stored.get(str(rec.id), "")
+                if self.cfg.content_ids:
+                    pid = str(rec.id)
+                else:
+                    pid = stable_id(f"{first['source']}::p{first.get('page_number')}::c{first.get('chunk_index')}::{text[:120]}")
+                promoted.append(qm.PointStruct(id=pid, vector=rec.vector, payload=p))
+                texts.append((pid, first["source"], text))
+                sig = self.dedup.signature(str(rec.id)) if self.dedup is not None else None
+                if sig is not None:
+                    index_items.append((pid, first["source"], p.get("doc_group"), sig))
+            if promoted:
+                if self.docstore is not None:
+                    self.docstore.put_many(texts)
+                self.client.upsert(collection_name=self.cfg.collection, points=promoted)
+                if index_items:
+                    self.dedup.add(index_items)
+            if offset is None:
+                break
+
+    def doc_groups(self) -> set:
+        """Distinct doc_group values in the collection (doc_group + doc_groups payload fields only, no vectors)"""
+        groups = set()
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.cfg.collection,
+                with_payload=["doc_group", "doc_groups"],
+                with_vectors=False,
+                limit=1000,
+                offset=offset,
+            )
+            for p in points:
+                payload = p.payload or {}
+                groups.update(g for g in [payload.get("doc_group")] + (payload.get("doc_groups") or [])
+                              if g and g != PUBLIC_DOC_GROUP)
+            if offset is None:
+                break
+        return groups
+
+    def select_context(self, hits: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Adaptive top-k: số chunk đưa vào prompt theo phân bố score thay vì cố định top_k
+        (hits là candidates: top_k của search, hoặc hit list của hội thoại).
+        Duyệt theo score giảm dần, dừng ở chunk đầu tiên:
+          - score < min_score
+          - score < top_score * (1 - max_score_gap)   (cách quá xa chunk tốt nhất)
+          - vượt max_context_chars (tổng text đưa vào CONTEXT)
+        Luôn giữ ít nhất min_k chunk. -> (hits đã chọn, thông tin cho rag_meta)
+        """
+        cfg = self.cfg
+        ranked = sorted(hits, key=lambda h: -float(h.get("score") or 0.0))
+        top = float(ranked[0]["score"]) if ranked else 0.0
+        out: List[Dict[str, Any]] = []
+        chars, stop = 0, None
+        for h in ranked:
+            score, n = float(h.get("score") or 0.0), len(h.get("text") or "")
+            if len(out) >= cfg.min_k:
+                if cfg.min_score and score < cfg.min_score:
+                    stop = "min_score"
+                elif cfg.max_score_gap and score < top * (1 - cfg.max_score_gap):
+                    stop = "gap"
+                elif cfg.max_context_chars and chars + n > cfg.max_context_chars:
+                    stop = "budget"
+                if stop:
+                    break
+            out.append(h)
+            chars += n
+        dropped = sum(len(h.get("text") or "") for h in ranked[len(out):])
+        return out, {
+            "k": len(out),
+            "candidates": len(ranked),
+            "stop": stop,
+            "context_chars": chars,
+            "dropped_chars": dropped,
+        }
+
+    def search(self, query: str, top_k: Optional[int] = None, allowed_groups: Optional[List[str]] = None,
+               query_vector: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """query_vector: embedding đã có sẵn (retrieval cache) → bỏ qua bước embed"""
         k = top_k or self.cfg.top_k
-        qv = self.embed([query])[0].tolist()
+        qv = (query_vector if query_vector is not None else self.embed_query(query)).tolist()
         
         # Build filter for group-based access control
-        query_filter = None
-        if allowed_groups:
-            # Match documents with doc_group in allowed_groups, OR no doc_group (public)
-            query_filter = qm.Filter(
-                should=[
-                    # Has doc_group and it's in allowed_groups
-                    qm.FieldCondition(
-                        key="doc_group",
-                        match=qm.MatchAny(any=allowed_groups)
-                    ),
-                    # OR doesn't have doc_group (public docs)
-                    qm.IsNullCondition(is_null=qm.PayloadField(key="doc_group"))
-                ]
-            )
-        
+        query_filter = acl_filter(allowed_groups) if allowed_groups else None
+
         hits = self.client.search(
             collection_name=self.cfg.collection,
             query_vector=qv,
             limit=k,
             query_filter=query_filter,
-            with_payload=True,
+            # docstore: chỉ lấy field nhỏ ("text" vẫn xin để đọc được point chưa migrate)
+            with_payload=_HIT_FIELDS if self.docstore is not None else True,
         )
         out = []
         for h in hits:
             p = h.payload or {}
+            cite = _cited(p, allowed_groups)
             out.append({
                 "score": float(h.score),
-                "source": p.get("source"),
-                "page_number": p.get("page_number"),
-                "chunk_index": p.get("chunk_index"),
+                "source": cite.get("source"),
+                "page_number": cite.get("page_number"),
+                "chunk_index": cite.get("chunk_index"),
                 "text": p.get("text"),
-                "doc_group": p.get("doc_group"),
+                "doc_group": cite.get("doc_group"),
+                "doc_groups": p.get("doc_groups"),
             })
+        if self.docstore is not None:
+            # hydrate text cho top-k cuối cùng trong một lần đọc batch
+            missing = [str(h.id) for h, o in zip(hits, out) if o["text"] is None]
+            texts = self.docstore.get_many(missing) if missing else {}
+            for h, o in zip(hits, out):
+                if o["text"] is None:
+                    o["text"] = texts.get(str(h.id), "")
         return out
@@ -0,0 +1,403 @@
+"""
+Corpus snapshot: bootstrap node RAG mới từ archive thay vì OCR + embed lại toàn bộ docs.
+
+    python snapshot.py export /app/.cache/snapshots/corpus.tar
+    python snapshot.py import /app/.cache/snapshots/corpus.tar [--merge] [--workers 8]
+    python snapshot.py info   /app/.cache/snapshots/corpus.tar
+
+Archive = tar không nén (đọc/ghi tuần tự, stream được qua pipe với "-"), các member
+tự nén bằng zstd (có checksum frame):
+    manifest.json                   luôn là member đầu: format version, embed model, dim,
+                                    chunk settings → import từ chối trước khi ghi gì nếu lệch
+    points/NNNNNN.msgpack.zst       [[id, vector <f4 bytes, payload], ...] (vectors + payload)
+    ocr/NNNNNN.msgpack.zst          {file name: text} của CACHE_DIR/ocr
+    qemb/NNNNNN.msgpack.zst         query embedding cache trong Redis (key, bytes, ttl ms)
+    state/<name>.sqlite.zst         ingest checkpoints (manifest các file đã ingest) + dedup index
+    summary.json                    số lượng từng phần (kiểm tra sau import)
+
+Import stream từng member, decode + upsert song song (BulkWriter: nhiều connection,
+backpressure), nên node mới sẵn sàng trong vài phút.
+"""
+from __future__ import annotations
+import argparse
+import io
+import json
+import os
+import sqlite3
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import msgpack
+import numpy as np
+import zstandard as zstd
+
+from utils import ensure_dir
+
+FORMAT = "rag-snapshot"
+FORMAT_VERSION = 1
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", "/app/.cache"))
+SNAPSHOT_POINTS_PER_PART = int(os.environ.get("SNAPSHOT_POINTS_PER_PART", "2048"))
+SNAPSHOT_WORKERS = int(os.environ.get("SNAPSHOT_WORKERS", str(min(8, os.cpu_count() or 4))))
+SNAPSHOT_ZSTD_LEVEL = int(os.environ.get("SNAPSHOT_ZSTD_LEVEL", "6"))
+_OCR_PER_PART = 500
+
+# setting phải khớp giữa node export và node import (khác → vector / chunk id không dùng chung được)
+_MUST_MATCH = ("embed_model", "dim", "chunk_size", "chunk_overlap", "chunk_ids")
+# archive export trước khi có setting đó
+_SETTING_DEFAULTS = {"chunk_ids": "source"}
+
+class SnapshotMismatch(Exception):
+    pass
+
+def _pack(obj: Any) -> bytes:
+    return zstd.ZstdCompressor(level=SNAPSHOT_ZSTD_LEVEL, write_checksum=True).compress(
+        msgpack.packb(obj, use_bin_type=True))
+
+def _unpack(blob: bytes) -> Any:
+    return msgpack.unpackb(zstd.ZstdDecompressor().decompress(blob), raw=False)
+
+def _state_files() -> Dict[str, str]:
+    from checkpoint import CHECKPOINT_DB
+    from dedup import DEDUP_DB
+    return {"ingest_checkpoints": CHECKPOINT_DB, "dedup_index": DEDUP_DB}
+
+def _docstore(cfg):
+    if not cfg.docstore_path:
+        return None
+    from docstore import DocStore
+    return DocStore(cfg.docstore_path)
+
+def _settings(cfg, dim: Optional[int]) -> Dict[str, Any]:
+    return {
+        "embed_model": cfg.embed_model,
+        "dim": dim,
+        "chunk_size": cfg.chunk_size,
+        "chunk_overlap": cfg.chunk_overlap,
+        "chunk_ids": "content" if cfg.content_ids else "source",
+        "collection": cfg.collection,
+        "ocr_lang": os.environ.get("OCR_LANG", "eng"),
+        "ocr_dpi": int(os.environ.get("OCR_DPI", "250")),
+    }
+
+class _TarOut:
+    """Ghi member theo thứ tự vào tar stream (thread-safe)"""
+    def __init__(self, path: str):
+        self._fh = sys.stdout.buffer if path == "-" else open(path, "wb")
+        self.tar = tarfile.open(fileobj=self._fh, mode="w|")
+        self._lock = threading.Lock()
+
+    def add(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        with self._lock:
+            self.tar.addfile(info, io.BytesIO(data))
+
+    def add_file(self, name: str, path: Path):
+        with self._lock:
+            self.tar.add(str(path), arcname=name)
+
+    def close(self):
+        self.tar.close()
+        if self._fh is not sys.stdout.buffer:
+            self._fh.close()
+
+def _ordered(pool: ThreadPoolExecutor, items: Iterator, fn, window: int) -> Iterator:
+    """map song song nhưng giữ thứ tự, tối đa window job đang chạy"""
+    pending: List[Future] = []
+    for it in items:
+        pending.append(pool.submit(fn, it))
+        if len(pending) >= window:
+            yield pending.pop(0).result()
+    for f in pending:
+        yield f.result()
+
+# ---------- export ----------
+def _scroll_points(client, collection: str) -> Iterator[List[Any]]:
+    offset = None
+    while True:
+        recs, offset = client.scroll(collection_name=collection, with_payload=True, with_vectors=True,
+                                     limit=SNAPSHOT_POINTS_PER_PART, offset=offset)
+        if recs:
+            yield recs
+        if offset is None:
+            break
+
+def _encode_points(recs: List[Any], docstore=None) -> bytes:
+    # archive luôn chứa text trong payload, dù node nguồn / đích có dùng docstore hay không
+    texts = docstore.get_many([str(p.id) for p in recs]) if docstore is not None else {}
+    rows = []
+    for p in recs:
+        payload = dict(p.payload or {})
+        if "text" not in payload and str(p.id) in texts:
+            payload["text"] = texts[str(p.id)]
+        rows.append([str(p.id), np.asarray(p.vector, dtype="<f4").tobytes(), payload])
+    return _pack(rows)
+
+def _ocr_batches() -> Iterator[Dict[str, str]]:
+    ocr_dir = CACHE_DIR / "ocr"
+    if not ocr_dir.is_dir():
+        return
+    batch: Dict[str, str] = {}
+    for f in sorted(ocr_dir.iterdir()):
+        if f.is_file() and f.suffix == ".txt":
+            batch[f.name] = f.read_text(encoding="utf-8", errors="ignore")
+            if len(batch) >= _OCR_PER_PART:
+                yield batch
+                batch = {}
+    if batch:
+        yield batch
+
+def export_snapshot(path: str, workers: int = SNAPSHOT_WORKERS, with_query_cache: bool = True) -> Dict[str, Any]:
+    from ingest import make_config
+    from rag import make_vector_client
+
+    cfg = make_config()
+    client = make_vector_client(cfg)
+    docstore = _docstore(cfg)
+    first = client.scroll(collection_name=cfg.collection, with_vectors=True, limit=1)[0]
+    if not first:
+        raise SystemExit(f"collection {cfg.collection} is empty, nothing to export")
+    dim = len(first[0].vector)
+    manifest = {
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "created_at": time.time(),
+        "settings": _settings(cfg, dim),
+        "vector_backend": cfg.vector_backend,
+    }
+    summary: Dict[str, Any] = {"points": 0, "point_parts": 0, "ocr_files": 0, "query_embeddings": 0, "state": []}
+    out = _TarOut(path)
+    t0 = time.time()
+    try:
+        out.add("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="snapshot") as pool:
+            parts = _ordered(pool, _scroll_points(client, cfg.collection),
+                             lambda recs: (len(recs), _encode_points(recs, docstore)), window=2 * workers)
+            for i, (n, blob) in enumerate(parts):
+                out.add(f"points/{i:06d}.msgpack.zst", blob)
+                summary["points"] += n
+                summary["point_parts"] += 1
+            for i, batch in enumerate(_ocr_batches()):
+                out.add(f"ocr/{i:06d}.msgpack.zst", _pack(batch))
+                summary["ocr_files"] += len(batch)
+        if with_query_cache:
+            try:
+                from cache import export_query_embeddings
+                for i, items in enumerate(export_query_embeddings(cfg.embed_model)):
+                    out.add(f"qemb/{i:06d}.msgpack.zst", _pack(items))
+                    summary["query_embeddings"] += len(items)
+            except Exception as e:
+                print(f"[SNAPSHOT] skip query embedding cache: {e}", file=sys.stderr)
+        for name, db in _state_files().items():
+            if not Path(db).exists():
+                continue
+            with tempfile.TemporaryDirectory() as tmp:
+                # backup API → bản copy nhất quán kể cả khi ingest/watcher đang ghi (WAL)
+                copy = Path(tmp) / f"{name}.sqlite"
+                src, dst = sqlite3.connect(db), sqlite3.connect(str(copy))
+                src.backup(dst)
+                src.close()
+                dst.close()
+                packed = Path(tmp) / f"{name}.sqlite.zst"
+                with open(copy, "rb") as fi, open(packed, "wb") as fo:
+                    zstd.ZstdCompressor(level=SNAPSHOT_ZSTD_LEVEL, write_checksum=True).copy_stream(fi, fo)
+                out.add_file(f"state/{name}.sqlite.zst", packed)
+            summary["state"].append(name)
+        summary["elapsed_sec"] = round(time.time() - t0, 1)
+        out.add("summary.json", json.dumps(summary).encode("utf-8"))
+    finally:
+        out.close()
+    return {"manifest": manifest, "summary": summary}
+
+# ---------- import ----------
+def check_settings(manifest: Dict[str, Any], cfg, current_dim: Optional[int] = None) -> None:
+    """Raise SnapshotMismatch nếu archive không dùng được với config của node này"""
+    if manifest.get("format") != FORMAT:
+        raise SnapshotMismatch("not a corpus snapshot archive")
+    if int(manifest.get("version", 0)) > FORMAT_VERSION:
+        raise SnapshotMismatch(f"snapshot format v{manifest.get('version')} is newer than supported v{FORMAT_VERSION}")
+    want = manifest.get("settings") or {}
+    have = _settings(cfg, current_dim if current_dim is not None else want.get("dim"))
+    want = {**_SETTING_DEFAULTS, **want}
+    diff = {k: {"snapshot": want.get(k), "node": have[k]} for k in _MUST_MATCH if want.get(k) != have[k]}
+    if diff:
+        raise SnapshotMismatch(f"settings mismatch: {json.dumps(diff, ensure_ascii=False)}")
+
+def _collection_dim(client, collection: str) -> Optional[int]:
+    names = [c.name for c in client.get_collections().collections]
+    if collection not in names:
+        return None
+    recs = client.scroll(collection_name=collection, with_vectors=True, limit=1)[0]
+    return len(recs[0].vector) if recs else None
+
+def _open_in(path: str) -> tarfile.TarFile:
+    fh = sys.stdin.buffer if path == "-" else open(path, "rb")
+    return tarfile.open(fileobj=fh, mode="r|")
+
+def import_snapshot(path: str, merge: bool = False, workers: int = SNAPSHOT_WORKERS) -> Dict[str, Any]:
+    from ingest import make_config
+    from rag import make_vector_client, BulkWriter, PUBLIC_DOC_GROUP
+    from qdrant_client.http import models as qm
+
+    cfg = make_config()
+    client = make_vector_client(cfg)
+    tar = _open_in(path)
+    member = tar.next()
+    if member is None or member.name != "manifest.json":
+        raise SnapshotMismatch("archive does not start with manifest.json")
+    manifest = json.loads(tar.extractfile(member).read())
+    dim = manifest["settings"]["dim"]
+    existing_dim = _collection_dim(client, cfg.collection)
+    check_settings(manifest, cfg, existing_dim)
+
+    names = [c.name for c in client.get_collections().collections]
+    if cfg.collection not in names:
+        client.create_collection(
+            collection_name=cfg.collection,
+            vectors_config=qm.VectorParams(size=dim, distance=qm.Distance.COSINE),
+        )
+    elif not merge and client.count(collection_name=cfg.collection, exact=True).count:
+        raise SnapshotMismatch(f"collection {cfg.collection} is not empty (use --merge to upsert into it)")
+
+    writer = BulkWriter(client, cfg.collection, cfg.upsert_batch_size or 256,
+                        max(cfg.upsert_concurrency, workers), max(cfg.upsert_max_inflight, 2 * workers))
+    counts = {"points": 0, "ocr_files": 0, "query_embeddings": 0, "state": []}
+    groups: set = set()
+    lock = threading.Lock()
+    ocr_dir = ensure_dir(CACHE_DIR / "ocr")
+    docstore = _docstore(cfg)
+
+    def load_points(blob: bytes):
+        rows = _unpack(blob)
+        if docstore is not None:
+            # text vào docstore trước khi point search được, payload chỉ giữ field filter
+            docstore.put_many((pid, p.get("source"), p.pop("text")) for pid, _, p in rows if "text" in p)
+        pts = [qm.PointStruct(id=pid, vector=np.frombuffer(vec, dtype="<f4").tolist(), payload=payload)
+               for pid, vec, payload in rows]
+        writer.add(pts)
+        with lock:
+            counts["points"] += len(pts)
+            groups.update(p.get("doc_group") for _, _, p in rows)
+            groups.update(g for _, _, p in rows for g in p.get("doc_groups") or [] if g != PUBLIC_DOC_GROUP)
+
+    def load_ocr(blob: bytes):
+        n = 0
+        for name, text in _unpack(blob).items():
+            f = ocr_dir / Path(name).name
+            if not f.exists():
+                f.write_text(text, encoding="utf-8")
+                n += 1
+        with lock:
+            counts["ocr_files"] += n
+
+    t0 = time.time()
+    summary: Dict[str, Any] = {}
+    qemb: List[Any] = []
+    slots = threading.BoundedSemaphore(2 * max(1, workers))
+    futs: List[Future] = []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="snapshot") as pool:
+        def submit(fn, blob):
+            slots.acquire()
+            f = pool.submit(fn, blob)
+            f.add_done_callback(lambda _: slots.release())
+            futs.append(f)
+
+        while True:
+            # stream mode: đọc member kế tiếp (không quay lại manifest đã đọc)
+            member = tar.next()
+            if member is None:
+                break
+            if not member.isfile():
+                continue
+            data = tar.extractfile(member)
+            if member.name.startswith("points/"):
+                submit(load_points, data.read())
+            elif member.name.startswith("ocr/"):
+                submit(load_ocr, data.read())
+            elif member.name.startswith("qemb/"):
+                qemb.extend(_unpack(data.read()))
+            elif member.name.startswith("state/"):
+                name = Path(member.name).name.split(".")[0]
+                target = _state_files().get(name)
+                if target is None:
+                    continue
+                if Path(target).exists() and merge:
+                    print(f"[SNAPSHOT] keep existing {target}")
+                    continue
+                ensure_dir(Path(target).parent)
+                tmp = f"{target}.import"
+                with open(tmp, "wb") as fo:
+                    zstd.ZstdDecompressor().copy_stream(data, fo)
+                for suffix in ("-wal", "-shm"):
+                    Path(target + suffix).unlink(missing_ok=True)
+                os.replace(tmp, target)
+                counts["state"].append(name)
+            elif member.name == "summary.json":
+                summary = json.loads(data.read())
+        for f in futs:
+            f.result()
+    tar.close()
+    # barrier: mọi point đã search được trước khi báo xong
+    writer.flush()
+
+    if qemb:
+        try:
+            from cache import import_query_embeddings
+            counts["query_embeddings"] = import_query_embeddings(qemb)
+        except Exception as e:
+            print(f"[SNAPSHOT] skip query embedding cache: {e}", file=sys.stderr)
+    # scope set cho cache keys + bump version: answer cache cũ (nếu --merge) không còn đúng
+    try:
+        from cache import register_corpus_groups, bump_group_versions
+        named = {g for g in groups if g}
+        if named:
+            register_corpus_groups(sorted(named))
+        counts["group_versions"] = bump_group_versions(groups)
+    except Exception as e:
+        print(f"[SNAPSHOT] cache scope not updated: {e}", file=sys.stderr)
+
+    counts["elapsed_sec"] = round(time.time() - t0, 1)
+    if summary and summary.get("points") != counts["points"]:
+        raise SnapshotMismatch(f"archive truncated: expected {summary.get('points')} points, imported {counts['points']}")
+    return {"manifest": manifest, "imported": counts}
+
+def snapshot_info(path: str) -> Dict[str, Any]:
+    tar = _open_in(path)
+    manifest, summary = None, None
+    for member in tar:
+        if member.name == "manifest.json":
+            manifest = json.loads(tar.extractfile(member).read())
+        elif member.name == "summary.json":
+            summary = json.loads(tar.extractfile(member).read())
+    tar.close()
+    return {"manifest": manifest, "summary": summary}
+
+def main():
+    ap = argparse.ArgumentParser(description="Export / import corpus snapshots")
+    ap.add_argument("command", choices=["export", "import", "info"])
+    ap.add_argument("path", help="archive path ('-' = stdout/stdin)")
+    ap.add_argument("--workers", type=int, default=SNAPSHOT_WORKERS)
+    ap.add_argument("--merge", action="store_true", help="import vào collection đã có dữ liệu")
+    ap.add_argument("--no-query-cache", action="store_true", help="export không kèm query embedding cache")
+    args = ap.parse_args()
+    try:
+        if args.command == "export":
+            res = export_snapshot(args.path, args.workers, with_query_cache=not args.no_query_cache)
+        elif args.command == "import":
+            res = import_snapshot(args.path, merge=args.merge, workers=args.workers)
+        else:
+            res = snapshot_info(args.path)
+    except SnapshotMismatch as e:
+        print(f"[SNAPSHOT] refused: {e}", file=sys.stderr)
+        sys.exit(2)
+    print(json.dumps(res, ensure_ascii=False, indent=2), file=sys.stderr if args.path == "-" else sys.stdout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Watch-folder ingestion daemon cho /app/docs.
+
+Theo dõi file created / modified / deleted (inotify qua watchdog, fallback polling
+mtime+size), gom burst sự kiện (debounce) rồi chỉ ingest lại đúng các file bị ảnh
+hưởng. doc_group suy ra từ folder (infer_group_from_path) như ingest.py; cache
+invalidation chỉ áp dụng cho source / group vừa thay đổi (invalidate_caches).
+
+Chạy:  python watcher.py            (service ingest-watcher trong docker-compose)
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from ingest import (
+    DOCS_BASE, SUPPORTED_SUFFIXES, make_store, reingest_file, remove_file, invalidate_caches,
+    reset_ingest_state, infer_group_from_path,
+)
+from cache import refresh_corpus_groups
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except Exception:
+    WATCHDOG_AVAILABLE = False
+    FileSystemEventHandler = object
+
+# auto = inotify nếu có watchdog, ngược lại polling; poll = luôn polling (NFS/SMB, Docker Desktop)
+WATCH_MODE = os.environ.get("WATCH_MODE", "auto").lower()
+WATCH_DEBOUNCE_SEC = float(os.environ.get("WATCH_DEBOUNCE_SEC", "3"))
+# burst kéo dài (copy cả folder lớn) vẫn được flush sau tối đa thời gian này
+WATCH_MAX_DELAY_SEC = float(os.environ.get("WATCH_MAX_DELAY_SEC", "60"))
+WATCH_POLL_SEC = float(os.environ.get("WATCH_POLL_SEC", "5"))
+
+def is_candidate(path: Path) -> bool:
+    """File có loader và không phải file tạm của editor/Office"""
+    name = path.name
+    if name.startswith(".") or name.startswith("~$") or name.endswith((".tmp", ".part", ".swp")):
+        return False
+    return path.suffix.lower() in SUPPORTED_SUFFIXES
+
+class ChangeBuffer:
+    """Gom sự kiện theo path: path -> "upsert" | "delete" (sự kiện cuối cùng thắng)"""
+    def __init__(self):
+        self._pending: Dict[str, str] = {}
+        self._first_at: Optional[float] = None
+        self._last_at = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, path: str, kind: str):
+        if not is_candidate(Path(path)):
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._pending[path] = kind
+            if self._first_at is None:
+                self._first_at = now
+            self._last_at = now
+
+    def take_if_quiet(self) -> Dict[str, str]:
+        """Trả về batch khi đã im lặng WATCH_DEBOUNCE_SEC (hoặc quá WATCH_MAX_DELAY_SEC)"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending:
+                return {}
+            if now - self._last_at < WATCH_DEBOUNCE_SEC and now - self._first_at < WATCH_MAX_DELAY_SEC:
+                return {}
+            batch, self._pending, self._first_at = self._pending, {}, None
+            return batch
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, buf: ChangeBuffer):
+        self.buf = buf
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        if event.event_type in ("created", "modified", "closed"):
+            self.buf.add(event.src_path, "upsert")
+        elif event.event_type == "deleted":
+            self.buf.add(event.src_path, "delete")
+        elif event.event_type == "moved":
+            self.buf.add(event.src_path, "delete")
+            self.buf.add(event.dest_path, "upsert")
+
+def _snapshot(base: Path) -> Dict[str, Tuple[float, int]]:
+    out = {}
+    for p in base.rglob("*"):
+        try:
+            if p.is_file() and is_candidate(p):
+                st = p.stat()
+                out[str(p)] = (st.st_mtime, st.st_size)
+        except OSError:
+            continue
+    return out
+
+class Poller:
+    """Fallback khi không có inotify: so sánh snapshot mtime/size mỗi WATCH_POLL_SEC"""
+    def __init__(self, base: Path, buf: ChangeBuffer):
+        self.base = base
+        self.buf = buf
+        self._prev = _snapshot(base)
+
+    def poll(self):
+        cur = _snapshot(self.base)
+        for path, sig in cur.items():
+            if self._prev.get(path) != sig:
+                self.buf.add(path, "upsert")
+        for path in self._prev.keys() - cur.keys():
+            self.buf.add(path, "delete")
+        self._prev = cur
+
+def process_batch(store, batch: Dict[str, str]) -> Dict[str, object]:
+    """Ingest / xoá các file trong batch rồi invalidate cache cho đúng phần thay đổi"""
+    reset_ingest_state()
+    chunks = removed = 0
+    groups = set()
+    for path_str, kind in sorted(batch.items()):
+        path = Path(path_str)
+        groups.add(infer_group_from_path(path, DOCS_BASE))
+        try:
+            if kind == "delete" or not path.exists():
+                n = remove_file(store, path)
+                removed += n
+                print(f"[WATCH] deleted {path} chunks={n}")
+            else:
+                _, n = reingest_file(store, path)
+                chunks += n
+        except Exception as e:
+            # file đang được ghi dở / hỏng → bỏ qua, sự kiện sau sẽ thử lại
+            print(f"[WATCH] {path} error={e}")
+    store.flush()
+    res = invalidate_caches()
+    if removed:
+        # group có thể vừa mất hết tài liệu → thu hẹp lại tập corpus groups
+        try:
+            refresh_corpus_groups(store.doc_groups())
+        except Exception as e:
+            print(f"[WATCH] corpus groups refresh failed: {e}")
+    reset_ingest_state()
+    dd = store.dedup.stats() if store.dedup is not None else None
+    print(f"[WATCH] batch files={len(batch)} groups={sorted(g or '-' for g in groups)} "
+          f"chunks={chunks} removed={removed} cache={res} dedup={dd}")
+    return {"files": len(batch), "chunks": chunks, "removed": removed, "cache": res}
+
+def main():
+    base = DOCS_BASE
+    store = make_store()
+    buf = ChangeBuffer()
+
+    use_inotify = WATCH_MODE != "poll" and WATCHDOG_AVAILABLE
+    poller = None
+    if use_inotify:
+        observer = Observer()
+        observer.schedule(_Handler(buf), str(base), recursive=True)
+        observer.start()
+        print(f"[WATCH] inotify watching {base} (debounce={WATCH_DEBOUNCE_SEC}s)")
+    else:
+        poller = Poller(base, buf)
+        print(f"[WATCH] polling {base} every {WATCH_POLL_SEC}s (debounce={WATCH_DEBOUNCE_SEC}s)")
+
+    next_poll = time.monotonic() + WATCH_POLL_SEC
+    while True:
+        time.sleep(0.5)
+        if poller and time.monotonic() >= next_poll:
+            poller.poll()
+            next_poll = time.monotonic() + WATCH_POLL_SEC
+        batch = buf.take_if_quiet()
+        if batch:
+            process_batch(store, batch)
+
+if __name__ == "__main__":
+    main()
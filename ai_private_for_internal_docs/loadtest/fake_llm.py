@@ -0,0 +1,194 @@
+"""
+Fake OpenAI-compatible LLM server cho load test (thay thế vLLM).
+
+Mô phỏng:
+- time-to-first-token (TTFT)
+- tốc độ sinh token (tokens/s)
+- tỉ lệ lỗi (HTTP 500/503)
+
+Chỉ dùng stdlib để chạy được ở bất kỳ đâu:
+    python fake_llm.py --port 8001 --ttft-ms 300 --tokens-per-sec 40 --error-rate 0.01
+
+Backend trỏ vào: LLM_BASE_URL=http://<host>:8001/v1
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+_TAG_RE = re.compile(r"^- \((.+?)(?: \| page (\d+))?\) ", re.MULTILINE)
+
+class Settings:
+    ttft_ms: float = 300.0
+    tokens_per_sec: float = 40.0
+    error_rate: float = 0.0
+    output_tokens: int = 120
+    jitter: float = 0.2
+    model: str = "fake-llm"
+
+S = Settings()
+
+_lock = threading.Lock()
+_stats = {"requests": 0, "errors": 0, "inflight": 0, "max_inflight": 0}
+
+def _approx_tokens(text: str) -> int:
+    # ~4 chars / token, đủ dùng cho benchmark tương đối
+    return max(1, len(text) // 4)
+
+def _citations(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    out = []
+    for src, page in _TAG_RE.findall(system)[:3]:
+        out.append({"source": src, "page": int(page) if page else None})
+    return out
+
+def _answer_text(n_tokens: int, messages: List[Dict[str, Any]]) -> str:
+    body = " ".join(["lorem"] * max(1, n_tokens - 10))
+    return json.dumps({"answer": body, "citations": _citations(messages)}, ensure_ascii=False)
+
+def _jittered(v: float) -> float:
+    if S.jitter <= 0:
+        return v
+    return max(0.0, v * random.uniform(1 - S.jitter, 1 + S.jitter))
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        # im lặng, load test sinh quá nhiều log
+        pass
+
+    def _send_json(self, code: int, obj: Dict[str, Any]):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/health", "/v1/health"):
+            self._send_json(200, {"ok": True})
+        elif self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": S.model, "object": "model"}]})
+        elif self.path.rstrip("/") == "/stats":
+            with _lock:
+                self._send_json(200, dict(_stats))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            req = json.loads(self.rfile.read(length) or b"{}")
+        except Exception:
+            self._send_json(400, {"error": "invalid json"})
+            return
+
+        with _lock:
+            _stats["requests"] += 1
+            _stats["inflight"] += 1
+            _stats["max_inflight"] = max(_stats["max_inflight"], _stats["inflight"])
+        try:
+            self._complete(req)
+        finally:
+            with _lock:
+                _stats["inflight"] -= 1
+
+    def _complete(self, req: Dict[str, Any]):
+        messages = req.get("messages") or []
+        max_tokens = int(req.get("max_tokens") or S.output_tokens)
+        n_out = min(S.output_tokens, max_tokens)
+        prompt_tokens = sum(_approx_tokens(m.get("content", "")) for m in messages)
+
+        time.sleep(_jittered(S.ttft_ms) / 1000.0)
+
+        if S.error_rate > 0 and random.random() < S.error_rate:
+            with _lock:
+                _stats["errors"] += 1
+            self._send_json(random.choice([500, 503]), {"error": {"message": "fake llm injected error"}})
+            return
+
+        per_token = 1.0 / S.tokens_per_sec if S.tokens_per_sec > 0 else 0.0
+        text = _answer_text(n_out, messages)
+        cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = req.get("model") or S.model
+
+        if req.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            words = text.split(" ")
+            for i, w in enumerate(words):
+                delta = {"content": (w if i == 0 else " " + w)}
+                chunk = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if per_token:
+                    time.sleep(_jittered(per_token))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+
+        time.sleep(_jittered(per_token * n_out))
+        self._send_json(200, {
+            "id": cid,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": n_out,
+                "total_tokens": prompt_tokens + n_out,
+            },
+        })
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM for load testing")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8001)
+    ap.add_argument("--ttft-ms", type=float, default=S.ttft_ms, help="time-to-first-token (ms)")
+    ap.add_argument("--tokens-per-sec", type=float, default=S.tokens_per_sec, help="decode speed per request")
+    ap.add_argument("--error-rate", type=float, default=S.error_rate, help="0..1, tỉ lệ trả về 5xx")
+    ap.add_argument("--output-tokens", type=int, default=S.output_tokens, help="số token mỗi câu trả lời")
+    ap.add_argument("--jitter", type=float, default=S.jitter, help="±tỉ lệ dao động latency")
+    ap.add_argument("--model", default=S.model)
+    args = ap.parse_args()
+
+    S.ttft_ms = args.ttft_ms
+    S.tokens_per_sec = args.tokens_per_sec
+    S.error_rate = args.error_rate
+    S.output_tokens = args.output_tokens
+    S.jitter = args.jitter
+    S.model = args.model
+
+    srv = ThreadingHTTPServer((args.host, args.port), Handler)
+    srv.daemon_threads = True
+    print(f"[fake-llm] listening on {args.host}:{args.port} ttft={S.ttft_ms}ms "
+          f"tps={S.tokens_per_sec} err={S.error_rate} out_tokens={S.output_tokens}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
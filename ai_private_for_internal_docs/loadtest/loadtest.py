@@ -0,0 +1,265 @@
+"""
+Load generator cho /v1/chat/completions.
+
+Tăng dần concurrency và đo throughput, tail latency, cache hit rate để ước lượng
+một backend pod phục vụ được bao nhiêu user đồng thời.
+
+Traffic mix:
+- Câu hỏi lặp lại theo phân bố Zipf trên một tập "hot" (giống FAQ thật),
+  phần còn lại là câu hỏi unique (luôn cache miss).
+- Nhiều scope quyền: mỗi dòng trong --tokens-file là một Bearer token (JWT của
+  user thuộc các AD group khác nhau). Không có file → dùng --api-key (scope rỗng).
+- Một phần nhỏ request gửi feedback "không hài lòng" (/feedback/bad).
+
+Ví dụ:
+    python loadtest.py --base-url http://localhost:8080 --api-key $API_KEY \\
+        --concurrency 1,4,16,32 --duration 30 --repeat-ratio 0.8 --feedback-rate 0.01
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import requests
+
+DEFAULT_QUESTIONS = [
+    "Quy trình xin nghỉ phép như thế nào?",
+    "Chính sách làm việc từ xa của công ty là gì?",
+    "Thời gian thử việc kéo dài bao lâu?",
+    "Làm sao để reset mật khẩu VPN?",
+    "Quy trình báo cáo sự cố bảo mật?",
+    "Chế độ bảo hiểm sức khỏe gồm những gì?",
+    "Hạn mức công tác phí mỗi ngày là bao nhiêu?",
+    "Ai phê duyệt yêu cầu mua sắm thiết bị?",
+    "Quy định về giờ làm việc và chấm công?",
+    "Cách đăng ký tham gia khóa đào tạo nội bộ?",
+    "Quy trình onboarding nhân viên mới?",
+    "Chính sách thưởng cuối năm được tính thế nào?",
+    "Làm sao để yêu cầu quyền truy cập hệ thống?",
+    "Quy trình deploy lên production?",
+    "Runbook xử lý khi database bị đầy ổ đĩa?",
+]
+
+@dataclass
+class Sample:
+    ok: bool
+    latency_ms: float
+    status: int
+    cache_hit: Optional[bool] = None
+    prompt_tokens: Optional[int] = None
+    # adaptive top-k: số chunk vào prompt và số ký tự context đã bỏ (rag_meta.k_selection)
+    k: Optional[int] = None
+    dropped_chars: Optional[int] = None
+    feedback: bool = False
+
+@dataclass
+class StepResult:
+    concurrency: int
+    duration_s: float
+    samples: List[Sample] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, Any]:
+        ok = [s for s in self.samples if s.ok]
+        lat = sorted(s.latency_ms for s in ok)
+        hits = [s for s in ok if s.cache_hit]
+        misses = [s for s in ok if s.cache_hit is False]
+        prompt = [s.prompt_tokens for s in misses if s.prompt_tokens]
+        ks = [s.k for s in misses if s.k is not None]
+        dropped = [s.dropped_chars for s in misses if s.dropped_chars is not None]
+        return {
+            "concurrency": self.concurrency,
+            "requests": len(self.samples),
+            "ok": len(ok),
+            "errors": len(self.samples) - len(ok),
+            "rps": round(len(ok) / self.duration_s, 2) if self.duration_s else 0.0,
+            "p50_ms": _pct(lat, 50),
+            "p95_ms": _pct(lat, 95),
+            "p99_ms": _pct(lat, 99),
+            "max_ms": round(lat[-1], 1) if lat else None,
+            "hit_rate": round(len(hits) / len(ok), 3) if ok else 0.0,
+            "hit_p50_ms": _pct(sorted(s.latency_ms for s in hits), 50),
+            "miss_p50_ms": _pct(sorted(s.latency_ms for s in misses), 50),
+            "avg_prompt_tokens": round(statistics.mean(prompt), 1) if prompt else None,
+            "avg_k": round(statistics.mean(ks), 2) if ks else None,
+            # ~4 ký tự / token (cùng ước lượng với fake_llm)
+            "est_saved_tokens": round(statistics.mean(dropped) / 4, 1) if dropped else None,
+            "feedback_calls": sum(1 for s in self.samples if s.feedback),
+        }
+
+def _pct(sorted_vals: List[float], p: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    idx = min(len(sorted_vals) - 1, max(0, int(round(p / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return round(sorted_vals[idx], 1)
+
+class Workload:
+    def __init__(self, questions: List[str], tokens: List[Optional[str]], repeat_ratio: float,
+                 zipf_s: float, feedback_rate: float, seed: Optional[int] = None):
+        self.questions = questions
+        self.tokens = tokens
+        self.repeat_ratio = repeat_ratio
+        self.feedback_rate = feedback_rate
+        # Zipf weights: câu hỏi thứ i có trọng số 1/i^s
+        self.weights = [1.0 / ((i + 1) ** zipf_s) for i in range(len(questions))]
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next(self) -> tuple[str, Optional[str], bool]:
+        with self._lock:
+            token = self.rng.choice(self.tokens)
+            if self.rng.random() < self.repeat_ratio:
+                q = self.rng.choices(self.questions, weights=self.weights, k=1)[0]
+            else:
+                q = f"{self.rng.choice(self.questions)} (#{uuid.uuid4().hex[:8]})"
+            fb = self.rng.random() < self.feedback_rate
+        return q, token, fb
+
+def _headers(token: Optional[str]) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+def _one_request(sess: requests.Session, args, wl: Workload) -> Sample:
+    q, token, fb = wl.next()
+    body = {
+        "model": args.model,
+        "messages": [{"role": "user", "content": q}],
+        "temperature": 0.2,
+        "max_tokens": args.max_tokens,
+    }
+    t0 = time.perf_counter()
+    try:
+        r = sess.post(f"{args.base_url}/v1/chat/completions", json=body,
+                      headers=_headers(token), timeout=args.timeout)
+    except requests.RequestException:
+        return Sample(ok=False, latency_ms=(time.perf_counter() - t0) * 1000, status=0)
+    lat = (time.perf_counter() - t0) * 1000
+    if r.status_code >= 400:
+        return Sample(ok=False, latency_ms=lat, status=r.status_code)
+
+    data = r.json()
+    meta = data.get("rag_meta") or {}
+    sel = meta.get("k_selection") or {}
+    s = Sample(
+        ok=True,
+        latency_ms=lat,
+        status=r.status_code,
+        cache_hit=bool((meta.get("cache") or {}).get("hit")),
+        prompt_tokens=(data.get("usage") or {}).get("prompt_tokens"),
+        k=meta.get("k"),
+        dropped_chars=sel.get("dropped_chars"),
+    )
+
+    rid = meta.get("request_id")
+    if fb and rid:
+        try:
+            sess.post(f"{args.base_url}{args.feedback_path}", data={"request_id": rid, "reason": "loadtest"},
+                      headers=_headers(token), timeout=args.timeout)
+            s.feedback = True
+        except requests.RequestException:
+            pass
+    return s
+
+def run_step(args, wl: Workload, concurrency: int) -> StepResult:
+    samples: List[Sample] = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + args.duration
+
+    def worker():
+        sess = requests.Session()
+        local: List[Sample] = []
+        while time.perf_counter() < stop_at:
+            local.append(_one_request(sess, args, wl))
+        with lock:
+            samples.extend(local)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return StepResult(concurrency=concurrency, duration_s=time.perf_counter() - t0, samples=samples)
+
+def _fmt(v: Any) -> str:
+    return "-" if v is None else str(v)
+
+def print_table(rows: List[Dict[str, Any]]):
+    cols = ["concurrency", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms",
+            "hit_rate", "hit_p50_ms", "miss_p50_ms", "avg_prompt_tokens", "avg_k", "est_saved_tokens",
+            "feedback_calls"]
+    widths = {c: max(len(c), *(len(_fmt(r.get(c))) for r in rows)) for c in cols}
+    print("  ".join(c.rjust(widths[c]) for c in cols))
+    for r in rows:
+        print("  ".join(_fmt(r.get(c)).rjust(widths[c]) for c in cols))
+
+def print_comparison(rows: List[Dict[str, Any]], baseline: List[Dict[str, Any]]):
+    """So avg_prompt_tokens với một lần chạy trước (vd. adaptive top-k tắt) theo từng concurrency"""
+    base = {b["concurrency"]: b for b in baseline}
+    print("\nconcurrency  baseline_prompt_tokens  prompt_tokens  saved  baseline_k  k")
+    for r in rows:
+        b = base.get(r["concurrency"])
+        if not b or not b.get("avg_prompt_tokens") or not r.get("avg_prompt_tokens"):
+            continue
+        saved = 1 - r["avg_prompt_tokens"] / b["avg_prompt_tokens"]
+        print(f"{r['concurrency']:>11}  {b['avg_prompt_tokens']:>22}  {r['avg_prompt_tokens']:>13}  "
+              f"{saved:>5.1%}  {_fmt(b.get('avg_k')):>10}  {_fmt(r.get('avg_k'))}")
+
+def _load_lines(path: Optional[str]) -> List[str]:
+    if not path:
+        return []
+    return [l.strip() for l in Path(path).read_text(encoding="utf-8").splitlines()
+            if l.strip() and not l.startswith("#")]
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test for RAG /v1/chat/completions")
+    ap.add_argument("--base-url", default="http://localhost:8080")
+    ap.add_argument("--api-key", default=None, help="legacy API key (khi không dùng --tokens-file)")
+    ap.add_argument("--tokens-file", default=None, help="mỗi dòng một Bearer token (mỗi token = một scope)")
+    ap.add_argument("--questions-file", default=None, help="mỗi dòng một câu hỏi")
+    ap.add_argument("--concurrency", default="1,4,16,32", help="danh sách concurrency, vd 1,4,16")
+    ap.add_argument("--duration", type=float, default=30.0, help="số giây cho mỗi bước concurrency")
+    ap.add_argument("--repeat-ratio", type=float, default=0.8, help="tỉ lệ câu hỏi lặp lại (Zipf)")
+    ap.add_argument("--zipf-s", type=float, default=1.1)
+    ap.add_argument("--feedback-rate", type=float, default=0.01, help="tỉ lệ request gửi feedback bad")
+    ap.add_argument("--feedback-path", default="/feedback/bad", help="/api/feedback/bad nếu đi qua nginx")
+    ap.add_argument("--model", default="")
+    ap.add_argument("--max-tokens", type=int, default=512)
+    ap.add_argument("--timeout", type=float, default=180.0)
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--json-out", default=None, help="ghi kết quả ra file JSON")
+    ap.add_argument("--compare", default=None, help="file --json-out của lần chạy trước → in prompt tokens tiết kiệm")
+    args = ap.parse_args()
+    args.base_url = args.base_url.rstrip("/")
+
+    questions = _load_lines(args.questions_file) or DEFAULT_QUESTIONS
+    tokens: List[Optional[str]] = _load_lines(args.tokens_file) or [args.api_key]
+    wl = Workload(questions, tokens, args.repeat_ratio, args.zipf_s, args.feedback_rate, seed=args.seed)
+
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    print(f"[loadtest] target={args.base_url} scopes={len(tokens)} questions={len(questions)} "
+          f"repeat={args.repeat_ratio} feedback={args.feedback_rate} levels={levels} duration={args.duration}s")
+
+    rows = []
+    for c in levels:
+        res = run_step(args, wl, c)
+        row = res.summary()
+        rows.append(row)
+        print(f"[loadtest] c={c} rps={row['rps']} p95={row['p95_ms']}ms hit_rate={row['hit_rate']} errors={row['errors']}")
+
+    print()
+    print_table(rows)
+    if args.compare:
+        print_comparison(rows, json.loads(Path(args.compare).read_text(encoding="utf-8")))
+
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(rows, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n[loadtest] wrote {args.json_out}")
+
+if __name__ == "__main__":
+    main()